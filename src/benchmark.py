@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Load generator and end-to-end benchmark for HyperSim.
+
+Starts a simulator engine on a local port, lets a number of OPC clients
+send frames to it and renders them like hypersim does. The first four leds
+of every strand carry a sequence number and the send time, so the render
+loop measures the latency from OPCclient.put_frames() to the rendered
+frame.
+
+	benchmark.py --opc_xy ../demo_configs/opc/wall.json --channels 4 --clients 2
+	benchmark.py --leds 20000 --fps 0 --render image     # as fast as possible
+	benchmark.py --demo                                   # all demo layouts
+
+Render paths: headless (HyperSimEngine.poll), image (plus Rasterizer and
+PPM, without display) and gui_canvas and gui_image, which run a real
+MainWindow with --renderer canvas or image and time its render loop
+(needs a display). Parse time is measured separately by feeding the same
+frames through an OPCParser.
+"""
+
+import argparse, colorsys, glob, os, struct, sys, time
+from threading import Thread
+
+from engine import HyperSimEngine, parseCmdArgs
+from channelmap import ChannelMap
+from framediff import changed_leds
+from layout import LAYOUT_TYPES, readConfig
+from opcclient import OPCclient
+from opcserver import OPCParser
+from rasterizer import Rasterizer, np
+
+# sequence number and time.monotonic_ns() of sending, in the first 4 leds of every strand
+STAMP = struct.Struct('<IQ')
+STAMP_LEDS = 4
+
+
+# ------------------------------------------------------
+def percentile(values, p):
+	""" p-th percentile of sorted values, 0.0 if there are none """
+	if not values:
+		return 0.0
+	return values[min(len(values)-1, int(p / 100.0 * len(values)))]
+
+
+# ------------------------------------------------------
+def rainbow(leds):
+	""" rgb bytes for twice the number of leds, any slice of leds*3 bytes is a frame """
+	data = bytearray()
+	for i in range(2*leds):
+		data.extend(int(255*c) for c in colorsys.hsv_to_rgb(float(i % leds)/leds, 1.0, 1.0))
+	return data
+
+
+# ======================================================
+class LoadGenerator(Thread):
+	""" OPC client sending stamped frames of leds on channels 1..channels at fps (0: as fast as possible) """
+
+	# ------------------------------------------------------
+	def __init__(self, address, leds, channels=1, fps=60.0):
+		Thread.__init__(self)
+		self.daemon = True
+		self.client = OPCclient(address)
+		self.strand = -(-leds // channels)
+		self.leds = leds
+		self.channels = channels
+		self.fps = fps
+		self.running = False
+		self.sent = 0
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.running = False
+
+	# ------------------------------------------------------
+	def run(self):
+		pattern = rainbow(self.leds)
+		strands = []
+		for c in range(self.channels):
+			size = min(self.strand, self.leds - c*self.strand)
+			strands.append( (c+1, bytearray(size*3)) )
+
+		self.running = True
+		period = 1.0/self.fps if self.fps > 0 else 0.0
+		deadline = time.monotonic()
+		while self.running:
+			shift = (self.sent % self.leds) * 3
+			for c, (channel, data) in enumerate(strands):
+				start = shift + c*self.strand*3
+				data[:] = pattern[start:start+len(data)]
+				STAMP.pack_into(data, 0, self.sent, time.monotonic_ns())
+			if not self.client.put_frames(strands):
+				time.sleep(0.1)
+				continue
+			self.sent += 1
+
+			if period:
+				deadline += period
+				delay = deadline - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				elif delay < -period:
+					deadline = time.monotonic()   # behind: do not send bursts to catch up
+		self.client.disconnect()
+
+
+# ------------------------------------------------------
+def parseTime(leds, channels, count=1000):
+	""" seconds OPCParser needs per message for frames of leds on channels """
+	strand = -(-leds // channels)
+	message = b''
+	for c in range(channels):
+		size = min(strand, leds - c*strand) * 3
+		message += struct.pack('>BBH', c+1, 0, size) + bytes(size)
+
+	parser = OPCParser()
+	messages = 0
+	start = time.perf_counter()
+	for i in range(count):
+		view = parser.free()
+		view[:len(message)] = message
+		parser.commit(len(message))
+		for channel, cmd, data in parser.frames():
+			messages += 1
+	return (time.perf_counter() - start) / messages
+
+
+# ------------------------------------------------------
+def gridLayout(leds, led_size=4):
+	""" led_rects of a square grid, for runs without layout file """
+	columns = max(1, int(leds**0.5))
+	return [ [ (i % columns)*led_size, (i // columns)*led_size, (i % columns + 1)*led_size - 1, (i // columns + 1)*led_size - 1 ] for i in range(leds) ]
+
+
+# ======================================================
+class Probe(object):
+	""" render times and latencies of the frames drawn while measuring """
+
+	# ------------------------------------------------------
+	def __init__(self, engine, generators, channels, strand):
+		self.engine = engine
+		self.generators = generators
+		self.channels = channels
+		self.strand = strand
+		self.render_times = []
+		self.latencies = []
+		self.last_seq = {}
+		self.measuring = False
+
+	# ------------------------------------------------------
+	def begin(self):
+		self.measuring = True
+		self.measure_start = time.monotonic()
+		self.stats_start = self.engine.stats()
+		self.sent_start = sum(g.sent for g in self.generators)
+		self.bytes_start = sum(c.bytes for c in self.engine.opcServer.clients)
+
+	# ------------------------------------------------------
+	def frame(self, seconds):
+		""" a frame was rendered in seconds, its stamps are read from the engine """
+		if not self.measuring:
+			return
+		rendered = time.monotonic_ns()
+		self.render_times.append(seconds)
+		for c in range(self.channels):
+			seq, sent = STAMP.unpack_from(self.engine.led_data, c*self.strand*3)
+			if self.last_seq.get(c) != seq:
+				self.last_seq[c] = seq
+				self.latencies.append((rendered - sent) / 1e9)
+
+	# ------------------------------------------------------
+	def end(self):
+		""" rates, render times and latencies since begin() """
+		elapsed = time.monotonic() - self.measure_start
+		stats = self.engine.stats()
+		sent = sum(g.sent for g in self.generators) - self.sent_start
+		received_bytes = sum(c.bytes for c in self.engine.opcServer.clients) - self.bytes_start
+		render_times = sorted(self.render_times)
+		latencies = sorted(self.latencies)
+		return {
+			'sent_fps': sent / elapsed,
+			'received_fps': (stats['received'] - self.stats_start['received']) / elapsed / self.channels,
+			'rendered_fps': (stats['rendered'] - self.stats_start['rendered']) / elapsed,
+			'dropped': stats['dropped'] - self.stats_start['dropped'],
+			'mbytes_per_s': received_bytes / elapsed / 1e6,
+			'render_p50': percentile(render_times, 50), 'render_p95': percentile(render_times, 95), 'render_p99': percentile(render_times, 99),
+			'latency_p50': percentile(latencies, 50), 'latency_p95': percentile(latencies, 95), 'latency_p99': percentile(latencies, 99),
+		}
+
+
+# ------------------------------------------------------
+def runLoop(engine, probe, led_rects, width, height, render, render_fps, duration, warmup):
+	""" headless and image paths: poll the engine (and rasterize) like the headless mode does """
+	rasterizer = Rasterizer(width, height, led_rects) if render == 'image' else None
+	last_colors = None
+	start = time.monotonic()
+	while True:
+		now = time.monotonic()
+		if not probe.measuring and now - start >= warmup:
+			probe.begin()
+		if probe.measuring and now - probe.measure_start >= duration:
+			return
+
+		t0 = time.perf_counter()
+		colors = engine.poll(now)
+		if colors is not None:
+			if rasterizer is not None:
+				count = min(len(colors) // 3, len(led_rects))
+				changed = changed_leds(colors, last_colors, count)
+				last_colors = colors
+				if changed:
+					rasterizer.draw(colors, None if len(changed) == count else changed)
+					rasterizer.ppm()
+			probe.frame(time.perf_counter() - t0)
+
+		delay = 1.0/render_fps - (time.monotonic() - now) if render_fps > 0 else 0
+		time.sleep(max(0.0005, delay))
+
+
+# ------------------------------------------------------
+def guiArgs(layout_file, layout_type, renderer, port, strand, render_fps):
+	""" hypersim command line of a MainWindow for the gui paths """
+	argv = ['--renderer', renderer, '--port', str(port), '--channels', str(strand), '--fps', str(render_fps if render_fps > 0 else 1000)]
+	if layout_file is not None:
+		argv += ['--'+layout_type, layout_file]
+	return parseCmdArgs(argv)
+
+
+# ------------------------------------------------------
+def runWindow(app, probe, led_rects, width, height, duration, warmup):
+	"""gui paths: a real MainWindow renders in its own after() loop.
+
+	Every pass of renderFrames that drew a frame is timed, including the
+	redraw tk does for it (update_idletasks), so the time covers poll, color
+	correction, the canvas items or image upload and the display update.
+	"""
+	if app.layout_file is None:
+		app.engine.setLeds(led_rects)
+		app.applyLayout(led_rects, width, height)
+
+	drawn = []
+	renderColors, renderFrames = app.renderColors, app.renderFrames
+	def timedColors(colors):
+		renderColors(colors)
+		drawn.append(True)
+	def timedFrames():
+		del drawn[:]
+		t0 = time.perf_counter()
+		renderFrames()
+		if drawn:
+			app.update_idletasks()
+			probe.frame(time.perf_counter() - t0)
+	# renderFrames reschedules itself through the instance, so the wrappers stay in the loop
+	app.renderColors, app.renderFrames = timedColors, timedFrames
+
+	app.after(int(warmup*1000), probe.begin)
+	app.after(int((warmup + duration)*1000), app.quit)
+	app.mainloop()
+
+
+# ------------------------------------------------------
+def benchmark(layout_file=None, layout_type=None, leds=None, channels=1, clients=1, fps=60.0, render='headless', render_fps=60.0, duration=5.0, warmup=1.0, port=17890):
+	"""Run one benchmark, returns a dict of results.
+
+	Times are in seconds. leds defaults to the number of leds in the layout.
+	render is headless, image (Rasterizer without display) or gui_canvas and
+	gui_image (a MainWindow with --renderer canvas or image, needs a display).
+	"""
+	if layout_file is not None:
+		led_rects, width, height = readConfig(layout_file, layout_type)
+	else:
+		led_rects = gridLayout(leds)
+		width = max(r[2] for r in led_rects) + 1
+		height = max(r[3] for r in led_rects) + 1
+	leds = leds or len(led_rects)
+	if leds // channels < STAMP_LEDS:
+		raise ValueError("%d leds are too few for %d channels" % (leds, channels))
+	strand = -(-leds // channels)
+
+	app = None
+	if render.startswith('gui_'):
+		import tkinter as tk
+		from mainwindow import MainWindow
+
+		root = tk.Tk()
+		app = MainWindow(parent=root, args=guiArgs(layout_file, layout_type, render[4:], port, strand, render_fps))
+		engine = app.engine
+	else:
+		engine = HyperSimEngine(port=port, channels=ChannelMap(strand_size=strand), host='127.0.0.1')
+		engine.setLeds(led_rects)
+		engine.start()
+
+	generators = [ LoadGenerator('127.0.0.1:%d' % port, leds, channels, fps) for i in range(clients) ]
+	for generator in generators:
+		generator.start()
+
+	probe = Probe(engine, generators, channels, strand)
+	try:
+		if app is not None:
+			runWindow(app, probe, led_rects, width, height, duration, warmup)
+		else:
+			runLoop(engine, probe, led_rects, width, height, render, render_fps, duration, warmup)
+		result = probe.end()
+	finally:
+		for generator in generators:
+			generator.stop()
+		for generator in generators:
+			generator.join()
+		if app is not None:
+			app.on_close()
+		else:
+			engine.stop()
+
+	result.update({
+		'layout': os.path.basename(layout_file) if layout_file else 'grid',
+		'leds': leds, 'channels': channels, 'clients': clients, 'fps': fps, 'render': render,
+		'parse': parseTime(leds, channels),
+	})
+	return result
+
+
+RESULT_HEADER = "%-36s %6s %3s %3s %-10s %8s %8s %7s %9s %23s %23s" % ('layout', 'leds', 'ch', 'cl', 'render',
+	'sent fps', 'recv fps', 'MB/s', 'parse us', 'render ms p50/p95/p99', 'latency ms p50/p95/p99')
+
+# ------------------------------------------------------
+def formatResult(r):
+	return "%-36s %6d %3d %3d %-10s %8.1f %8.1f %7.2f %9.1f %7.2f/%7.2f/%7.2f %7.2f/%7.2f/%7.2f" % (r['layout'], r['leds'], r['channels'], r['clients'], r['render'],
+		r['sent_fps'], r['received_fps'], r['mbytes_per_s'], r['parse']*1e6,
+		r['render_p50']*1e3, r['render_p95']*1e3, r['render_p99']*1e3, r['latency_p50']*1e3, r['latency_p95']*1e3, r['latency_p99']*1e3)
+
+
+# ------------------------------------------------------
+def demoLayouts(base=None):
+	""" (file, type) of all layouts in demo_configs """
+	base = base or os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'demo_configs')
+	layouts  = [ (f, 'hyperion') for f in sorted(glob.glob(os.path.join(base, 'hyperion', '*.json'))) ]
+	layouts += [ (f, 'opc_xy') for f in sorted(glob.glob(os.path.join(base, 'opc', '*.json'))) ]
+	return layouts
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Load generator and latency benchmark for HyperSim.', prog='benchmark.py')
+	group = parser.add_mutually_exclusive_group()
+	for layout_type in LAYOUT_TYPES:
+		group.add_argument('--'+layout_type, default=None, metavar="<file>", help='%s layout' % layout_type)
+	group.add_argument('--demo', default=False, action='store_true', help='run on all layouts in demo_configs')
+	parser.add_argument('--leds', default=None, type=int, metavar="<count>", help='leds per frame (default: all leds of the layout, 1000 without layout)')
+	parser.add_argument('--channels', default=1, type=int, metavar="<count>", help='strands per frame, sent on channels 1..count (default: 1)')
+	parser.add_argument('--clients', default=1, type=int, metavar="<count>", help='concurrent clients (default: 1)')
+	parser.add_argument('--fps', default=60.0, type=float, metavar="<rate>", help='frames per second of each client, 0 for as fast as possible (default: 60)')
+	parser.add_argument('--render', default='headless', choices=['headless', 'image', 'gui_canvas', 'gui_image'], help='render path (default: headless)')
+	parser.add_argument('--render_fps', default=60.0, type=float, metavar="<rate>", help='refresh rate of the render loop (default: 60)')
+	parser.add_argument('--duration', default=5.0, type=float, metavar="<seconds>", help='measured time per run (default: 5)')
+	parser.add_argument('--port', default=17890, type=int, metavar="<port>", help='port of the benchmarked server (default: 17890)')
+	args = parser.parse_args()
+
+	runs = []
+	if args.demo:
+		runs = demoLayouts()
+	else:
+		for layout_type in LAYOUT_TYPES:
+			if getattr(args, layout_type) is not None:
+				runs = [ (getattr(args, layout_type), layout_type) ]
+		if not runs:
+			runs = [ (None, None) ]
+			args.leds = args.leds or 1000
+
+	print("python %s, %s" % (sys.version.split()[0], "numpy" if np is not None else "no numpy"))
+	print(RESULT_HEADER)
+	for layout_file, layout_type in runs:
+		try:
+			result = benchmark(layout_file, layout_type, args.leds, args.channels, args.clients, args.fps, args.render, args.render_fps, args.duration, port=args.port)
+		except Exception as e:
+			print("%-36s %s" % (os.path.basename(layout_file or 'grid'), e))
+			continue
+		print(formatResult(result))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+class ChannelMap(object):
+	"""Maps OPC channels to ranges of leds in the layout.
+
+	Channel 0 is the broadcast channel and always addresses the whole layout
+	starting at led 0, the way a Fadecandy spreads channel 0 over all of its
+	strands. Without a map every channel addresses the layout from led 0.
+
+	A map is either a strand size (channel n starts at led (n-1)*size) or a
+	set of explicit ranges, see parse(). Frames for channels outside an
+	explicit map are ignored.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, ranges=None, strand_size=None):
+		self.ranges = dict(ranges or {})
+		self.strand_size = strand_size
+
+	# ------------------------------------------------------
+	@staticmethod
+	def parse(spec):
+		"""Create a map from a command line spec.
+
+		'64'              every channel is a strand of 64 leds
+		'1:0-63,2:64-99'  channel: first led - last led (inclusive)
+		"""
+		if spec is None or spec.strip() == '':
+			return ChannelMap()
+
+		if spec.strip().isdigit():
+			return ChannelMap(strand_size=int(spec))
+
+		ranges = {}
+		for item in spec.split(','):
+			try:
+				channel, leds = item.split(':')
+				first, last = leds.split('-')
+				channel, first, last = int(channel), int(first), int(last)
+			except ValueError:
+				raise ValueError("invalid channel range '%s', expected <channel>:<first led>-<last led>" % item.strip())
+			if not 1 <= channel <= 255 or last < first:
+				raise ValueError("invalid channel range '%s'" % item.strip())
+			ranges[channel] = (first, last - first + 1)
+		return ChannelMap(ranges)
+
+	# ------------------------------------------------------
+	def range(self, channel):
+		""" return (first led, led count) of a channel, count is None for 'up to the end' """
+		if channel == 0:
+			return 0, None
+		if self.strand_size:
+			return (channel-1) * self.strand_size, self.strand_size
+		if self.ranges:
+			return self.ranges.get(channel, (None, None))
+		return 0, None
+
+	# ------------------------------------------------------
+	def merge(self, led_data, frames):
+		"""Write per channel frames ({channel: rgb bytes}) into led_data.
+
+		led_data is a bytearray with the colors of the whole layout, broadcast
+		frames are applied first so strands can override them.
+		"""
+		size = len(led_data)
+		for channel in sorted(frames):
+			first, count = self.range(channel)
+			if first is None:
+				continue
+
+			data = frames[channel]
+			start = first * 3
+			end = size if count is None else min(size, start + count*3)
+			length = min(len(data), end - start)
+			if length > 0:
+				led_data[start:start+length] = data[:length]
+		return led_data
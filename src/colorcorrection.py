@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class ColorCorrection(object):
+	"""Fadecandy style color correction of rgb frames.
+
+	The settings are those of the fadecandy 'color' json object:
+		gamma        : exponent, a number or one per channel [r, g, b]
+		whitepoint   : brightness per channel [r, g, b]
+		linearSlope  : slope of the linear part near black
+		linearCutoff : input level where the linear part ends
+
+	They are turned into a lookup table with 256 entries per channel, which
+	apply() uses on whole frames at once: numpy.take_along_axis when NumPy is
+	installed, bytes.translate on every color plane otherwise.
+	"""
+	KEYS = ('gamma', 'whitepoint', 'linearSlope', 'linearCutoff')
+
+	# ------------------------------------------------------
+	def __init__(self, gamma=1.0, whitepoint=(1.0,1.0,1.0), linearSlope=1.0, linearCutoff=0.0):
+		self.settings = {}
+		self.update({'gamma': gamma, 'whitepoint': whitepoint, 'linearSlope': linearSlope, 'linearCutoff': linearCutoff})
+
+	# ------------------------------------------------------
+	def update(self, settings):
+		"""Change some or all settings, unknown keys are ignored.
+
+		Raises ValueError on invalid values and keeps the old settings then.
+		"""
+		new = dict(self.settings)
+		new.update( (k, settings[k]) for k in ColorCorrection.KEYS if k in settings )
+		try:
+			gamma = new['gamma']
+			gamma = [ float(g) for g in gamma ] if isinstance(gamma, (list, tuple)) else 3 * [float(gamma)]
+			whitepoint = [ float(w) for w in new['whitepoint'] ]
+			slope, cutoff = float(new['linearSlope']), float(new['linearCutoff'])
+		except (TypeError, ValueError):
+			raise ValueError("invalid color correction %s" % settings)
+		if len(gamma) != 3 or len(whitepoint) != 3 or min(gamma) <= 0:
+			raise ValueError("invalid color correction %s" % settings)
+
+		lut = tuple( bytes( self._correct(i / 255.0, gamma[c], whitepoint[c], slope, cutoff) for i in range(256) ) for c in range(3) )
+
+		# swap in one go, the render loop may be using the old tables
+		self.settings = new
+		self.lut = lut
+		self.lut_array = np.frombuffer(b''.join(lut), np.uint8).reshape(3,256).T.copy() if np is not None else None
+
+	# ------------------------------------------------------
+	@staticmethod
+	def _correct(value, gamma, whitepoint, slope, cutoff):
+		""" the curve fcserver uses for its firmware lookup tables """
+		value *= whitepoint
+		if value * slope <= cutoff:
+			out = value * slope
+		else:
+			scale = 1.0 - cutoff
+			base = max(0.0, value - slope * cutoff) / scale if scale > 0 else 1.0
+			out = cutoff + (base ** gamma) * scale
+		return int(round(min(1.0, max(0.0, out)) * 255))
+
+	# ------------------------------------------------------
+	def apply(self, data):
+		""" return the corrected colors of a flat buffer of rgb bytes """
+		size = len(data) - len(data) % 3
+		if self.lut_array is not None:
+			rgb = np.frombuffer(data, np.uint8, size).reshape(-1,3)
+			return np.take_along_axis(self.lut_array, rgb, axis=0).tobytes()
+
+		data = bytes(data[:size])
+		out = bytearray(size)
+		for c in range(3):
+			out[c::3] = data[c::3].translate(self.lut[c])
+		return out
+
+	# ------------------------------------------------------
+	@staticmethod
+	def hexColors(colors):
+		""" tk color strings ('#rrggbb') of all leds in a flat buffer of rgb bytes """
+		h = colors.hex()
+		return [ '#' + h[i:i+6] for i in range(0, len(h), 6) ]
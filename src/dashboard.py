@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import math, time
+import tkinter as tk
+
+
+class Dashboard(tk.Frame):
+	"""Tiles of all workers of a RenderFarm.
+
+	Every tile shows the image a worker wrote into its shared memory slot and
+	a caption with its layout, port and statistics. The window only copies
+	frames whose sequence number changed, drawing stays in the workers.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, parent, farm, columns=None, fps=60):
+		tk.Frame.__init__(self, parent)
+		self.parent = parent
+		self.farm = farm
+		self.fps = fps
+		self.parent.title("HyperSim render farm")
+		self.pack(fill=tk.BOTH, expand=1)
+		self.bind_all("<Control-q>", self.on_close)
+
+		columns = columns or int(math.ceil(math.sqrt(len(farm.workers))))
+		self.tiles = []
+		for idx, worker in enumerate(farm.workers):
+			slot = worker['slot']
+			frame = tk.Frame(self, bd=1, relief=tk.SUNKEN)
+			frame.grid(row=idx // columns, column=idx % columns, padx=2, pady=2, sticky=tk.N)
+			photo = tk.PhotoImage(width=slot.width, height=slot.height)
+			tk.Label(frame, image=photo).pack()
+			caption = tk.StringVar()
+			tk.Label(frame, textvariable=caption, anchor=tk.W).pack(fill=tk.X)
+			self.tiles.append({'worker': worker, 'photo': photo, 'caption': caption, 'seq': None, 'header': b'P6 %d %d 255 ' % (slot.width, slot.height)})
+
+		self.stats_time = time.monotonic()
+		self.stats_last = {}
+		self.render_job = self.after(0, self.renderFrames)
+
+	# ------------------------------------------------------
+	def on_close(self, event=None):
+		self.after_cancel(self.render_job)
+		self.parent.destroy()
+
+	# ------------------------------------------------------
+	def renderFrames(self):
+		start = time.monotonic()
+		for tile in self.tiles:
+			frame = tile['worker']['slot'].read(tile['seq'])
+			if frame is None:
+				continue
+			tile['seq'], rgb, tile['stats'] = frame
+			tile['photo'].configure(data=tile['header'] + rgb, format='PPM')
+
+		if start - self.stats_time >= 1.0:
+			self.updateStats(start)
+
+		delay = 1.0/self.fps - (time.monotonic() - start)
+		self.render_job = self.after(max(1, int(delay*1000)), self.renderFrames)
+
+	# ------------------------------------------------------
+	def updateStats(self, now):
+		elapsed = now - self.stats_time
+		for tile in self.tiles:
+			worker = tile['worker']
+			process = worker['process']
+			stats = tile.get('stats', {})
+			rendered = stats.get('rendered', 0)
+			if process.is_alive():
+				state = "clients %d | %.1f fps | dropped %d" % (stats.get('clients', 0), (rendered - self.stats_last.get(worker['port'], 0)) / elapsed, stats.get('dropped', 0))
+			else:
+				state = "exited (%s)" % process.exitcode
+			tile['caption'].set("%s\n%s" % (self.farm.label(worker), state))
+			self.stats_last[worker['port']] = rendered
+		self.stats_time = now
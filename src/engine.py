@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+import json, time, argparse, os
+
+from opcserver import OPCserver, FrameMailbox
+from opctransport import OPCudpServer, OPCwebSocketServer
+from channelmap import ChannelMap
+from colorcorrection import ColorCorrection
+from interpolator import Interpolator
+from layout import LAYOUT_TYPES, readConfig, loadGeometry
+from recorder import FrameRecorder
+from replay import StreamDumper, OPCreplay, openCapture, parseSpeed
+from perfstats import PerfStats, PerfExporter, summary
+from grabber import ImageGrabber, openReader
+from forwarder import Forwarder, parseTarget
+
+
+class HyperSimEngine(object):
+	"""The simulator without any display.
+
+	Runs the OPC receivers, loads the layout and keeps the current frame:
+	pending channel frames are merged, color corrected and, if enabled,
+	interpolated. The GUI draws what poll() returns, the headless mode just
+	keeps polling. With port None no OPC server listens, messages are then
+	passed to opcServer.process(), like offlinerender does with captures.
+	Usable as a library:
+
+		engine = HyperSimEngine(port=7890)
+		engine.loadLayout('wall.json', 'opc_xy')
+		engine.start()
+		while True:
+			colors = engine.poll()   # rgb bytes or None if nothing changed
+			...
+		engine.stop()
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, port=7890, udp_port=None, ws_port=None, merge='latest', priorities=None, channels=None, color=None, interpolate=False, host='0.0.0.0', record=None, dump=None, replay=None, perf=False, perf_file=None, perf_port=None, perf_host='127.0.0.1', grab=None, forward=None):
+		self.mailbox = FrameMailbox()
+		# stage timers, switchable at runtime, always on while exported
+		self.perf = PerfStats(enabled=perf or perf_file is not None or perf_port is not None)
+		self.channels = channels if channels is not None else ChannelMap()
+		self.colorCorrection = ColorCorrection(gamma=1.3)
+		if color is not None:
+			self.colorCorrection.update(color)
+		self.interpolator = Interpolator() if interpolate else None
+		self.redraw = False
+
+		self.layout_file = None
+		self.layout_type = None
+		self.led_rects = []
+		self.led_data = b''
+		self.colors = b''
+
+		self.opcServer = OPCserver(self.mailbox.post, self.setColorCorrection, HOST=host, PORT=port, merge=merge, priorities=priorities, fw_func=self.setFirmwareConfig, perf=self.perf)
+		self.recorder = None
+		if record is not None:
+			self.recorder = FrameRecorder(record)
+			self.opcServer.addListener(self.recorder)
+		self.dumper = None
+		if dump is not None:
+			self.dumper = StreamDumper(dump)
+			self.opcServer.addListener(self.dumper)
+		# forward is a list of ForwardTarget, they get the frames the merge policy accepted and all sysEx
+		self.forwarder = None
+		if forward:
+			self.forwarder = Forwarder(forward)
+			self.opcServer.addListener(self.forwarder, merged=True)
+
+		# replay is (capture, speed, loop), its messages take the same path as received ones
+		self.replay = None
+		if replay is not None:
+			capture, speed, loop = replay
+			client = self.opcServer.connect(('replay', 0))
+			self.replay = OPCreplay(capture, lambda channel, cmd, data: self.opcServer.process(client, channel, cmd, data), speed, loop=loop)
+
+		# grab is (reader, fps), the led colors of the images are sent like a client would
+		self.grabber = None
+		if grab is not None:
+			reader, fps = grab
+			client = self.opcServer.connect(('grabber', 0))
+			self.grabber = ImageGrabber(reader, self.grabGeometry, lambda channel, cmd, data: self.opcServer.process(client, channel, cmd, data), fps)
+
+		self.exporter = None
+		if perf_file is not None or perf_port is not None:
+			self.exporter = PerfExporter(self.perf, perf_file, perf_port, extra=self.stats, host=perf_host)
+
+		self.transports = []
+		if udp_port is not None:
+			self.transports.append(OPCudpServer(self.opcServer, HOST=host, PORT=udp_port))
+		if ws_port is not None:
+			self.transports.append(OPCwebSocketServer(self.opcServer, HOST=host, PORT=ws_port))
+
+	# ------------------------------------------------------
+	@staticmethod
+	def fromArgs(args):
+		return HyperSimEngine(port=args.port, udp_port=args.udp_port, ws_port=args.ws_port, merge=args.merge,
+			priorities=args.priorities, channels=args.channel_map, color=args.color_settings, interpolate=args.interpolate, record=args.record,
+			dump=args.dump, replay=args.replay_capture, perf=args.perf, perf_file=args.perf_file, perf_port=args.perf_port, perf_host=args.perf_host, grab=args.grab_source, forward=args.forward_targets)
+
+	# ------------------------------------------------------
+	def start(self):
+		self.opcServer.start()
+		for transport in self.transports:
+			transport.start()
+		if self.forwarder is not None:
+			self.forwarder.start()
+		if self.replay is not None:
+			self.replay.start()
+		if self.grabber is not None:
+			self.grabber.start()
+		if self.exporter is not None:
+			self.exporter.start()
+
+	# ------------------------------------------------------
+	def stop(self):
+		if self.replay is not None:
+			self.replay.stop()
+			self.replay.join()
+			print(self.replay.summary())
+		if self.grabber is not None:
+			self.grabber.stop()
+			self.grabber.join()
+			print(self.grabber.summary())
+		if self.exporter is not None:
+			self.exporter.stop()
+		for transport in self.transports:
+			transport.stop()
+		self.opcServer.stop()
+		self.opcServer.join()
+		if self.forwarder is not None:
+			self.forwarder.stop()
+			for target in self.forwarder.targets:
+				print("forward %s" % target.summary())
+		if self.recorder is not None:
+			self.recorder.close()
+		if self.dumper is not None:
+			self.dumper.close()
+
+	# ------------------------------------------------------
+	def loadLayout(self, layout_file, layout_type="hyperion", win_width=800, win_height=600, led_size=15):
+		""" read a layout, returns (led_rects, win_width, win_height), see layout.readConfig """
+		led_rects, win_width, win_height = readConfig(layout_file, layout_type, win_width, win_height, led_size)
+		self.layout_file = layout_file
+		self.layout_type = layout_type
+		self.setLeds(led_rects)
+		return led_rects, win_width, win_height
+
+	# ------------------------------------------------------
+	def grabGeometry(self):
+		""" geometry of the current layout for the grabber, None unless it is a hyperion layout """
+		if self.layout_type != 'hyperion':
+			return None
+		try:
+			return loadGeometry(self.layout_file, 'hyperion')
+		except Exception:
+			# the file is being written, keep going with the next frame
+			return None
+
+	# ------------------------------------------------------
+	def setLeds(self, led_rects):
+		self.led_rects = led_rects
+		size = len(led_rects)*3
+		self.led_data = self.led_data[:size].ljust(size, b'\0')
+		self.redraw = True
+
+	# ------------------------------------------------------
+	def setFrame(self, led_data, now=None):
+		""" make led_data (flat rgb bytes) the current frame, returns the colors to display """
+		timed = self.perf.enabled
+		if timed:
+			start = time.perf_counter()
+		self.led_data = bytes(led_data)
+		count = min(len(self.led_data) // 3, len(self.led_rects))
+		colors = self.colorCorrection.apply(self.led_data[:count*3])
+
+		if self.interpolator is not None:
+			now = time.monotonic() if now is None else now
+			self.interpolator.keyframe(colors, now)
+			colors = self.interpolator.frame(now)
+		self.colors = colors
+		if timed:
+			self.perf.add('clut', time.perf_counter() - start, count*3)
+		return colors
+
+	# ------------------------------------------------------
+	def poll(self, now=None):
+		""" take pending frames, returns the colors to display or None if nothing changed """
+		now = time.monotonic() if now is None else now
+		frames = self.mailbox.take()
+		if frames:
+			# merge all channels into the current frame, which also applies a new color correction
+			self.redraw = False
+			led_data = self.channels.merge(bytearray(self.led_data), frames)
+			return self.setFrame(led_data, now)
+
+		if self.redraw:
+			self.redraw = False
+			return self.setFrame(self.led_data, now)
+
+		if self.interpolator is not None and self.interpolator.active(now):
+			self.colors = self.interpolator.frame(now)
+			return self.colors
+		return None
+
+	# ------------------------------------------------------
+	def stats(self):
+		stats = self.mailbox.stats()
+		stats['clients'] = len(self.opcServer.clients)
+		return stats
+
+	# ------------------------------------------------------
+	def setColorCorrection(self, settings):
+		# called from the server thread, the next poll() does the redraw
+		self.colorCorrection.update(settings)
+		self.redraw = True
+
+	# ------------------------------------------------------
+	def setFirmwareConfig(self, flags):
+		# called from the server thread
+		if self.interpolator is not None:
+			self.interpolator.setFlags(flags)
+
+	# ------------------------------------------------------
+	def run(self, fps=60, stats_interval=10):
+		""" keep the frame state up to date until interrupted, prints statistics """
+		last = self.stats()
+		last_perf = self.perf.snapshot()
+		last_time = time.monotonic()
+		try:
+			while True:
+				start = time.monotonic()
+				self.poll(start)
+				if start - last_time >= stats_interval:
+					stats = self.stats()
+					print("clients %d | in %.1f fps | out %.1f fps | dropped %d" % (stats['clients'],
+						(stats['received'] - last['received']) / (start - last_time),
+						(stats['rendered'] - last['rendered']) / (start - last_time), stats['dropped']) )
+					if self.perf.enabled:
+						perf = self.perf.snapshot()
+						print(summary(perf, last_perf))
+						last_perf = perf
+					if self.forwarder is not None:
+						for target in self.forwarder.targets:
+							print("  forward %s" % target.summary())
+					last, last_time = stats, start
+				time.sleep(max(0.001, 1.0/fps - (time.monotonic() - start)))
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.stop()
+
+
+# ------------------------------------------------------
+def parseCmdArgs(argv=None):
+	parser = argparse.ArgumentParser(description='Simulator for hyperion.', prog='hypersim')
+	group = parser.add_mutually_exclusive_group()
+	group2 = parser.add_mutually_exclusive_group()
+
+	parser.add_argument('-n','--num', dest='show_numbers', action='store_true', help='show led IDs')
+	group2.add_argument('-c','--circle', dest='draw_type', action='store_const',const="circle",  help='draw led as circle/oval')
+	group2.add_argument('-r','--rect', dest='draw_type',   action='store_const',const="rect", help='draw led as rect (default)')
+	parser.add_argument('--renderer', default='canvas', choices=['canvas','image'], help='draw leds as canvas items (default) or into a single image, which is faster for large layouts')
+	group.add_argument('--hyperion', default=None, metavar="<file>", help='hyperion config')
+	group.add_argument('--opc_xy'  , default=None, metavar="<file>", help='opc config xy components')
+	group.add_argument('--opc_yz'  , default=None, metavar="<file>", help='opc config yz components')
+	group.add_argument('--opc_xz'  , default=None, metavar="<file>", help='opc config xz components')
+	group.add_argument('--opc_3d'  , default=None, metavar="<file>", help='opc config, 3d view (drag to rotate, wheel to zoom)')
+	parser.add_argument('--led_size', default=15, metavar="<pixel>", type=int, help='pixel size of a single led (default: 15)')
+	parser.add_argument('--port', default=7890, metavar="<port>", type=int, help='set port of OPC-server (default: 7890)')
+	parser.add_argument('--udp_port', default=None, metavar="<port>", type=int, help='also receive OPC datagrams on this udp port')
+	parser.add_argument('--ws_port', default=None, metavar="<port>", type=int, help='also receive OPC over WebSocket on this port')
+	parser.add_argument('--merge', default='latest', choices=OPCserver.MERGE_POLICIES, help='how frames of concurrent clients are combined (default: latest)')
+	parser.add_argument('--priority', default=[], action='append', metavar="<host>[:<port>]=<prio>", help='priority of a client host, or of the connection from host:port, for --merge priority, can be repeated')
+	parser.add_argument('--channels', default=None, metavar="<map>", help='map OPC channels to leds: strand size (e.g. 64) or ranges (e.g. 1:0-63,2:64-127). channel 0 addresses all leds')
+	parser.add_argument('--color', default=None, metavar="<file>", help='fadecandy color correction json (fcserver config or its "color" object)')
+	parser.add_argument('--interpolate', default=False, action='store_true', help='fade between frames and dither like the fadecandy firmware, clients can switch it off')
+	parser.add_argument('--fps', default=60, metavar="<rate>", type=float, help='maximum refresh rate of the leds (default: 60)')
+	parser.add_argument('-w','--wide', dest='wideScreen', default=False, action='store_true', help='set to 16:9 format')
+	parser.add_argument('--record', default=None, metavar="<file>", help='record all received OPC messages to a capture file (plus <file>.idx)')
+	parser.add_argument('--dump', default=None, metavar="<file>", help='write all received OPC messages to a raw OPC stream file')
+	parser.add_argument('--replay', default=None, metavar="<file>", help='play a raw OPC stream or a --record capture as if a client sent it')
+	parser.add_argument('--replay_speed', default='1', metavar="<x|max|step>", help='replay speed: factor of real time, max or step (key "." or enter) (default: 1)')
+	parser.add_argument('--replay_fps', default=60, metavar="<rate>", type=float, help='frame rate for replaying raw OPC streams (default: 60)')
+	parser.add_argument('--replay_loop', default=False, action='store_true', help='replay forever')
+	parser.add_argument('--grab', default=None, metavar="<file>", help='show the led colors of a PPM stream or raw rgb24 video (- for stdin), like a hyperion grabber')
+	parser.add_argument('--grab_size', default=None, metavar="<w>x<h>", help='frame size of raw rgb24 for --grab, PPM otherwise')
+	parser.add_argument('--grab_fps', default=30, metavar="<rate>", type=float, help='frame rate of --grab, 0 for as fast as possible (default: 30)')
+	parser.add_argument('--forward', default=[], action='append', metavar="<host>:<port>[,fps=<rate>][,map=<from>:<to>/...][,udp]", help='relay the frames shown and all sysEx messages to another OPC server, at most fps frames per second, with channels mapped, can be repeated')
+	parser.add_argument('--headless', default=False, action='store_true', help='run without window, e.g. on servers or for load tests')
+	parser.add_argument('--perf', default=False, action='store_true', help='time receiving, parsing, color correction and drawing (key "p")')
+	parser.add_argument('--perf_file', default=None, metavar="<file>", help='write the timings every second, as JSON for *.json, else as Prometheus text')
+	parser.add_argument('--perf_port', default=None, metavar="<port>", type=int, help='serve the timings on http://localhost:<port>/metrics and /stats.json')
+	parser.add_argument('--perf_host', default='127.0.0.1', metavar="<host>", help='address to serve the timings on, 0.0.0.0 for all interfaces (default: 127.0.0.1)')
+
+	args = parser.parse_args(argv)
+
+	args.draw_type = 'rect' if args.draw_type is None else args.draw_type
+	args.fps = max(1.0, args.fps)
+
+	args.color_settings = None
+	if args.color is not None:
+		try:
+			with open(args.color) as color_file:
+				color = json.load(color_file)
+			args.color_settings = color.get('color', color)
+			ColorCorrection().update(args.color_settings)
+		except (OSError, ValueError, AttributeError) as e:
+			parser.error("could not read color correction '%s': %s" % (args.color, e))
+
+	args.priorities = {}
+	for item in args.priority:
+		host, _, prio = item.rpartition('=')
+		if not host or not prio.lstrip('-').isdigit():
+			parser.error("invalid priority '%s', expected <host>[:<port>]=<prio>" % item)
+		args.priorities[host] = int(prio)
+
+	try:
+		args.channel_map = ChannelMap.parse(args.channels)
+	except ValueError as e:
+		parser.error(str(e))
+
+	args.replay_capture = None
+	if args.replay is not None:
+		try:
+			speed = parseSpeed(args.replay_speed)
+			args.replay_capture = (openCapture(args.replay, max(1.0, args.replay_fps)), speed, args.replay_loop)
+		except (OSError, ValueError) as e:
+			parser.error("could not replay '%s': %s" % (args.replay, e))
+
+	args.grab_source = None
+	if args.grab is not None:
+		if args.hyperion is None:
+			parser.error("--grab needs a --hyperion layout")
+		try:
+			args.grab_source = (openReader(args.grab, args.grab_size), max(0.0, args.grab_fps))
+		except (OSError, ValueError) as e:
+			parser.error("could not grab '%s': %s" % (args.grab, e))
+
+	try:
+		args.forward_targets = [ parseTarget(spec) for spec in args.forward ]
+	except ValueError as e:
+		parser.error(str(e))
+
+	args.layout_file = None
+	args.layout_type = None
+	for k in LAYOUT_TYPES:
+		if getattr(args, k) is not None:
+			args.layout_file = os.path.realpath( getattr(args, k) )
+			args.layout_type = k
+			if not os.path.exists(args.layout_file):
+				print("could not read ", args.layout_file)
+				exit(1)
+			break
+
+	return args
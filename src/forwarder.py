@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""Forwarding of received OPC messages to other OPC servers.
+
+With hypersim --forward the simulator sits between a client and the real
+hardware: everything clients send is shown and relayed, e.g.
+
+	hypersim --hyperion hyperion.config.json --port 7890 \\
+		--forward 192.168.1.20:7890,fps=60 --forward 192.168.1.21:7890,map=1:0/2:1
+
+The Forwarder is a merged listener of the OPCserver: it gets the frames
+the merge policy accepted, so the hardware shows what the simulator shows
+(replayed and grabbed frames included), and every other message, e.g.
+color correction, unconditionally. The payload is copied once and shared
+by all targets, a target only packs its own 4 byte header (with the
+remapped channel) and sends header and payload with one scatter-gather
+send.
+
+Every target has its own queue and thread, a slow or unreachable target
+never delays the simulator or the other targets. Messages are sent in the
+order they were received. Like the FrameMailbox the queue keeps the newest
+frame per channel, a waiting frame is replaced by a newer one of its
+channel unless another message (sysEx, e.g. color correction) was queued
+in between, so a target running at its fps cap stays current instead of
+falling behind. sysEx messages are never dropped. Targets with the same
+address share one persistent connection.
+"""
+
+import struct, time
+from threading import Thread, Condition, Lock
+
+from opcclient import OPCclient
+
+OPC_HEADER = struct.Struct('>BBH')
+
+# seconds between connection attempts to a target that is down
+RECONNECT_DELAY = 1.0
+
+
+# ======================================================
+class PooledClient(object):
+	""" one persistent OPCclient per address, shared by the targets sending to it """
+
+	_pool = {}
+	_pool_lock = Lock()
+
+	# ------------------------------------------------------
+	def __init__(self, address, udp=False):
+		self.client = OPCclient(address, long_connection=True, udp=udp)
+		self.lock = Lock()
+		self.retry_time = 0.0
+		self.users = 0
+
+	# ------------------------------------------------------
+	@staticmethod
+	def get(address, udp=False):
+		with PooledClient._pool_lock:
+			key = (address, udp)
+			pooled = PooledClient._pool.get(key)
+			if pooled is None:
+				pooled = PooledClient._pool[key] = PooledClient(address, udp)
+			pooled.users += 1
+			return pooled
+
+	# ------------------------------------------------------
+	def release(self):
+		with PooledClient._pool_lock:
+			self.users -= 1
+			if self.users == 0:
+				for key, pooled in list(PooledClient._pool.items()):
+					if pooled is self:
+						del PooledClient._pool[key]
+				with self.lock:
+					self.client.disconnect()
+
+	# ------------------------------------------------------
+	def send(self, buffers, now):
+		""" send buffers holding complete OPC messages, False if the target is not reachable """
+		with self.lock:
+			if not self.client.connected:
+				if now < self.retry_time:
+					return False
+				if not self.client.connect():
+					self.retry_time = now + RECONNECT_DELAY
+					return False
+			if not self.client.send_buffers(buffers):
+				self.retry_time = now + RECONNECT_DELAY
+				return False
+			return True
+
+
+# ======================================================
+class ForwardTarget(Thread):
+	"""Sends the messages queued by put() to one OPC server.
+
+	fps caps the rate of pixel frames (0: as they come), channel_map maps
+	received channels to the channels sent, others keep their channel.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, address, fps=0.0, channel_map=None, udp=False):
+		Thread.__init__(self)
+		self.daemon = True
+		self.address = address
+		self.fps = fps
+		self.channel_map = dict(channel_map or {})
+		self.pooled = PooledClient.get(address, udp)
+		self._cond = Condition()
+		# messages in order, _latest: channel -> index of its frame at the end of the queue
+		self._queue = []
+		self._latest = {}
+		self._stopping = False
+		self.headers = bytearray(OPC_HEADER.size * 256)
+		self.header_view = memoryview(self.headers)
+
+		self.queued = 0
+		self.sent = 0
+		self.dropped = 0
+		self.failed = 0
+		self.bytes = 0
+		self.lag = 0.0
+		self.lag_max = 0.0
+		self.lag_sum = 0.0
+		self.connected = False
+
+	# ------------------------------------------------------
+	def put(self, channel, cmd, payload, now):
+		""" queue a message, payload must not change anymore """
+		with self._cond:
+			self.queued += 1
+			if cmd == 0:
+				channel = self.channel_map.get(channel, channel)
+				index = self._latest.get(channel)
+				if index is not None:
+					# nothing else was queued after it, the older frame can go
+					self.dropped += 1
+					self._queue[index] = (channel, cmd, payload, now)
+				else:
+					self._latest[channel] = len(self._queue)
+					self._queue.append((channel, cmd, payload, now))
+			else:
+				# keeps its place between the frames, they are not merged across it
+				self._latest.clear()
+				self._queue.append((channel, cmd, payload, now))
+			self._cond.notify()
+
+	# ------------------------------------------------------
+	def stop(self):
+		with self._cond:
+			self._stopping = True
+			self._cond.notify()
+
+	# ------------------------------------------------------
+	def run(self):
+		next_frame = 0.0
+		while True:
+			with self._cond:
+				while not self._stopping and not self._queue:
+					self._cond.wait()
+				if self._stopping:
+					break
+				now = time.monotonic()
+				if now >= next_frame:
+					items, self._queue = self._queue, []
+					self._latest.clear()
+				else:
+					# frames wait for the fps cap, messages in front of them don't
+					count = 0
+					while count < len(self._queue) and self._queue[count][1] != 0:
+						count += 1
+					items = self._queue[:count]
+					del self._queue[:count]
+					for channel in self._latest:
+						self._latest[channel] -= count
+					if not items:
+						self._cond.wait(next_frame - now)
+						continue
+
+			if self.fps and any(item[1] == 0 for item in items):
+				next_frame = max(next_frame, now) + 1.0 / self.fps
+			self.send(items)
+
+	# ------------------------------------------------------
+	def send(self, items):
+		if len(items) * OPC_HEADER.size > len(self.headers):
+			self.headers = bytearray(OPC_HEADER.size * len(items))
+			self.header_view = memoryview(self.headers)
+		buffers = []
+		for index, (channel, cmd, payload, received) in enumerate(items):
+			OPC_HEADER.pack_into(self.headers, index * OPC_HEADER.size, channel, cmd, len(payload))
+			buffers.append(self.header_view[index*OPC_HEADER.size:(index+1)*OPC_HEADER.size])
+			buffers.append(payload)
+
+		self.connected = self.pooled.send(buffers, time.monotonic())
+		done = time.monotonic()
+		if not self.connected:
+			self.failed += len(items)
+			return
+		self.sent += len(items)
+		self.bytes += sum(len(b) for b in buffers)
+		for item in items:
+			lag = done - item[3]
+			self.lag_sum += lag
+			self.lag_max = max(self.lag_max, lag)
+		self.lag = lag
+
+	# ------------------------------------------------------
+	def stats(self):
+		""" counters since start, lag in seconds from receiving to sending: last, mean and max """
+		sent = max(1, self.sent)
+		with self._cond:
+			pending = len(self._queue)
+		return {'target': self.address, 'connected': self.connected, 'queued': self.queued, 'sent': self.sent,
+			'dropped': self.dropped, 'failed': self.failed, 'pending': pending, 'bytes': self.bytes,
+			'lag': self.lag, 'lag_mean': self.lag_sum / sent, 'lag_max': self.lag_max}
+
+	# ------------------------------------------------------
+	def summary(self):
+		stats = self.stats()
+		return "%s  %s  sent %d  dropped %d  failed %d  pending %d  lag %.1f ms (mean %.1f, max %.1f)" % (stats['target'],
+			'connected' if stats['connected'] else 'down', stats['sent'], stats['dropped'], stats['failed'], stats['pending'],
+			stats['lag']*1e3, stats['lag_mean']*1e3, stats['lag_max']*1e3)
+
+
+# ======================================================
+class Forwarder(object):
+	""" OPCserver listener, hands every message to all targets """
+
+	# ------------------------------------------------------
+	def __init__(self, targets):
+		self.targets = targets
+
+	# ------------------------------------------------------
+	def __call__(self, channel, cmd, data):
+		# data is only valid during the call, one copy for all targets
+		payload = bytes(data)
+		now = time.monotonic()
+		for target in self.targets:
+			target.put(channel, cmd, payload, now)
+
+	# ------------------------------------------------------
+	def start(self):
+		for target in self.targets:
+			target.start()
+
+	# ------------------------------------------------------
+	def stop(self):
+		for target in self.targets:
+			target.stop()
+		for target in self.targets:
+			target.join(3)
+			target.pooled.release()
+
+	# ------------------------------------------------------
+	def stats(self):
+		return [ target.stats() for target in self.targets ]
+
+
+# ------------------------------------------------------
+def parseTarget(spec):
+	"""'host:port[,fps=<rate>][,map=<from>:<to>/...][,udp]' -> ForwardTarget
+
+	map sends the frames received on channel <from> on channel <to>.
+	"""
+	fps, channel_map, udp = 0.0, {}, False
+	parts = spec.split(',')
+	address = parts[0]
+	host, _, port = address.rpartition(':')
+	if not host or not port.isdigit():
+		raise ValueError("invalid forward target '%s', expected <host>:<port>[,fps=<rate>][,map=<from>:<to>/...][,udp]" % spec)
+	for option in parts[1:]:
+		key, _, value = option.partition('=')
+		if key == 'fps':
+			fps = max(0.0, float(value))
+		elif key == 'map':
+			for pair in value.split('/'):
+				src, _, dst = pair.partition(':')
+				if not src.isdigit() or not dst.isdigit() or int(src) > 255 or int(dst) > 255:
+					raise ValueError("invalid channel map '%s' of '%s', expected <from>:<to>/..." % (value, spec))
+				channel_map[int(src)] = int(dst)
+		elif key == 'udp' and not value:
+			udp = True
+		else:
+			raise ValueError("unknown option '%s' of forward target '%s'" % (option, spec))
+	return ForwardTarget(address, fps, channel_map, udp)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# leds compared at once before looking at single leds
+BLOCK_LEDS = 64
+
+# ------------------------------------------------------
+def changed_leds(frame, last, count):
+	"""Return the indices of the first count leds whose color differs between two frames.
+
+	frame and last are flat buffers of rgb bytes. last may be None or shorter
+	than frame, all leds without a previous color count as changed.
+	"""
+	count = min(count, len(frame) // 3)
+	if last is None:
+		return list(range(count))
+
+	common = min(count, len(last) // 3)
+	if np is not None:
+		a = np.frombuffer(frame, np.uint8, common*3).reshape(-1,3)
+		b = np.frombuffer(last,  np.uint8, common*3).reshape(-1,3)
+		changed = np.flatnonzero((a != b).any(axis=1)).tolist()
+	else:
+		# compare whole blocks first, static scenes leave most of them untouched
+		changed = []
+		frame = memoryview(frame)
+		last = memoryview(last)
+		size = common*3
+		for start in range(0, size, BLOCK_LEDS*3):
+			end = min(size, start + BLOCK_LEDS*3)
+			if frame[start:end] != last[start:end]:
+				changed.extend( i // 3 for i in range(start, end, 3) if frame[i:i+3] != last[i:i+3] )
+
+	changed.extend(range(common, count))
+	return changed
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Drive hyperion layouts from images, like a hyperion screen grabber.
+
+Frames are read from a file or a pipe, either as a stream of binary PPM
+images (what ffmpeg writes with -f image2pipe -vcodec ppm) or as raw rgb24
+of a given size. Every led gets the average color of its hscan/vscan area
+of the image, like hyperion's image to led mapping, and the colors are
+sent as one OPC frame on channel 0:
+
+	ffmpeg -i movie.mp4 -vf scale=320:180 -f image2pipe -vcodec ppm - | \\
+		python3 hypersim.py --hyperion hyperion.config.json --grab -
+	python3 grabber.py movie.rgb --size 320x180 --hyperion hyperion.config.json --to localhost:7890
+
+The areas are cut at all led borders. Per frame the pixels of every block
+between two cuts are summed once into a summed-area table of the blocks,
+the sum of any led area is then four lookups, so a frame costs one pass
+over the pixels plus O(leds), however much the areas overlap.
+"""
+
+import bisect, math, sys, time
+from threading import Thread, Event
+
+from layout import loadGeometry
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+# ======================================================
+class FrameReader(object):
+	"""Reads rgb24 frames from a binary file object.
+
+	size is (width, height) for raw rgb24, None for a PPM stream. frames()
+	yields (width, height, data), data is a buffer reused for every frame.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, stream, size=None):
+		self.stream = stream
+		self.size = size
+
+	# ------------------------------------------------------
+	def _token(self):
+		token = b''
+		while True:
+			c = self.stream.read(1)
+			if not c:
+				return token or None
+			if c == b'#' and not token:
+				self.stream.readline()
+			elif c.isspace():
+				if token:
+					return token
+			else:
+				token += c
+
+	# ------------------------------------------------------
+	def _readFrame(self, view):
+		pos = 0
+		while pos < len(view):
+			nbytes = self.stream.readinto(view[pos:])
+			if not nbytes:
+				return False
+			pos += nbytes
+		return True
+
+	# ------------------------------------------------------
+	def frames(self):
+		buffer = bytearray()
+		while True:
+			if self.size is None:
+				magic = self._token()
+				if magic is None:
+					return
+				width, height, maxval = [ self._token() for i in range(3) ]
+				if magic != b'P6' or maxval != b'255':
+					raise ValueError("only binary 8 bit PPM (P6) images are supported")
+				width, height = int(width), int(height)
+			else:
+				width, height = self.size
+
+			if len(buffer) != width*height*3:
+				buffer = bytearray(width*height*3)
+			if not self._readFrame(memoryview(buffer)):
+				return
+			yield width, height, buffer
+
+
+# ======================================================
+class LedMapper(object):
+	"""Average color of the area of every led in images of one size.
+
+	regions holds (x0, y0, x1, y1) in 0..1 of the image or None per led,
+	e.g. the columns of a hyperion LayoutGeometry.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, regions, width, height):
+		self.width = width
+		self.height = height
+		bounds = []
+		for r in regions:
+			if r is None or r[0] != r[0]:
+				bounds.append(None)
+				continue
+			x0, x1 = self._pixels(min(r[0], r[2]), max(r[0], r[2]), width)
+			y0, y1 = self._pixels(min(r[1], r[3]), max(r[1], r[3]), height)
+			bounds.append((x0, y0, x1, y1))
+
+		valid = [ b for b in bounds if b is not None ]
+		self.xcuts = sorted(set([ b[0] for b in valid ] + [ b[2] for b in valid ])) or [0, 1]
+		self.ycuts = sorted(set([ b[1] for b in valid ] + [ b[3] for b in valid ])) or [0, 1]
+		# per led: positions of its borders in the cuts and its pixel count
+		self.leds = []
+		for b in bounds:
+			if b is None:
+				self.leds.append(None)
+				continue
+			x0, y0, x1, y1 = b
+			self.leds.append( (bisect.bisect_left(self.xcuts, x0), bisect.bisect_left(self.ycuts, y0),
+				bisect.bisect_left(self.xcuts, x1), bisect.bisect_left(self.ycuts, y1), (x1 - x0) * (y1 - y0)) )
+
+		if np is not None:
+			leds = [ l or (0, 0, 0, 0, 1) for l in self.leds ]
+			self.index = [ np.array([ l[i] for l in leds ], dtype=np.intp) for i in range(4) ]
+			self.area = np.array([ l[4] for l in leds ], dtype=np.int64)[:, None]
+			self.missing = np.array([ l is None for l in self.leds ], dtype=bool)
+
+	# ------------------------------------------------------
+	@staticmethod
+	def _pixels(v0, v1, size):
+		""" pixel range of 0..1 coordinates, at least one pixel """
+		p0 = min(size - 1, max(0, int(math.floor(v0 * size))))
+		p1 = min(size, max(p0 + 1, int(math.ceil(v1 * size))))
+		return p0, p1
+
+	# ------------------------------------------------------
+	def _table(self, frame):
+		""" summed-area table of the blocks between the cuts, [y cut][x cut][channel] """
+		xcuts, ycuts = self.xcuts, self.ycuts
+		if np is not None:
+			image = np.frombuffer(frame, np.uint8, self.width*self.height*3).reshape(self.height, self.width, 3)
+			image = image[ycuts[0]:ycuts[-1], xcuts[0]:xcuts[-1]]
+			blocks = np.add.reduceat(image, [ x - xcuts[0] for x in xcuts[:-1] ], axis=1, dtype=np.int64)
+			blocks = np.add.reduceat(blocks, [ y - ycuts[0] for y in ycuts[:-1] ], axis=0)
+			table = np.zeros((len(ycuts), len(xcuts), 3), dtype=np.int64)
+			table[1:, 1:] = blocks.cumsum(axis=0).cumsum(axis=1)
+			return table
+
+		stride = self.width * 3
+		segments = list(zip(xcuts[:-1], xcuts[1:]))
+		table = [ [0] * (len(xcuts) * 3) ]
+		for y0, y1 in zip(ycuts[:-1], ycuts[1:]):
+			sums = [0] * (len(segments) * 3)
+			for y in range(y0, y1):
+				row = frame[y*stride:(y+1)*stride]
+				for c in range(3):
+					channel = row[c::3]
+					for j, (x0, x1) in enumerate(segments):
+						sums[j*3+c] += sum(channel[x0:x1])
+			# running sums along the row plus the row of the table above
+			above = table[-1]
+			line = [0, 0, 0]
+			acc = [0, 0, 0]
+			for j in range(len(segments)):
+				for c in range(3):
+					acc[c] += sums[j*3+c]
+					line.append(acc[c] + above[(j+1)*3+c])
+			table.append(line)
+		return table
+
+	# ------------------------------------------------------
+	def colors(self, frame):
+		""" flat rgb bytes with the average color of every led, black for leds without area """
+		table = self._table(frame)
+		if np is not None:
+			x0, y0, x1, y1 = self.index
+			sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+			colors = (sums + self.area // 2) // self.area
+			colors[self.missing] = 0
+			return colors.astype(np.uint8).tobytes()
+
+		out = bytearray(len(self.leds) * 3)
+		for idx, led in enumerate(self.leds):
+			if led is None:
+				continue
+			x0, y0, x1, y1, area = led
+			a, b, c, d = table[y1], table[y0], x1*3, x0*3
+			for ch in range(3):
+				out[idx*3+ch] = (a[c+ch] - b[c+ch] - a[d+ch] + b[d+ch] + area // 2) // area
+		return out
+
+
+# ======================================================
+class ImageGrabber(Thread):
+	"""Maps the frames of a FrameReader to led colors and passes them to sink(channel, cmd, data).
+
+	geometry() returns the current hyperion LayoutGeometry or None, so a
+	reloaded layout is used from the next frame on. fps limits the frame
+	rate, 0 maps frames as fast as they come.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, reader, geometry, sink, fps=30.0):
+		Thread.__init__(self)
+		self.daemon = True
+		self.reader = reader
+		self.geometry = geometry
+		self.sink = sink
+		self.fps = fps
+		self.running = False
+		self.frames = 0
+		self.elapsed = 0.0
+		self.map_time = 0.0
+		self._stopping = Event()
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.running = False
+		self._stopping.set()
+
+	# ------------------------------------------------------
+	def run(self):
+		self.running = True
+		started = time.monotonic()
+		mapper, mapped = None, (None, None)
+		try:
+			for width, height, frame in self.reader.frames():
+				if not self.running:
+					break
+				geometry = self.geometry()
+				if geometry is not None:
+					if mapped != (geometry, (width, height)):
+						mapper = LedMapper(list(zip(*geometry.columns)), width, height)
+						mapped = (geometry, (width, height))
+					start = time.perf_counter()
+					colors = mapper.colors(frame)
+					self.map_time += time.perf_counter() - start
+					self.sink(0, 0, colors)
+				self.frames += 1
+
+				if self.fps:
+					delay = started + self.frames / self.fps - time.monotonic()
+					if delay > 0 and self._stopping.wait(delay):
+						break
+		except (OSError, ValueError) as e:
+			print("grabber: %s" % e)
+		self.elapsed = time.monotonic() - started
+		self.running = False
+
+	# ------------------------------------------------------
+	def summary(self):
+		elapsed = max(1e-6, self.elapsed)
+		return "grabbed %d frames in %.2f s: %.1f fps, %.2f ms per frame for the led colors" % (
+			self.frames, self.elapsed, self.frames / elapsed, 1e3 * self.map_time / max(1, self.frames))
+
+
+# ------------------------------------------------------
+def parseSize(size):
+	""" 'WxH' -> (width, height), None stays None """
+	if size is None:
+		return None
+	width, _, height = size.lower().partition('x')
+	if not width.isdigit() or not height.isdigit() or int(width) == 0 or int(height) == 0:
+		raise ValueError("invalid size '%s', expected <width>x<height>" % size)
+	return int(width), int(height)
+
+
+# ------------------------------------------------------
+def openReader(path, size=None):
+	""" FrameReader of a file or stdin ('-'), raw rgb24 if size is given """
+	stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+	return FrameReader(stream, parseSize(size))
+
+
+if __name__ == "__main__":
+	import argparse
+	from opcclient import OPCclient
+	from replay import ClientSink
+
+	parser = argparse.ArgumentParser(description='Send the led colors of image frames to an OPC server.', prog='grabber.py')
+	parser.add_argument('frames', metavar="<file>", help='PPM stream or raw rgb24 file, - for stdin')
+	parser.add_argument('--hyperion', required=True, metavar="<file>", help='hyperion config with the led areas')
+	parser.add_argument('--size', default=None, metavar="<w>x<h>", help='frame size of raw rgb24, PPM otherwise')
+	parser.add_argument('--fps', default=30.0, type=float, metavar="<rate>", help='frames per second, 0 for as fast as possible (default: 30)')
+	parser.add_argument('--to', default='localhost:7890', metavar="<host:port>", help='OPC server (default: localhost:7890)')
+	args = parser.parse_args()
+
+	try:
+		reader = openReader(args.frames, args.size)
+		geometry = loadGeometry(args.hyperion, 'hyperion')
+	except (OSError, ValueError) as e:
+		parser.error(str(e))
+
+	grabber = ImageGrabber(reader, lambda: geometry, ClientSink(OPCclient(args.to)), args.fps)
+	grabber.start()
+	try:
+		while grabber.is_alive():
+			grabber.join(0.5)
+	except KeyboardInterrupt:
+		grabber.stop()
+		grabber.join()
+	print(grabber.summary())
@@ -1,17 +1,40 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import signal, os
-import tkinter as tk
-from opcserver import *
-from mainwindow import *
+import signal, os, sys
+from threading import Thread
+from engine import *
 
 def signal_handler(signum, frame):
 	exit(0)
 
+def step_replay(replay):
+	# frame step: every line on stdin sends the next frame
+	for line in sys.stdin:
+		replay.step()
+
 
 signal.signal(signal.SIGINT, signal_handler)
-root = tk.Tk()
-app = MainWindow(parent=root)
-root.protocol("WM_DELETE_WINDOW", app.on_close)
-app.mainloop()
+args = parseCmdArgs()
+
+if args.headless:
+	# no tkinter needed
+	engine = HyperSimEngine.fromArgs(args)
+	if args.layout_file is not None:
+		engine.loadLayout(args.layout_file, args.layout_type, 1067 if args.wideScreen else 800, 600, args.led_size)
+		print("[%s] %s: %d leds" % (args.layout_type, args.layout_file, len(engine.led_rects)) )
+	engine.start()
+	if engine.replay is not None and engine.replay.speed is None:
+		print("press enter for the next frame")
+		Thread(target=step_replay, args=(engine.replay,), daemon=True).start()
+	# exit() in the signal handler lets run() stop the engine and close files
+	signal.signal(signal.SIGTERM, signal_handler)
+	engine.run(args.fps)
+else:
+	import tkinter as tk
+	from mainwindow import *
+
+	root = tk.Tk()
+	app = MainWindow(parent=root, args=args)
+	root.protocol("WM_DELETE_WINDOW", app.on_close)
+	app.mainloop()
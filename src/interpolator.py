@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class Interpolator(object):
+	"""Renders frames between keyframes like the Fadecandy firmware does.
+
+	keyframe() takes each new color corrected frame. frame() then returns
+	the blend of the previous and the newest keyframe for the current time,
+	fading over the time that passed between the two keyframes. The blend is
+	computed with 8 bits of fraction per color and temporal dithering carries
+	the fraction over to the following frames.
+
+	The firmware configuration flags (see OPCclient.setFirmwareConfig) switch
+	off interpolation and dithering, the led flags are only kept.
+
+	All math is done on whole frames: with NumPy on uint16 arrays, without it
+	on one python integer holding a 16 bit lane per color.
+	"""
+	NO_DITHER  = 0x01
+	NO_INTERP  = 0x02
+	MANUAL_LED = 0x04
+	LED_ON     = 0x08
+
+	# longest fade, a sender that pauses should not cause slow fades
+	MAX_PERIOD = 1.0
+
+	# ------------------------------------------------------
+	def __init__(self, flags=0):
+		self.flags = flags
+		self.prev = None
+		self.next = None
+		self.time = None
+		self.period = 0.0
+		self.size = 0
+		self.half = 0
+		self.residual = None
+
+	# ------------------------------------------------------
+	def setFlags(self, flags):
+		self.flags = flags
+		self.residual = None
+
+	# ------------------------------------------------------
+	def keyframe(self, colors, now):
+		frame = self._lanes(colors)
+		if self.next is None or len(colors) != self.size:
+			self.prev = frame
+			self.period = 0.0
+			self.residual = None
+			# rounding offset for each lane when dithering is off
+			self.half = 0x80 if np is not None else int.from_bytes(b'\x00\x80' * len(colors), 'big')
+		else:
+			self.prev = self.next
+			self.period = min(Interpolator.MAX_PERIOD, now - self.time)
+		self.next = frame
+		self.size = len(colors)
+		self.time = now
+
+	# ------------------------------------------------------
+	def active(self, now):
+		""" True while frame() still changes without new keyframes """
+		return self.next is not None and self._weight(now) < 256
+
+	# ------------------------------------------------------
+	def _weight(self, now):
+		if self.flags & Interpolator.NO_INTERP or self.period <= 0:
+			return 256
+		return max(0, min(256, int((now - self.time) / self.period * 256)))
+
+	# ------------------------------------------------------
+	def _lanes(self, colors):
+		if np is not None:
+			return np.frombuffer(colors, np.uint8).astype(np.uint16)
+		wide = bytearray(2*len(colors))
+		wide[1::2] = colors
+		return int.from_bytes(wide, 'big')
+
+	# ------------------------------------------------------
+	def frame(self, now):
+		""" the colors to display now, None before the first keyframe """
+		if self.next is None:
+			return None
+
+		w = self._weight(now)
+		value = self.prev * (256 - w) + self.next * w
+		dither = not self.flags & Interpolator.NO_DITHER
+
+		if dither and self.residual is not None:
+			value += self.residual
+		elif not dither:
+			value += self.half
+
+		if np is not None:
+			self.residual = value & 0xff if dither else None
+			return (value >> 8).astype(np.uint8).tobytes()
+
+		# every lane is at most 255*256 + 255, so nothing carries into the next lane
+		lanes = value.to_bytes(2*self.size, 'big')
+		if dither:
+			residual = bytearray(2*self.size)
+			residual[1::2] = lanes[1::2]
+			self.residual = int.from_bytes(residual, 'big')
+		else:
+			self.residual = None
+		return lanes[0::2]
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""Layout files and their geometry.
+
+A layout file is parsed once into a LayoutGeometry that holds normalized
+positions of all leds in flat arrays and is cached by path and
+modification time. rects() derives the pixel rectangles for a window size
+and led size with one transform over the arrays, so resizing the window
+or the leds does not read the file again.
+
+Big opc layouts are read as a stream and their points are kept in a binary
+cache file ($XDG_CACHE_HOME/hypersim), which is memory mapped on the next
+start instead of parsing the JSON again.
+"""
+
+import hashlib, json, mmap, os, re, struct
+from array import array
+
+from projection import Camera
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+OPC_AXES = {'opc_xy' : (0,1),'opc_xz' : (0,2),'opc_yz' : (1,2) }
+LAYOUT_TYPES = ['hyperion'] + sorted(OPC_AXES) + ['opc_3d']
+
+# strings are matched first and kept, so "http://..." is not a comment
+JSON_COMMENTS = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+
+# the "point" arrays of an opc layout, see parsePoints
+OPC_POINT = re.compile(r'"point"\s*:\s*\[([^\]]*)\]')
+
+# opc layouts of at least this size keep their points in a binary cache:
+# header, then x, y, z per led as doubles in machine byte order
+POINT_CACHE_MIN_SIZE = 1<<20
+POINT_CACHE_MAGIC = b'HSPTS\x01\x00\x00'
+POINT_CACHE_HEADER = struct.Struct('<8sqqQ')
+
+NAN = float('nan')
+
+# ======================================================
+class LayoutGeometry(object):
+	"""Normalized led positions of a layout, independent of the window size.
+
+	hyperion layouts hold the scan area of every led as x0, y0, x1, y1 in
+	0..1 of the window. opc layouts hold the position of every led on the
+	two axes, scaled to 0..1, and the aspect ratio of the points. opc_3d
+	layouts hold x, y, z centered on the layout and scaled to -1..1 on the
+	longest axis, projected by a Camera. Leds without position are NaN.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, layout_type, columns, aspect=None):
+		self.layout_type = layout_type
+		self.columns = columns
+		self.aspect = aspect
+
+	# ------------------------------------------------------
+	def __len__(self):
+		return len(self.columns[0])
+
+	# ------------------------------------------------------
+	def windowSize(self, win_width, win_height):
+		""" opc layouts adapt the window to the aspect ratio of the points """
+		if self.aspect is None:
+			return win_width, win_height
+		while True:
+			win_height = win_width * self.aspect
+			if win_height < 800:
+				break
+			win_width -= 10
+		return win_width, win_height
+
+	# ------------------------------------------------------
+	def rects(self, win_width=800, win_height=600, led_size=15, camera=None):
+		""" returns (led_rects, win_width, win_height), see readConfig """
+		if self.layout_type == 'opc_3d':
+			return (camera or Camera()).project(self.columns, win_width, win_height, led_size)[0], win_width, win_height
+
+		win_width, win_height = self.windowSize(win_width, win_height)
+		if self.aspect is None:
+			x0, y0, x1, y1 = self.columns
+			transform = [ (x0, win_width, 0), (y0, win_height, 0), (x1, win_width, 0), (y1, win_height, 0) ]
+		else:
+			led_margin = 5
+			canvas_gap = led_margin*2 + led_size
+			a, b = self.columns
+			transform = [ (a, win_width -canvas_gap, led_margin), (b, win_height-canvas_gap, led_margin),
+				(a, win_width -canvas_gap, led_size+led_margin), (b, win_height-canvas_gap, led_size+led_margin) ]
+		return _transformRects(transform), win_width, win_height
+
+
+# ------------------------------------------------------
+def _transformRects(transform):
+	""" [ [int(column[i]*scale + offset) for each (column, scale, offset)] or None if NaN ] """
+	if np is not None and len(transform[0][0]):
+		coords = np.stack([ np.frombuffer(column, np.float64) * scale + offset for column, scale, offset in transform ], axis=1)
+		missing = np.isnan(coords).any(axis=1)
+		rects = np.where(missing[:, None], 0, coords).astype(np.int64).tolist()
+		if missing.any():
+			for idx in np.flatnonzero(missing).tolist():
+				rects[idx] = None
+		return rects
+
+	(c0, s0, o0), (c1, s1, o1), (c2, s2, o2), (c3, s3, o3) = transform
+	return [ None if v0 != v0 else [int(v0*s0 + o0), int(v1*s1 + o1), int(v2*s2 + o2), int(v3*s3 + o3)]
+		for v0, v1, v2, v3 in zip(c0, c1, c2, c3) ]
+
+
+# ------------------------------------------------------
+def parseHyperion(text):
+	""" geometry of a hyperion, hyperion.ng or hyperion.ng led layout config """
+	hyperion_cfg = json.loads(JSON_COMMENTS.sub(lambda m: m.group(1) or '', text))
+
+	if isinstance(hyperion_cfg, dict) and 'leds' in hyperion_cfg and hyperion_cfg['leds'] and 'hscan' in hyperion_cfg['leds'][0]:
+		leds = [ (led['hscan']['minimum'], led['vscan']['minimum'], led['hscan']['maximum'], led['vscan']['maximum']) for led in hyperion_cfg['leds'] ]
+	elif isinstance(hyperion_cfg, list) and hyperion_cfg and 'hmax' in hyperion_cfg[0]:
+		leds = [ (led['hmin'], led['vmin'], led['hmax'], led['vmax']) for led in hyperion_cfg ]
+	elif isinstance(hyperion_cfg, list) and hyperion_cfg and 'h' in hyperion_cfg[0]:
+		leds = [ (led['h']['min'], led['v']['min'], led['h']['max'], led['v']['max']) for led in hyperion_cfg ]
+	else:
+		raise Exception ("Not a hyperion nor hyperion-ng file")
+
+	return LayoutGeometry('hyperion', [ array('d', column) for column in zip(*leds) ])
+
+
+# ------------------------------------------------------
+def _addPoints(points, contents):
+	""" append the "point" arrays (their text between the brackets) as x, y, z, ValueError if one is malformed """
+	if all(c.count(',') == 2 for c in contents):
+		# the usual case: all points have three components, convert them in one go
+		if contents:
+			points.extend(map(float, ','.join(contents).split(',')))
+		return
+	for c in contents:
+		if not c.strip():
+			points.extend((NAN, NAN, NAN))
+			continue
+		point = c.split(',')
+		if len(point) < 3:
+			raise ValueError("invalid point [%s], expected x, y, z" % c.strip())
+		points.extend(float(v) for v in point[:3])
+
+
+# ------------------------------------------------------
+def parsePoints(data_file, chunk_size=1<<20):
+	"""Read the points of an opc layout into a flat array('d') of x, y, z per led.
+
+	The file is read in chunks and only the "point" arrays are picked out, so
+	no python objects are built for the whole document. Leds with an empty
+	point are NaN. The led objects are counted by their braces, ValueError
+	if a led has no point, a point is malformed or the file holds anything
+	else in braces, see readJsonPoints.
+	"""
+	points = array('d')
+	leds = 0
+	pending = ''
+	while True:
+		chunk = data_file.read(chunk_size)
+		leds += chunk.count('{')
+		text = pending + chunk
+		contents = []
+		end = 0
+		for m in OPC_POINT.finditer(text):
+			contents.append(m.group(1))
+			end = m.end()
+		_addPoints(points, contents)
+		if not chunk:
+			break
+		# keep an incomplete point for the next chunk
+		start = text.rfind('"point"', end)
+		pending = text[start:] if start >= 0 else text[max(end, len(text)-len('"point"')):]
+	if len(points) != leds * 3:
+		raise ValueError("%d points for %d leds" % (len(points) // 3, leds))
+	return points
+
+
+# ------------------------------------------------------
+def readJsonPoints(data_file):
+	""" the points of an opc layout like parsePoints, from the whole JSON document """
+	opc_cfg = json.load(data_file)
+	if not isinstance(opc_cfg, list):
+		raise ValueError("not an opc layout, expected a list of leds")
+	points = array('d')
+	for idx, led in enumerate(opc_cfg):
+		point = led.get('point') if isinstance(led, dict) else None
+		if not isinstance(point, list):
+			raise ValueError("led %d has no point" % idx)
+		if not point:
+			points.extend((NAN, NAN, NAN))
+		elif len(point) < 3:
+			raise ValueError("invalid point %s of led %d, expected x, y, z" % (point, idx))
+		else:
+			points.extend(float(v) for v in point[:3])
+	return points
+
+
+# ------------------------------------------------------
+def _pointCachePath(path):
+	cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(cache_dir, 'hypersim', hashlib.sha1(path.encode('utf-8')).hexdigest() + '.points')
+
+
+# ------------------------------------------------------
+def readPointCache(path, stat):
+	""" points of a layout from the binary cache, None if there is none for this version of the file """
+	try:
+		with open(_pointCachePath(path), 'rb') as cache_file:
+			data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		return None
+	magic, mtime, size, count = POINT_CACHE_HEADER.unpack_from(data, 0) if len(data) >= POINT_CACHE_HEADER.size else (None, 0, 0, 0)
+	if magic != POINT_CACHE_MAGIC or (mtime, size) != (stat.st_mtime_ns, stat.st_size) or len(data) != POINT_CACHE_HEADER.size + count*8:
+		data.close()
+		return None
+	if np is not None:
+		# stays mapped as long as the array lives
+		return np.frombuffer(data, np.float64, count, POINT_CACHE_HEADER.size)
+	points = array('d')
+	points.frombytes(data[POINT_CACHE_HEADER.size:])
+	data.close()
+	return points
+
+
+# ------------------------------------------------------
+def writePointCache(path, stat, points):
+	cache_path = _pointCachePath(path)
+	try:
+		os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+		with open(cache_path + '.tmp', 'wb') as cache_file:
+			cache_file.write(POINT_CACHE_HEADER.pack(POINT_CACHE_MAGIC, stat.st_mtime_ns, stat.st_size, len(points)))
+			cache_file.write(points)
+		os.replace(cache_path + '.tmp', cache_path)
+	except OSError as e:
+		print("could not write layout cache %s: %s" % (cache_path, e))
+
+
+# ------------------------------------------------------
+def loadPoints(path, stat):
+	""" points of an opc layout, big files go through the binary cache """
+	if stat.st_size >= POINT_CACHE_MIN_SIZE:
+		points = readPointCache(path, stat)
+		if points is not None:
+			return points
+	with open(path) as data_file:
+		try:
+			points = parsePoints(data_file)
+		except ValueError:
+			# e.g. nested objects, json tells what is wrong if anything is
+			data_file.seek(0)
+			points = readJsonPoints(data_file)
+	# only reached with valid points
+	if stat.st_size >= POINT_CACHE_MIN_SIZE:
+		writePointCache(path, stat, points)
+	return points
+
+
+# ------------------------------------------------------
+def opcGeometry(points, layout_type):
+	""" geometry of the two axes of layout_type, None if no led has a point """
+	a_idx, b_idx = OPC_AXES[layout_type]
+	if np is not None:
+		points = np.frombuffer(points, np.float64).reshape(-1, 3)
+		a_values, b_values = points[:, a_idx], points[:, b_idx]
+		if np.isnan(a_values).all():
+			return None
+		a_min, a_max = float(np.nanmin(a_values)), float(np.nanmax(a_values))
+		b_min, b_max = float(np.nanmin(b_values)), float(np.nanmax(b_values))
+	else:
+		a_values, b_values = points[a_idx::3], points[b_idx::3]
+		valid_a = [ v for v in a_values if v == v ]
+		valid_b = [ v for v in b_values if v == v ]
+		if not valid_a:
+			return None
+		a_min, a_max = min(valid_a), max(valid_a)
+		b_min, b_max = min(valid_b), max(valid_b)
+
+	if a_max - a_min == 0:
+		a_max = a_min + 1
+	if b_max - b_min == 0:
+		b_max = b_min + 1
+
+	a_range, b_range = a_max - a_min, b_max - b_min
+	if np is not None:
+		a = (a_values - a_min) / a_range
+		b = (b_values - b_min) / b_range
+	else:
+		a = array('d', [ (v - a_min) / a_range for v in a_values ])
+		b = array('d', [ (v - b_min) / b_range for v in b_values ])
+	return LayoutGeometry(layout_type, [a, b], aspect=abs(b_range) / abs(a_range))
+
+
+# ------------------------------------------------------
+def opcGeometry3d(points):
+	""" geometry of all three axes for a Camera, None if no led has a point """
+	if np is not None:
+		columns = np.frombuffer(points, np.float64).reshape(-1, 3).T
+		if np.isnan(columns[0]).all():
+			return None
+		ranges = [ (float(np.nanmin(c)), float(np.nanmax(c))) for c in columns ]
+	else:
+		columns = [ points[axis::3] for axis in range(3) ]
+		valid = [ [ v for v in c if v == v ] for c in columns ]
+		if not valid[0]:
+			return None
+		ranges = [ (min(v), max(v)) for v in valid ]
+
+	# center on the bounding box, the longest axis spans -1..1
+	centers = [ (v_min + v_max) / 2.0 for v_min, v_max in ranges ]
+	radius = max(v_max - v_min for v_min, v_max in ranges) / 2.0 or 1.0
+	if np is not None:
+		columns = [ (c - center) / radius for c, center in zip(columns, centers) ]
+	else:
+		columns = [ array('d', [ (v - center) / radius for v in c ]) for c, center in zip(columns, centers) ]
+	return LayoutGeometry('opc_3d', columns)
+
+
+# path -> (mtime, size, parsed file, {layout_type: geometry})
+_cache = {}
+
+# ------------------------------------------------------
+def loadGeometry(layout_file, layout_type="hyperion"):
+	"""Return the LayoutGeometry of a layout file.
+
+	The file is only read again when its modification time or size changed.
+	The points of an opc file are shared by all opc types.
+	"""
+	if layout_type not in LAYOUT_TYPES:
+		raise ValueError("unknown type of config file '%s'" % layout_type)
+
+	path = os.path.realpath(layout_file)
+	stat = os.stat(path)
+	entry = _cache.get(path)
+	if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+		entry = (stat.st_mtime_ns, stat.st_size, {}, {})
+		_cache[path] = entry
+	parsed, geometries = entry[2], entry[3]
+
+	if layout_type not in geometries:
+		kind = 'hyperion' if layout_type == 'hyperion' else 'opc'
+		if kind == 'hyperion' and kind not in parsed:
+			with open(path) as data_file:
+				parsed[kind] = parseHyperion(data_file.read())
+		elif kind not in parsed:
+			parsed[kind] = loadPoints(path, stat)
+		if kind == 'hyperion':
+			geometries[layout_type] = parsed[kind]
+		elif layout_type == 'opc_3d':
+			geometries[layout_type] = opcGeometry3d(parsed[kind])
+		else:
+			geometries[layout_type] = opcGeometry(parsed[kind], layout_type)
+	return geometries[layout_type]
+
+
+# ------------------------------------------------------
+def readConfig(layout_file, layout_type="hyperion", win_width=800, win_height=600, led_size=15):
+	""" read a layout file, returns (led_rects, win_width, win_height)
+
+	led_rects holds [x0, y0, x1, y1] in pixels or None per led. 2d opc
+	layouts adapt the window size to the aspect ratio of the points, opc_3d
+	layouts are seen from the front by a default Camera.
+	"""
+	geometry = loadGeometry(layout_file, layout_type)
+	if geometry is None:
+		raise ValueError("no led with a point in '%s'" % layout_file)
+	return geometry.rects(win_width, win_height, led_size)
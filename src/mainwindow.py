@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
-import json, re, time, argparse, signal, os
+import os, time
 import tkinter as tk
 
 import tkinter.messagebox as tkMessageBox
 import tkinter.filedialog as tkFileDialog
 
-from opcserver import *
+from engine import HyperSimEngine, parseCmdArgs
+from framediff import changed_leds
+from rasterizer import Rasterizer
+from colorcorrection import ColorCorrection
+from projection import Camera
+from spatialindex import SpatialIndex, idRanges
+from perfstats import summary
+import layout
 
 
 class StatusBar(tk.Frame):   
@@ -17,50 +24,91 @@ class StatusBar(tk.Frame):
 		self.label=tk.Label(self, bd=1, relief=tk.SUNKEN, anchor=tk.W, textvariable=self.text, padx=2, pady=2)
 		self.text.set('')
 		self.label.pack(fill=tk.X, side=tk.LEFT,expand=1, padx=2, pady=2)
+
+		self.stats=tk.StringVar()
+		self.stats_label=tk.Label(self, bd=1, relief=tk.SUNKEN, anchor=tk.E, textvariable=self.stats, padx=2, pady=2)
+		self.stats_label.pack(fill=tk.X, side=tk.RIGHT, padx=2, pady=2)
+
+		# stage timings, only shown while they are measured
+		self.perf=tk.StringVar()
+		self.perf_label=tk.Label(self, bd=1, relief=tk.SUNKEN, anchor=tk.W, textvariable=self.perf, padx=2, pady=2)
+		self.perf.set('')
 		self.pack(fill=tk.X, side=tk.LEFT,expand=1, padx=1, pady=1)
 
 	def setText(self,text=''):
 		self.text.set(text)
 
+	def setStats(self,text=''):
+		self.stats.set(text)
+
+	def setPerf(self,text=''):
+		if text and not self.perf.get():
+			self.perf_label.pack(fill=tk.X, side=tk.BOTTOM, padx=2, pady=2, before=self.label)
+		elif not text and self.perf.get():
+			self.perf_label.pack_forget()
+		self.perf.set(text)
+
 class MainWindow(tk.Frame):
+	# how often the layout file is checked for changes
+	LAYOUT_WATCH_INTERVAL = 1000
+	# radians per pixel of mouse drag and zoom per wheel step in the 3d view
+	ROTATE_SPEED = 0.01
+	ZOOM_STEP = 1.1
 
 	# ------------------------------------------------------
-	def __init__(self, parent=None):
+	def __init__(self, parent=None, args=None):
 		self.parent = parent
-		self.layout_file = None
-		self.draw_type = 'rect'
-		self.led_size = 15
-		self.clut = [256*[0],256*[0],256*[0]]
-		self.gamma = 1.3
-		self.whitepoint = (1.0,1.0,1.0)
+		self.rasterizer = None
 		self.canvas = None
-		self.OPCport = 7890
-		self.wideScreen = False
+		self.led_rendered = None
+		self.leds_checked = 0
+		self.leds_changed = 0
+		self.camera = Camera()
+		self.camera_moved = False
+		self.drag = None
+		self.hover = None
+
+		args = parseCmdArgs() if args is None else args
+		self.show_numbers = args.show_numbers
+		self.wideScreen = args.wideScreen
+		self.draw_type = args.draw_type
+		self.renderer = args.renderer
+		self.led_size = args.led_size
+		self.max_fps = args.fps
+		self.merge = args.merge
+		self.layout_file = args.layout_file
+		self.layout_type = args.layout_type
+
+		self.engine = HyperSimEngine.fromArgs(args)
+		self.opcServer = self.engine.opcServer
+		self.stats_time = time.monotonic()
+		self.stats_last = self.engine.stats()
+		self.perf = self.engine.perf
+		self.perf_last = self.perf.snapshot()
+		self.render_end = None
 
-		self.parseCmdArgs()
-		self.calculateCLUTs()
 		self.resetVars()
 		self.initUI()
-
-		self.opcServer = OPCserver(self.updateLeds,self.setColorCorrection,PORT=self.OPCport)
-		self.opcServer.start()
+		self.engine.start()
 
 		if self.layout_file is not None:
 			self.loadConfig()
 
-		self.led_data = len(self.led_widgets) * [(100,200,100)]
-		self.updateLeds( self.led_data )
+		self.renderColors( self.engine.setFrame(len(self.led_rects) * bytes((100,200,100))) )
+		self.render_job = self.after(0, self.renderFrames)
+		self.watch_job = self.after(MainWindow.LAYOUT_WATCH_INTERVAL, self.watchLayout)
 
 	# ------------------------------------------------------
 	def resetUI(self):
-		self.opcServer.standby(True)
-		try:
-			if self.canvas is not None:
-				self.canvas.destroy()
-			self.led_widgets = []
-			self.initCanvas()
-		finally:
-			self.opcServer.standby(False)
+		# frames only reach the canvas through engine.poll() in this thread, so
+		# the server keeps receiving while the canvas is rebuilt
+		if self.canvas is not None:
+			self.canvas.destroy()
+		self.led_widgets = []
+		self.led_labels = []
+		self.initCanvas()
+		self.led_rendered = None
+		self.engine.redraw = True
 
 	# ------------------------------------------------------
 	def resetVars(self):
@@ -68,14 +116,250 @@ class MainWindow(tk.Frame):
 		self.win_height = 600
 		self.led_rects = []
 		self.led_widgets = []
-		self.led_rects = []
+		self.led_labels = []
+		self.led_order = None
+		self.led_index = None
+		self.visible = None
+		self.layout_stat = None
 
 	# ------------------------------------------------------
-	def loadConfig(self):
-		self.resetVars()
-		self.readConfig(self.layout_file ,self.layout_type)
-		self.resetUI()
+	def layoutStat(self):
+		try:
+			stat = os.stat(self.layout_file)
+		except (OSError, TypeError):
+			return None
+		return (stat.st_mtime_ns, stat.st_size)
+
+	# ------------------------------------------------------
+	def loadConfig(self, interactive=True):
+		""" (re)load the layout file, the current layout stays if that fails """
+		self.layout_stat = self.layoutStat()
+		try:
+			led_rects, win_width, win_height = self.engine.loadLayout(self.layout_file, self.layout_type, 1067 if self.wideScreen else 800, 600, self.led_size)
+		except Exception as e:
+			if interactive:
+				tkMessageBox.showerror("Open Config File", "Failed to open '%s' file \n'%s'\n%s" % (self.layout_type, self.layout_file, e))
+			else:
+				self.statusbar.setText("[%s] %s: reload failed: %s" % (self.layout_type, self.layout_file, e))
+			return False
+
+		self.applyLayout(led_rects, win_width, win_height)
 		self.statusbar.setText("[%s] %s" % (self.layout_type, self.layout_file) )
+		return True
+
+	# ------------------------------------------------------
+	def watchLayout(self):
+		# reload when the layout file was saved, e.g. while editing it
+		stat = self.layoutStat()
+		if stat is not None and stat != self.layout_stat:
+			self.loadConfig(interactive=False)
+		self.watch_job = self.after(MainWindow.LAYOUT_WATCH_INTERVAL, self.watchLayout)
+
+	# ------------------------------------------------------
+	def applyLayout(self, led_rects, win_width, win_height):
+		"""Show new led geometry without rebuilding the canvas.
+
+		The engine already uses the new layout, its next frame is drawn with
+		it. Items of leds that did not move are kept, moved leds get new
+		coordinates and only added or removed leds create or delete items.
+		"""
+		old_rects = self.led_rects
+		resized = (win_width, win_height) != (self.win_width, self.win_height)
+		self.led_rects, self.win_width, self.win_height = led_rects, win_width, win_height
+
+		was_3d, self.led_order = self.led_order is not None, None
+		if self.layout_type == 'opc_3d':
+			# keep the view of the camera, the items are created from far to near
+			self.project()
+			self.resetUI()
+			return
+
+		if self.canvas is None or self.rasterizer is not None or was_3d:
+			# the image renderer needs a new image anyway, the 3d view stacked the items by depth
+			self.resetUI()
+			return
+
+		if resized:
+			self.canvas.config(width=win_width, height=win_height)
+			self.canvas.coords(self.background, 0, 0, win_width, win_height)
+
+		colors = self.led_rendered or b''
+		count = max(len(old_rects), len(led_rects))
+		self.led_widgets.extend([None] * (count - len(self.led_widgets)))
+		self.led_labels.extend([None] * (count - len(self.led_labels)))
+		for idx in range(count):
+			old = old_rects[idx] if idx < len(old_rects) else None
+			r = led_rects[idx] if idx < len(led_rects) else None
+			if old == r:
+				continue
+
+			widget, label = self.led_widgets[idx], self.led_labels[idx]
+			if r is None:
+				self.canvas.delete(widget)
+				if label is not None:
+					self.canvas.delete(label)
+				self.led_widgets[idx] = self.led_labels[idx] = None
+			elif widget is None:
+				fill = ColorCorrection.hexColors(colors[idx*3:idx*3+3])[0] if len(colors) >= idx*3+3 else "black"
+				self.led_widgets[idx] = self.createLed(r, fill)
+				self.led_labels[idx] = self.createLabel(idx, r)
+			else:
+				self.canvas.coords(widget, r[0], r[1], r[2], r[3])
+				if label is not None:
+					self.canvas.coords(label, int((r[0]+r[2])/2), int((r[1]+r[3])/2))
+
+		del self.led_widgets[len(led_rects):]
+		del self.led_labels[len(led_rects):]
+		self.led_index = None
+		if self.show_numbers:
+			self.canvas.tag_raise('label')
+
+	# ------------------------------------------------------
+	def project(self):
+		""" led_rects and led_order of the 3d layout seen by the camera """
+		geometry = layout.loadGeometry(self.layout_file, self.layout_type)
+		self.led_rects, self.led_order = self.camera.project(geometry.columns, self.win_width, self.win_height, self.led_size)
+		self.led_index = None
+		self.camera_moved = False
+
+	# ------------------------------------------------------
+	def updateProjection(self):
+		"""Show the 3d layout from the current camera position.
+
+		Called at most once per rendered frame, however often the camera
+		moved in between. Canvas items keep their stacking order: the n-th
+		item from the bottom is moved to the n-th led from the back and
+		takes its color, so no item is created or raised. When zoomed in,
+		leds outside of the window are not recolored until they come back.
+		"""
+		try:
+			self.project()
+		except (OSError, ValueError) as e:
+			self.statusbar.setText("[%s] %s: %s" % (self.layout_type, self.layout_file, e))
+			return
+
+		self.visible = None
+		if self.camera.zoom > 1:
+			self.visible = set(self.ledIndex().region(0, 0, self.win_width, self.win_height))
+
+		colors = self.led_rendered or b''
+		if self.rasterizer is not None:
+			self.rasterizer = Rasterizer(self.win_width, self.win_height, self.led_rects, self.draw_type, order=self.led_order)
+			self.rasterizer.draw(colors)
+			self.photo.configure(data=self.rasterizer.ppm(), format='PPM')
+		else:
+			self.select([])
+			fills = ColorCorrection.hexColors(colors)
+			for widget, idx in zip(self.led_slots, self.led_order):
+				r = self.led_rects[idx]
+				self.canvas.coords(widget, r[0], r[1], r[2], r[3])
+				if self.visible is None or idx in self.visible:
+					self.canvas.itemconfigure(widget, fill=fills[idx] if idx < len(fills) else "black")
+				self.led_widgets[idx] = widget
+
+		for idx, label in enumerate(self.led_labels):
+			if label is not None:
+				r = self.led_rects[idx]
+				self.canvas.coords(label, int((r[0]+r[2])/2), int((r[1]+r[3])/2))
+
+	# ------------------------------------------------------
+	def ledIndex(self):
+		""" spatial index of the shown leds, built on first use after a layout change """
+		if self.led_index is None:
+			self.led_index = SpatialIndex(self.led_rects, self.led_order)
+		return self.led_index
+
+	# ------------------------------------------------------
+	def on_motion(self, event):
+		self.hover = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+		self.showTooltip()
+
+	# ------------------------------------------------------
+	def on_leave(self, event):
+		self.hover = None
+		self.showTooltip()
+
+	# ------------------------------------------------------
+	def showTooltip(self):
+		""" id, received and displayed color of the led under the mouse """
+		idx = None if self.hover is None else self.ledIndex().at(*self.hover)
+		if idx is None:
+			if self.tooltip is not None:
+				self.canvas.delete(*self.tooltip)
+				self.tooltip = None
+			return
+
+		raw = self.engine.led_data[idx*3:idx*3+3]
+		shown = (self.led_rendered or b'')[idx*3:idx*3+3]
+		text = "led %d\nraw %s\ncorrected %s" % (idx, bytes(raw).hex() or '-', bytes(shown).hex() or '-')
+		x, y = self.hover[0] + 12, self.hover[1] + 12
+		if self.tooltip is None:
+			self.tooltip = (self.canvas.create_rectangle(0, 0, 0, 0, fill="lightyellow", outline="black"),
+				self.canvas.create_text(x, y, anchor=tk.NW, text=text))
+		else:
+			self.canvas.itemconfigure(self.tooltip[1], text=text)
+			self.canvas.coords(self.tooltip[1], x, y)
+			self.canvas.tag_raise(self.tooltip[0])
+			self.canvas.tag_raise(self.tooltip[1])
+		x0, y0, x1, y1 = self.canvas.bbox(self.tooltip[1])
+		self.canvas.coords(self.tooltip[0], x0 - 2, y0 - 2, x1 + 2, y1 + 2)
+
+	# ------------------------------------------------------
+	def on_select_start(self, event):
+		self.drag = None
+		self.select_start = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+		self.band = self.canvas.create_rectangle(self.select_start + self.select_start, outline="yellow", dash=(4, 2))
+
+	# ------------------------------------------------------
+	def on_select(self, event):
+		if self.select_start is not None:
+			self.canvas.coords(self.band, self.select_start + (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)))
+
+	# ------------------------------------------------------
+	def on_select_end(self, event):
+		if self.select_start is None:
+			return
+		x0, y0 = self.select_start
+		x1, y1 = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+		self.select_start = None
+		self.canvas.delete(self.band)
+		self.select(self.ledIndex().region(x0, y0, x1, y1))
+		self.statusbar.setText("[%s] %d leds selected: %s" % (self.layout_type, len(self.selection), idRanges(self.selection) or '-'))
+
+	# ------------------------------------------------------
+	def select(self, leds):
+		""" highlight the outline of leds, canvas renderer only """
+		for outline, selection in (("darkgray", self.selection), ("yellow", leds)):
+			for idx in selection:
+				if idx < len(self.led_widgets) and self.led_widgets[idx] is not None:
+					self.canvas.itemconfigure(self.led_widgets[idx], outline=outline)
+		self.selection = leds
+
+	# ------------------------------------------------------
+	def on_drag_start(self, event):
+		self.drag = (event.x, event.y)
+
+	# ------------------------------------------------------
+	def on_drag(self, event):
+		if self.led_order is None or self.drag is None:
+			return
+		dx, dy = event.x - self.drag[0], event.y - self.drag[1]
+		self.drag = (event.x, event.y)
+		self.camera.rotate(dx * MainWindow.ROTATE_SPEED, dy * MainWindow.ROTATE_SPEED)
+		self.camera_moved = True
+
+	# ------------------------------------------------------
+	def on_wheel(self, event):
+		if self.led_order is None:
+			return
+		zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+		self.camera.zoomBy(MainWindow.ZOOM_STEP if zoom_in else 1.0 / MainWindow.ZOOM_STEP)
+		self.camera_moved = True
+
+	# ------------------------------------------------------
+	def menu_reset_view(self,event=None):
+		self.camera = Camera()
+		self.camera_moved = self.led_order is not None
 
 	# ------------------------------------------------------
 	def menu_open_hyperion(self):
@@ -106,11 +390,20 @@ class MainWindow(tk.Frame):
 	def menu_open_opc_yz(self):
 		self.menu_open_opc("opc_yz")
 
+	# ------------------------------------------------------
+	def menu_open_opc_3d(self):
+		self.menu_open_opc("opc_3d")
+
 	# ------------------------------------------------------
 	def menu_switch_led_type(self,event=None):
 		self.draw_type = 'circle' if self.draw_type == 'rect' else 'rect'
 		self.resetUI()
 
+	# ------------------------------------------------------
+	def menu_switch_renderer(self,event=None):
+		self.renderer = 'image' if self.renderer == 'canvas' else 'canvas'
+		self.resetUI()
+
 	# ------------------------------------------------------
 	def menu_switch_led_ids(self,event=None):
 		self.show_numbers = not self.show_numbers
@@ -144,6 +437,27 @@ class MainWindow(tk.Frame):
 			self.resetVars()
 			self.resetUI()
 
+	# ------------------------------------------------------
+	def menu_client_stats(self,event=None):
+		lines = [ "%(client)s  prio %(priority)d  %(fps).1f fps  %(bps).0f B/s  frames %(frames)d  rejected %(rejected)d" % c for c in self.opcServer.clientStats() ]
+		if not lines:
+			lines.append("no clients connected")
+		if self.engine.forwarder is not None:
+			lines += ["", "forwarding to:"] + [ target.summary() for target in self.engine.forwarder.targets ]
+		tkMessageBox.showinfo("OPC clients (merge: %s)" % self.merge, "\n".join(lines))
+
+	# ------------------------------------------------------
+	def menu_switch_perf(self,event=None):
+		self.perf.enabled = not self.perf.enabled
+		self.perf_last = self.perf.snapshot()
+		if not self.perf.enabled:
+			self.statusbar.setPerf()
+
+	# ------------------------------------------------------
+	def menu_replay_step(self,event=None):
+		if self.engine.replay is not None:
+			self.engine.replay.step()
+
 	# ------------------------------------------------------
 	def initUI(self):
 		self.parent.title("HyperSim");
@@ -157,16 +471,23 @@ class MainWindow(tk.Frame):
 		filemenu.add_command(label="Open OPC xy",   command=self.menu_open_opc_xy)
 		filemenu.add_command(label="Open OPC xz",   command=self.menu_open_opc_xz)
 		filemenu.add_command(label="Open OPC yz",   command=self.menu_open_opc_yz)
+		filemenu.add_command(label="Open OPC 3D",   command=self.menu_open_opc_3d)
 		filemenu.add_separator()
 		filemenu.add_command(label="Quit", accelerator="Ctrl+Q",  command=self.on_close)
 		
 		settingsmenu = tk.Menu(menubar, tearoff=0)
 		settingsmenu.add_command(label="switch led type",  accelerator="t", command=self.menu_switch_led_type)
+		settingsmenu.add_command(label="switch renderer (canvas/image)",  accelerator="i", command=self.menu_switch_renderer)
 		settingsmenu.add_command(label="show/hide led IDs",  accelerator="n", command=self.menu_switch_led_ids)
 		settingsmenu.add_command(label="led size +5", accelerator="+", command=self.menu_led_size_inc)
 		settingsmenu.add_command(label="led size -5", accelerator="-", command=self.menu_led_size_dec)
 		settingsmenu.add_command(label="screen 4:3", accelerator="4", command=self.menu_screen_4to3)
 		settingsmenu.add_command(label="screen 16:9", accelerator="9", command=self.menu_screen_16to9)
+		settingsmenu.add_command(label="reset 3D view", accelerator="0", command=self.menu_reset_view)
+		settingsmenu.add_separator()
+		settingsmenu.add_command(label="client statistics", accelerator="s", command=self.menu_client_stats)
+		settingsmenu.add_command(label="show/hide timings", accelerator="p", command=self.menu_switch_perf)
+		settingsmenu.add_command(label="replay next frame", accelerator=".", command=self.menu_replay_step)
 
 		menubar.add_cascade(label="File", menu=filemenu)
 		menubar.add_cascade(label="Settings", menu=settingsmenu)
@@ -175,11 +496,16 @@ class MainWindow(tk.Frame):
 
 		self.bind_all("<Control-q>", self.on_close)
 		self.bind_all("t", self.menu_switch_led_type)
+		self.bind_all("i", self.menu_switch_renderer)
 		self.bind_all("n", self.menu_switch_led_ids)
 		self.bind_all("+", self.menu_led_size_inc)
 		self.bind_all("-", self.menu_led_size_dec)
 		self.bind_all("4", self.menu_screen_4to3)
 		self.bind_all("9", self.menu_screen_16to9)
+		self.bind_all("0", self.menu_reset_view)
+		self.bind_all("s", self.menu_client_stats)
+		self.bind_all("p", self.menu_switch_perf)
+		self.bind_all(".", self.menu_replay_step)
 
 		self.frameC = tk.Frame(master=self)
 		self.frameC.pack()
@@ -190,205 +516,125 @@ class MainWindow(tk.Frame):
 	def initCanvas(self):
 		self.canvas = tk.Canvas(self.frameC, width=self.win_width, height=self.win_height)
 		self.canvas.pack()
-		self.canvas.create_rectangle(0, 0, self.win_width, self.win_height, fill="darkgray", outline="darkgray")
+		self.background = self.canvas.create_rectangle(0, 0, self.win_width, self.win_height, fill="darkgray", outline="darkgray")
+		# rotate and zoom the 3d view
+		self.canvas.bind("<ButtonPress-1>", self.on_drag_start)
+		self.canvas.bind("<B1-Motion>", self.on_drag)
+		self.canvas.bind("<MouseWheel>", self.on_wheel)
+		self.canvas.bind("<Button-4>", self.on_wheel)
+		self.canvas.bind("<Button-5>", self.on_wheel)
+		# tooltip of the led under the mouse, shift+drag selects leds
+		self.canvas.bind("<Motion>", self.on_motion)
+		self.canvas.bind("<Leave>", self.on_leave)
+		self.canvas.bind("<Shift-ButtonPress-1>", self.on_select_start)
+		self.canvas.bind("<Shift-B1-Motion>", self.on_select)
+		self.canvas.bind("<ButtonRelease-1>", self.on_select_end)
+		self.tooltip = None
+		self.selection = []
+		self.select_start = None
+		self.led_index = None
+		self.visible = None
+
+		self.rasterizer = None
+		if self.renderer == 'image':
+			# all leds are drawn into one image, see updateLeds
+			self.rasterizer = Rasterizer(self.win_width, self.win_height, self.led_rects, self.draw_type, order=self.led_order)
+			self.rasterizer.draw( len(self.led_rects) * b'\0\0\0' )
+			self.photo = tk.PhotoImage(width=self.rasterizer.width, height=self.rasterizer.height)
+			self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+
+		# led items in stacking order, far to near in the 3d view
+		self.led_widgets = [None] * len(self.led_rects)
+		self.led_slots = []
+		if self.rasterizer is None:
+			for idx in range(len(self.led_rects)) if self.led_order is None else self.led_order:
+				if self.led_rects[idx] is not None:
+					self.led_widgets[idx] = self.createLed(self.led_rects[idx])
+					self.led_slots.append(self.led_widgets[idx])
 
 		for idx, r in enumerate(self.led_rects):
-			if r is None:
-				self.led_widgets.append(None)
-			else:
-				if self.draw_type == 'circle':
-					self.led_widgets.append(self.canvas.create_oval(r[0], r[1], r[2], r[3], fill="black", outline="darkgray"))
-				else:
-					self.led_widgets.append(self.canvas.create_rectangle(r[0], r[1], r[2], r[3], fill="black", outline="darkgray"))
-
-				if self.show_numbers:
-					self.canvas.create_text( int((r[0]+r[2])/2), int((r[1]+r[3])/2), anchor=tk.W, text=str(idx))
-
-
+			self.led_labels.append(None if r is None else self.createLabel(idx, r))
 
 	# ------------------------------------------------------
-	def parseCmdArgs(self):
-		parser = argparse.ArgumentParser(description='Simulator for hyperion.', prog='hypersim')
-		group = parser.add_mutually_exclusive_group()
-		group2 = parser.add_mutually_exclusive_group()
-		
-		parser.add_argument('-n','--num', dest='show_numbers', action='store_true', help='show led IDs')
-		group2.add_argument('-c','--circle', dest='draw_type', action='store_const',const="circle",  help='draw led as circle/oval')
-		group2.add_argument('-r','--rect', dest='draw_type',   action='store_const',const="rect", help='draw led as rect (default)')
-		group.add_argument('--hyperion', default=None, metavar="<file>", help='hyperion config')
-		group.add_argument('--opc_xy'  , default=None, metavar="<file>", help='opc config xy components')
-		group.add_argument('--opc_yz'  , default=None, metavar="<file>", help='opc config yz components')
-		group.add_argument('--opc_xz'  , default=None, metavar="<file>", help='opc config xz components')
-		parser.add_argument('--led_size', default=15, metavar="<pixel>", type=int, help='pixel size of a single led (default: 15)')
-		parser.add_argument('--port', default=7890, metavar="<port>", type=int, help='set port of OPC-server (default: 7890)')
-		parser.add_argument('-w','--wide', dest='wideScreen', default=False, action='store_true', help='set to 16:9 format')
-
-		args = parser.parse_args()
-		
-		self.OPCport = args.port
-		self.show_numbers = args.show_numbers
-		self.wideScreen = args.wideScreen
-		self.draw_type = 'rect' if args.draw_type is None else args.draw_type
-		self.led_size = args.led_size
-		
-		if args.hyperion is not None:
-			self.layout_file = os.path.realpath( args.hyperion )
-			self.layout_type = "hyperion"
-			if not os.path.exists(self.layout_file):
-				print("could not read ", self.layout_file)
-				exit(1)
+	def createLed(self, r, fill="black"):
+		if self.draw_type == 'circle':
+			return self.canvas.create_oval(r[0], r[1], r[2], r[3], fill=fill, outline="darkgray")
+		return self.canvas.create_rectangle(r[0], r[1], r[2], r[3], fill=fill, outline="darkgray")
 
-		for k in args.__dict__:
-			if k in ['opc_xy','opc_yz','opc_xz'] and args.__dict__[k] is not None:
-				self.layout_file = os.path.realpath( args.__dict__[k] )
-				self.layout_type = k
-				if not os.path.exists(self.layout_file):
-					print("could not read ", self.layout_file)
-					exit(1)
-				break
+	# ------------------------------------------------------
+	def createLabel(self, idx, r):
+		if not self.show_numbers:
+			return None
+		return self.canvas.create_text( int((r[0]+r[2])/2), int((r[1]+r[3])/2), anchor=tk.W, text=str(idx), tags='label')
 
 	# ------------------------------------------------------
 	def on_close(self,event=None):
-		self.opcServer.stop()
-		self.opcServer.join()
+		self.after_cancel(self.render_job)
+		self.after_cancel(self.watch_job)
+		self.engine.stop()
 		self.parent.destroy()
 
 	# ------------------------------------------------------
-	def readConfig_hyperion(self,layout_file):
-		with open(layout_file) as data_file:
-			data = ""
-			cfg_data = data_file.read()
-			for line in cfg_data.splitlines():
-				data += line.split('//')[0]
-			hyperion_cfg = json.loads(data)
-
-			try:
-				#print ("Test for hyperion records")
-				test_hyperion = hyperion_cfg['leds'][0]['hscan']
-
-			except Exception as e:
-				#print ("Test for hyperion.ng records")
-				try:
-					test_hyperion_ng = hyperion_cfg[0]['hmax']
-
-				except Exception as e:
-				    	raise Exception ("Not a hyperion nor hyperion-ng file")
-				else:
-					#print ("hyperion.ng records found")
-					for led in hyperion_cfg:
-						self.led_rects.append([
-							int(led['hmin'] * self.win_width),
-							int(led['vmin'] * self.win_height),
-							int(led['hmax'] * self.win_width),
-							int(led['vmax'] * self.win_height)
-						])
-			else:
-				#print ("hyperion records found")
-				for led in hyperion_cfg['leds']:
-					self.led_rects.append([
-						int(led['hscan']['minimum'] * self.win_width),
-						int(led['vscan']['minimum'] * self.win_height),
-						int(led['hscan']['maximum'] * self.win_width),
-						int(led['vscan']['maximum'] * self.win_height)
-						])
-
-	# ------------------------------------------------------
-	def readConfig_opc(self,layout_file,a_val_idx,b_val_idx):
-		a_values = []
-		b_values = []
-		a_values_tmp = []
-		b_values_tmp = []
-		with open(layout_file) as data_file:
-			opc_cfg = json.load(data_file)
-
-			for d in opc_cfg:
-				if len(d['point']) > 0:
-					a_values.append(d['point'][a_val_idx])
-					b_values.append(d['point'][b_val_idx])
-					a_values_tmp.append(d['point'][a_val_idx])
-					b_values_tmp.append(d['point'][b_val_idx])
-				else:
-					a_values.append(None)
-					b_values.append(None)
-
-			#tkMessageBox.showerror("Open Config File", "here")
-
-			if len(a_values) != len(b_values) or len(a_values) == 0:
-				print("error while loading layout file")
-				return
-
-			a_values_max = max(a_values_tmp)
-			a_values_min = min(a_values_tmp)
-			b_values_max = max(b_values_tmp)
-			b_values_min = min(b_values_tmp)
-			
-			if a_values_max - a_values_min == 0:
-				a_values_max = a_values_min + 1
-
-			if b_values_max - b_values_min == 0:
-				b_values_max = b_values_min + 1
-
-			# calc ratio
-			self.win_height = 800
-			while True:
-				self.win_height = self.win_width * (abs(b_values_max - b_values_min) / abs(a_values_max - a_values_min))
-				if self.win_height < 800:
-					break
-				else:
-					self.win_width -= 10
-
-			norm_a = lambda x: (x - a_values_min) / (a_values_max - a_values_min);
-			norm_b = lambda x: (x - b_values_min) / (b_values_max - b_values_min);
-
-			led_margin = 5
-			canvas_gap = led_margin*2 + self.led_size
-			
-			for idx in range(len(a_values)):
-				if a_values[idx] is None:
-					self.led_rects.append(None)
-				else:
-					self.led_rects.append([
-						int(norm_a(a_values[idx]) * (self.win_width -canvas_gap)+ led_margin),
-						int(norm_a(b_values[idx]) * (self.win_height-canvas_gap)+ led_margin),
-						int(norm_a(a_values[idx]) * (self.win_width -canvas_gap)+ self.led_size+led_margin),
-						int(norm_a(b_values[idx]) * (self.win_height-canvas_gap)+ self.led_size+led_margin)
-					])
-
-	# ------------------------------------------------------
-	def readConfig(self,layout_file, layout_type="hyperion"):
-			opc_map = {'opc_xy' : (0,1),'opc_xz' : (0,2),'opc_yz' : (1,2) }
-			
-			try:
-				if layout_type == "hyperion":
-					self.readConfig_hyperion(layout_file)
-				elif layout_type in opc_map:
-					self.readConfig_opc(layout_file, opc_map[layout_type][0], opc_map[layout_type][1])
-				else:
-					print("unknown type of config file")
-					exit(1)
-			except Exception as e:
-				tkMessageBox.showerror("Open Config File", "Failed to open '%s' file \n'%s'\n%s" % (self.layout_type, self.layout_file, e))
+	def renderColors(self, colors):
+		# only touch the leds that changed since the last rendered frame
+		count = min(len(colors) // 3, len(self.led_rects))
+		changed = changed_leds(colors, self.led_rendered, count)
+		self.led_rendered = colors
+		self.leds_checked += count
+		self.leds_changed += len(changed)
+
+		if not changed:
+			return
+
+		if self.rasterizer is not None:
+			self.rasterizer.draw(colors, None if len(changed) == count else changed)
+			self.photo.configure(data=self.rasterizer.ppm(), format='PPM')
+			return
+
+		fills = ColorCorrection.hexColors(colors)
+		visible = self.visible
+		for idx in changed:
+			if self.led_widgets[idx] is not None and (visible is None or idx in visible):
+				self.canvas.itemconfigure(self.led_widgets[idx], fill=fills[idx])
 
 	# ------------------------------------------------------
-	def updateLeds(self, led_data):
-		self.led_data = led_data
-		color = lambda i,c:self.clut[c][ led_data[i][c] ]
-
-		for idx in range(len(led_data)):
-			if idx < len(self.led_widgets):
-				if self.led_widgets[idx] is not None:
-					self.canvas.itemconfigure(self.led_widgets[idx], fill="#%02x%02x%02x" % (color(idx,0), color(idx,1), color(idx,2) ) )
+	def renderFrames(self):
+		start = time.monotonic()
+		timed = self.perf.enabled
+		if timed and self.render_end is not None:
+			# includes the redraw tk does for the items changed in the last frame
+			self.perf.add('idle', start - self.render_end)
+		if self.camera_moved:
+			self.updateProjection()
+		colors = self.engine.poll(start)
+		if colors is not None:
+			if timed:
+				drawn = time.perf_counter()
+			self.renderColors(colors)
+			if timed:
+				self.perf.add('tk', time.perf_counter() - drawn)
+			if self.tooltip is not None:
+				self.showTooltip()
+
+		if start - self.stats_time >= 1.0:
+			self.updateStats(start)
+
+		# keep the frame rate, but always give tk some time to breathe
+		self.render_end = time.monotonic()
+		delay = 1.0/self.max_fps - (self.render_end - start)
+		self.render_job = self.after(max(1, int(delay*1000)), self.renderFrames)
 
 	# ------------------------------------------------------
-	def calculateCLUTs(self):
-		for c in range(3):
-			for i in range(256):
-				self.clut[c][i] = int(min(255,(i ** self.gamma) * self.whitepoint[c] ))
-
-	# ------------------------------------------------------
-	def setColorCorrection(self, gamma, whitepoint):
-		self.gamma = gamma
-		self.whitepoint = whitepoint
-		
-		self.calculateCLUTs()
-		self.updateLeds(self.led_data)
+	def updateStats(self, now):
+		stats = self.engine.stats()
+		elapsed = now - self.stats_time
+		rate = lambda key: (stats[key] - self.stats_last[key]) / elapsed
+		changed = 100.0 * self.leds_changed / self.leds_checked if self.leds_checked else 0.0
+		self.statusbar.setStats("clients %d | in %.1f fps | out %.1f fps | dropped %d | changed %.1f%%" % (stats['clients'], rate('received'), rate('rendered'), stats['dropped'], changed) )
+		self.leds_checked = self.leds_changed = 0
+		self.stats_time = now
+		self.stats_last = stats
+		if self.perf.enabled:
+			perf = self.perf.snapshot()
+			self.statusbar.setPerf(summary(perf, self.perf_last))
+			self.perf_last = perf
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Render OPC streams into image sequences or raw video, without tk.
+
+Frames come from a raw OPC dump or a --record capture, played as fast as
+possible, or live from clients. Every output frame shows the state of the
+stream at frame number / fps seconds, like the simulator window would:
+
+	offlinerender.py --opc_xy wall.json --capture show.hscap --out frames/%05d.png
+	offlinerender.py --hyperion hyperion.config.json --capture show.opc --out show.rgb
+	offlinerender.py --opc_xy wall.json --capture show.hscap --out - | \\
+		ffmpeg -f rawvideo -pix_fmt rgb24 -s 800x600 -r 30 -i - show.mp4
+	offlinerender.py --opc_xy wall.json --listen 7890 --duration 60 --out live.rgb
+
+Outputs: a file name with a %d placeholder writes one .ppm or .png per
+frame, a .rgb file or - (stdout) gets all frames as raw rgb24. The frame
+size is printed at start.
+
+Leds are drawn with the masks of the Rasterizer, only leds that changed
+color are written, and unchanged frames are not encoded again.
+"""
+
+import argparse, json, os, struct, sys, time, zlib
+
+from channelmap import ChannelMap
+from engine import HyperSimEngine
+from framediff import changed_leds
+from layout import LAYOUT_TYPES, readConfig
+from opcserver import OPCserver
+from rasterizer import Rasterizer
+from replay import openCapture
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# ======================================================
+class OfflineRenderer(object):
+	"""The display part of the simulator on top of a Rasterizer.
+
+	Messages take the path of the simulator: a HyperSimEngine merges the
+	channels, applies color correction and firmware sysEx and, if enabled,
+	interpolates. With a port the engine receives from clients after
+	start(), without one apply() feeds it the OPC messages of a capture in
+	order. render() returns the frame buffer with the state at a given time.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, led_rects, width, height, draw_type='rect', channels=None, color=None, interpolate=False, merge='latest', port=None):
+		self.led_rects = led_rects
+		self.rasterizer = Rasterizer(width, height, led_rects, draw_type)
+		self.rasterizer.draw(len(led_rects) * b'\0\0\0')
+		self.engine = HyperSimEngine(port=port, merge=merge, channels=channels, color=color, interpolate=interpolate)
+		self.engine.setLeds(led_rects)
+		self.client = self.engine.opcServer.connect(('capture', 0))
+		self.colors = None
+		self.changed = True
+
+	# ------------------------------------------------------
+	def start(self):
+		self.engine.start()
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.engine.stop()
+
+	# ------------------------------------------------------
+	def apply(self, channel, cmd, data):
+		self.engine.opcServer.process(self.client, channel, cmd, data)
+
+	# ------------------------------------------------------
+	def render(self, now=None):
+		""" the frame buffer (width*height rgb bytes) at now, changed tells whether it differs from the last one """
+		self.changed = False
+		colors = self.engine.poll(now)
+		if colors is None:
+			return self.rasterizer.frame
+
+		count = len(self.led_rects)
+		leds = changed_leds(colors, self.colors, count)
+		self.colors = colors
+		if leds:
+			self.rasterizer.draw(colors, None if len(leds) == count else leds)
+			self.changed = True
+		return self.rasterizer.frame
+
+
+# ------------------------------------------------------
+def pngBytes(width, height, frame, level=1):
+	""" frame (rgb bytes) as png file, rows unfiltered """
+	stride = width * 3
+	raw = bytearray((stride + 1) * height)
+	for y in range(height):
+		raw[y*(stride+1)+1:(y+1)*(stride+1)] = frame[y*stride:(y+1)*stride]
+
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+	return (PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+		chunk(b'IDAT', zlib.compress(bytes(raw), level)) + chunk(b'IEND', b''))
+
+
+# ======================================================
+class ImageSequence(object):
+	""" one ppm or png file per frame, pattern holds a %d placeholder """
+
+	# ------------------------------------------------------
+	def __init__(self, pattern, width, height, level=1):
+		self.pattern = pattern
+		self.width = width
+		self.height = height
+		self.level = level
+		self.png = pattern.lower().endswith('.png')
+		self.encoded = None
+		self.frames = 0
+		directory = os.path.dirname(pattern % 0)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+
+	# ------------------------------------------------------
+	def write(self, frame, changed=True):
+		if changed or self.encoded is None:
+			if self.png:
+				self.encoded = pngBytes(self.width, self.height, frame, self.level)
+			else:
+				self.encoded = b'P6 %d %d 255 ' % (self.width, self.height) + frame
+		with open(self.pattern % self.frames, 'wb') as f:
+			f.write(self.encoded)
+		self.frames += 1
+
+	# ------------------------------------------------------
+	def close(self):
+		pass
+
+
+# ======================================================
+class RawVideo(object):
+	""" all frames as raw rgb24 into one file or stdout ('-') """
+
+	# ------------------------------------------------------
+	def __init__(self, path):
+		self.file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+		self.frames = 0
+
+	# ------------------------------------------------------
+	def write(self, frame, changed=True):
+		self.file.write(frame)
+		self.frames += 1
+
+	# ------------------------------------------------------
+	def close(self):
+		if self.file is not sys.stdout.buffer:
+			self.file.close()
+		else:
+			self.file.flush()
+
+
+# ------------------------------------------------------
+def openOutput(path, width, height, level=1):
+	if path == '-' or path.lower().endswith('.rgb'):
+		return RawVideo(path)
+	if '%' in path and path.lower().endswith(('.png', '.ppm')):
+		return ImageSequence(path, width, height, level)
+	raise ValueError("unknown output '%s': use a .ppm or .png name with a %%d placeholder, a .rgb file or -" % path)
+
+
+# ------------------------------------------------------
+def renderCapture(capture, renderer, output, fps=30.0, start=0.0, duration=None):
+	""" write the frames of a capture from start seconds on, returns seconds of the show rendered """
+	frame_time = 1.0 / fps
+	count = 0
+	end = None if duration is None else start + duration
+	next_time = start
+	for seconds, channel, cmd, data in capture.frames(start):
+		# every frame shows all messages up to its time
+		while seconds > next_time:
+			if end is not None and next_time >= end:
+				return count * frame_time
+			frame = renderer.render(next_time)
+			output.write(frame, renderer.changed)
+			count += 1
+			next_time = start + count * frame_time
+		renderer.apply(channel, cmd, data)
+
+	if end is None or next_time < end:
+		output.write(renderer.render(next_time), renderer.changed)
+		count += 1
+	return count * frame_time
+
+
+# ------------------------------------------------------
+def renderLive(renderer, output, fps=30.0, duration=None):
+	""" receive with the renderer started on its port and write a frame every 1/fps seconds until duration or ctrl+c """
+	renderer.start()
+	started = time.monotonic()
+	count = 0
+	try:
+		while duration is None or count < duration * fps:
+			delay = started + count / fps - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			output.write(renderer.render(), renderer.changed)
+			count += 1
+	except KeyboardInterrupt:
+		pass
+	finally:
+		renderer.stop()
+	return count / fps
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Render OPC streams into images or raw video.', prog='offlinerender.py')
+	group = parser.add_mutually_exclusive_group(required=True)
+	for layout_type in LAYOUT_TYPES:
+		group.add_argument('--'+layout_type, default=None, metavar="<file>", help='%s layout' % layout_type)
+	source = parser.add_mutually_exclusive_group(required=True)
+	source.add_argument('--capture', default=None, metavar="<file>", help='raw OPC dump or hypersim --record capture')
+	source.add_argument('--listen', default=None, type=int, metavar="<port>", help='render what OPC clients send to this port')
+	parser.add_argument('--out', required=True, metavar="<file>", help='frames/%%05d.png, frames/%%05d.ppm, video.rgb or - for raw rgb24 on stdout')
+	parser.add_argument('--fps', default=30.0, type=float, metavar="<rate>", help='frames per second of the output (default: 30)')
+	parser.add_argument('--start', default=0.0, type=float, metavar="<seconds>", help='start position in the capture')
+	parser.add_argument('--duration', default=None, type=float, metavar="<seconds>", help='length of the output (default: whole capture, live until ctrl+c)')
+	parser.add_argument('--capture_fps', default=60.0, type=float, metavar="<rate>", help='frame rate of raw OPC dumps (default: 60)')
+	parser.add_argument('--led_size', default=15, type=int, metavar="<pixel>", help='pixel size of a single led (default: 15)')
+	parser.add_argument('-c','--circle', dest='draw_type', default='rect', action='store_const', const='circle', help='draw led as circle/oval')
+	parser.add_argument('-w','--wide', dest='wideScreen', default=False, action='store_true', help='set to 16:9 format')
+	parser.add_argument('--channels', default=None, metavar="<map>", help='map OPC channels to leds, see hypersim --channels')
+	parser.add_argument('--color', default=None, metavar="<file>", help='fadecandy color correction json')
+	parser.add_argument('--interpolate', default=False, action='store_true', help='fade between frames and dither like the fadecandy firmware, see hypersim --interpolate')
+	parser.add_argument('--merge', default='latest', choices=OPCserver.MERGE_POLICIES, help='how frames of concurrent --listen clients are combined (default: latest)')
+	parser.add_argument('--png_level', default=1, type=int, choices=range(0, 10), metavar="<0-9>", help='zlib level of png files (default: 1)')
+	args = parser.parse_args()
+
+	try:
+		layout_type = [ t for t in LAYOUT_TYPES if getattr(args, t) is not None ][0]
+		led_rects, width, height = readConfig(getattr(args, layout_type), layout_type, 1067 if args.wideScreen else 800, 600, args.led_size)
+		width, height = int(width), int(height)
+		color = None
+		if args.color is not None:
+			with open(args.color) as color_file:
+				color = json.load(color_file)
+			color = color.get('color', color)
+		output = openOutput(args.out, width, height, args.png_level)
+		if args.out == '-':
+			# frames go to stdout, messages of the engine to stderr
+			sys.stdout = sys.stderr
+		renderer = OfflineRenderer(led_rects, width, height, args.draw_type, ChannelMap.parse(args.channels), color, args.interpolate, args.merge, args.listen)
+		capture = openCapture(args.capture, max(1.0, args.capture_fps)) if args.capture is not None else None
+	except (OSError, ValueError, AttributeError) as e:
+		parser.error(str(e))
+
+	print("%d leds, %dx%d pixels, %g fps" % (len(led_rects), width, height, args.fps), file=sys.stderr)
+	started = time.monotonic()
+	try:
+		if capture is not None:
+			seconds = renderCapture(capture, renderer, output, args.fps, args.start, args.duration)
+		else:
+			seconds = renderLive(renderer, output, args.fps, args.duration)
+	finally:
+		output.close()
+	elapsed = max(1e-6, time.monotonic() - started)
+	print("rendered %d frames (%.1f s) in %.2f s: %.1f fps, %.1fx real time" % (output.frames, seconds, elapsed, output.frames / elapsed, seconds / elapsed), file=sys.stderr)
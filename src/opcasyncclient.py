@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""asyncio client for Open Pixel Control
+
+put_pixels() never blocks: messages go into a small queue that a
+background task sends. The connection is kept in the background, lost
+connections are noticed as soon as the server closes them and are
+reestablished with exponential backoff. If the server is slow or absent
+the queue drops the oldest messages, so the animation keeps its timing.
+
+	import asyncio
+	from opcasyncclient import OPCasyncClient
+
+	async def main():
+		client = OPCasyncClient('localhost:7890')
+		client.start()
+		while True:
+			client.put_pixels(my_pixels)       # returns at once
+			await asyncio.sleep(1/60.0)
+		await client.stop()
+
+	asyncio.run(main())
+
+stats() returns the number of sent and dropped messages, reconnects and the
+latency from put_pixels() until the message is written to the socket.
+"""
+
+import asyncio, struct, time
+from collections import deque
+
+from opcclient import pixel_data
+
+
+class OPCasyncClient(object):
+
+	# ----------------------------
+	def __init__(self, server_ip_port='localhost:7890', queue_size=4, min_backoff=0.1, max_backoff=5.0, verbose=False):
+		"""server_ip_port is an ip:port or hostname:port as a single string.
+
+		queue_size is the number of messages kept while sending lags behind,
+		older ones are dropped. Reconnects wait min_backoff seconds after the
+		first failure, doubling up to max_backoff.
+
+		"""
+		self.verbose = verbose
+		self._ip, self._port = server_ip_port.split(':')
+		self._port = int(self._port)
+		self.min_backoff = min_backoff
+		self.max_backoff = max_backoff
+
+		self.queue = deque()
+		self.queue_size = queue_size
+		self.latencies = deque(maxlen=1000)
+		self.connected = False
+		self.sent = 0
+		self.dropped = 0
+		self.reconnects = 0
+
+		self._pending = None
+		self._task = None
+
+	# ----------------------------
+	def _debug(self, m):
+		if self.verbose:
+			print('	%s' % str(m))
+
+	# ----------------------------
+	def start(self):
+		"""Start the background connection, needs a running event loop."""
+		if self._task is None:
+			self._pending = asyncio.Event()
+			if self.queue:
+				self._pending.set()
+			self._task = asyncio.ensure_future(self._run())
+
+	# ----------------------------
+	async def stop(self):
+		if self._task is not None:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+		self.connected = False
+
+	# ----------------------------
+	def _queue(self, message):
+		if len(self.queue) >= self.queue_size:
+			self.queue.popleft()
+			self.dropped += 1
+		self.queue.append((time.monotonic(), message))
+		if self._pending is not None:
+			self._pending.set()
+
+	# ----------------------------
+	def put_pixels(self, pixels, channel=0):
+		"""Queue pixels for the given channel, see OPCclient.put_pixels.
+
+		Return True if the client is connected right now.
+
+		"""
+		return self.put_frames([(channel, pixels)])
+
+	# ----------------------------
+	def put_frames(self, frames):
+		"""Queue the pixels of several channels, [(channel, pixels), ...], as one message."""
+		parts = []
+		for channel, pixels in frames:
+			data = pixel_data(pixels)
+			if len(data) > 0xffff:
+				raise ValueError("OPC message too long: %d bytes" % len(data))
+			parts.append(struct.pack(">BBH", channel, 0, len(data)))
+			parts.append(data)
+		self._queue(b''.join(parts))
+		return self.connected
+
+	# ----------------------------
+	def sysEx(self, systemId, commandId, msg):
+		self._queue(struct.pack(">BBHHH", 0, 0xFF, len(msg) + 4, systemId, commandId) + msg)
+		return self.connected
+
+	# ----------------------------
+	def stats(self):
+		latencies = sorted(self.latencies)
+		percentile = lambda p: latencies[min(len(latencies)-1, int(p * len(latencies)))] if latencies else 0.0
+		return {'connected': self.connected, 'queued': len(self.queue), 'sent': self.sent, 'dropped': self.dropped,
+			'reconnects': self.reconnects, 'latency_p50': percentile(0.5), 'latency_p95': percentile(0.95),
+			'latency_max': latencies[-1] if latencies else 0.0}
+
+	# ----------------------------
+	async def _run(self):
+		backoff = self.min_backoff
+		while True:
+			try:
+				self._debug('connecting to %s:%d' % (self._ip, self._port))
+				reader, writer = await asyncio.open_connection(self._ip, self._port)
+			except OSError as e:
+				self._debug('connect failed: %s, retry in %.1f s' % (e, backoff))
+				await asyncio.sleep(backoff)
+				backoff = min(self.max_backoff, backoff * 2)
+				continue
+
+			self._debug('connected')
+			self.connected = True
+			backoff = self.min_backoff
+			sender = asyncio.ensure_future(self._send(writer))
+			watcher = asyncio.ensure_future(self._watch(reader))
+			try:
+				await asyncio.wait([sender, watcher], return_when=asyncio.FIRST_COMPLETED)
+			finally:
+				self.connected = False
+				sender.cancel()
+				watcher.cancel()
+				writer.close()
+			self._debug('connection lost')
+			self.reconnects += 1
+			await asyncio.sleep(self.min_backoff)
+
+	# ----------------------------
+	async def _send(self, writer):
+		while True:
+			await self._pending.wait()
+			self._pending.clear()
+			batch = list(self.queue)
+			self.queue.clear()
+			for queued, message in batch:
+				writer.write(message)
+			try:
+				await writer.drain()
+			except OSError:
+				self.dropped += len(batch)
+				return
+			now = time.monotonic()
+			self.sent += len(batch)
+			self.latencies.extend(now - queued for queued, message in batch)
+
+	# ----------------------------
+	async def _watch(self, reader):
+		# OPC servers do not answer, reading only notices a closed connection
+		try:
+			while await reader.read(1024):
+				pass
+		except OSError:
+			pass
+
+
+if __name__ == "__main__":
+	import colorsys
+
+	async def rainbow(ledCount=128, fps=60):
+		client = OPCasyncClient(verbose=True)
+		client.start()
+		ledData = bytearray()
+		for i in range(ledCount):
+			ledData.extend(int(255*c) for c in colorsys.hsv_to_rgb(float(i)/ledCount, 1.0, 1.0))
+
+		last = time.monotonic()
+		while True:
+			client.put_pixels(ledData)
+			ledData = ledData[-3:] + ledData[:-3]
+			await asyncio.sleep(1.0/fps)
+			if time.monotonic() - last >= 5:
+				last = time.monotonic()
+				print("sent %(sent)d  dropped %(dropped)d  reconnects %(reconnects)d  latency p50 %(latency_p50).4f s  p95 %(latency_p95).4f s" % client.stats())
+
+	try:
+		asyncio.run(rainbow())
+	except KeyboardInterrupt:
+		print()
@@ -38,16 +38,76 @@ Recommended use:
 import socket, time
 import struct
 import sys
+from itertools import chain
+try:
+	import numpy as np
+except ImportError:
+	np = None
 try:
 	import json
 except ImportError:
 	import simplejson as json
 
+# HyperSim's own sysEx system id and commands
+HYPERSIM_SYSEX_ID = 0x4853
+SYSEX_FRAGMENT    = 1
+SYSEX_PRIORITY    = 2
+
+# largest udp payload that fits in an ethernet frame without ip fragmentation
+UDP_MAX_DATAGRAM = 1472
+
+
+# ----------------------------
+def udp_fragments(packet, max_size=UDP_MAX_DATAGRAM):
+	"""Split an OPC message into datagrams of at most max_size bytes.
+
+	Messages that fit are sent as they are. Larger ones are wrapped into
+	HyperSim fragment sysEx messages that carry the original channel,
+	command, total length and the offset of the fragment:
+
+		0, 0xFF, len, 'HS', SYSEX_FRAGMENT, channel, command, total, offset, data
+
+	"""
+	if len(packet) <= max_size:
+		yield packet
+		return
+
+	channel, command = packet[0], packet[1]
+	data = memoryview(packet)[4:]
+	chunk = max_size - 14
+	for offset in range(0, len(data), chunk):
+		part = data[offset:offset+chunk]
+		yield struct.pack(">BBHHHBBHH", 0, 0xFF, len(part) + 10, HYPERSIM_SYSEX_ID, SYSEX_FRAGMENT, channel, command, len(data), offset) + part
+
+
+# ----------------------------
+def pixel_data(pixels):
+	"""Pixel data as bytes-like object, without copying where possible.
+
+	bytes, bytearray and memoryview are used as they are. NumPy arrays are
+	clamped to 0-255 unless they are uint8 already. Lists of rgb tuples are
+	clamped and rounded down.
+
+	"""
+	if isinstance(pixels, (bytes, bytearray)):
+		return pixels
+	if isinstance(pixels, memoryview):
+		return pixels if pixels.ndim == 1 and pixels.format == 'B' else pixels.cast('B')
+	if np is not None and isinstance(pixels, np.ndarray):
+		if pixels.dtype != np.uint8:
+			pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+		return memoryview(np.ascontiguousarray(pixels)).cast('B')
+	try:
+		# fine as long as all values are ints in range
+		return bytes(chain.from_iterable(pixels))
+	except (TypeError, ValueError):
+		return bytes(min(255, max(0, int(v))) for pixel in pixels for v in pixel)
+
 
 class OPCclient(object):
 
 	# ----------------------------
-	def __init__(self, server_ip_port='localhost:7890', long_connection=True, verbose=False):
+	def __init__(self, server_ip_port='localhost:7890', long_connection=True, verbose=False, udp=False):
 		"""Create an OPC client object which sends pixels to an OPC server.
 
 		server_ip_port should be an ip:port or hostname:port as a single string.
@@ -68,8 +128,12 @@ class OPCclient(object):
 
 		If verbose is True, the client will print debugging info to the console.
 
+		If udp is True, messages are sent as datagrams to a HyperSim udp port,
+		messages bigger than a datagram are fragmented (see udp_fragments).
+
 		"""
 		self.verbose = verbose
+		self.udp = udp
 
 		self._long_connection = long_connection
 
@@ -78,6 +142,12 @@ class OPCclient(object):
 
 		self._socket = None  # will be None when we're not connected
 
+		# reused for every send, see _header and _join
+		self._headers = bytearray(4*256)
+		self._header_view = memoryview(self._headers)
+		self._buffer = bytearray(0)
+		self._buffer_view = memoryview(self._buffer)
+
 		self.noDither = False
 		self.noInterp = False
 		self.manualLED = False
@@ -101,7 +171,7 @@ class OPCclient(object):
 
 		try:
 			self._debug('_ensure_connected: trying to connect...')
-			self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if self.udp else socket.SOCK_STREAM)
 			self._socket.connect((self._ip, self._port))
 			self._debug('_ensure_connected:	...success')
 			return True
@@ -110,6 +180,21 @@ class OPCclient(object):
 			self._socket = None
 			return False
 
+	# ----------------------------
+	@property
+	def connected(self):
+		"""True while a connection to the server is open."""
+		return self._socket is not None
+
+	# ----------------------------
+	def connect(self):
+		"""Connect unless already connected.
+
+		Return True on success or False on failure.
+
+		"""
+		return self._ensure_connected()
+
 	# ----------------------------
 	def disconnect(self):
 		"""Drop the connection to the server, if there is one."""
@@ -134,18 +219,88 @@ class OPCclient(object):
 		return success
 
 	# ----------------------------
-	def send(self, packet):
+	def _header(self, index, channel, command, length):
+		"""Header of the index-th message of a send, packed into a reused buffer."""
+		if length > 0xffff:
+			raise ValueError("OPC message too long: %d bytes" % length)
+		if 4*index + 4 > len(self._headers):
+			self._headers = bytearray(2*len(self._headers))
+			self._header_view = memoryview(self._headers)
+		struct.pack_into(">BBH", self._headers, 4*index, channel, command, length)
+		return self._header_view[4*index:4*index+4]
+
+	# ----------------------------
+	def _join(self, buffers):
+		"""Copy buffers into the reused send buffer, returns a view of the used part."""
+		size = sum(len(b) for b in buffers)
+		if size > len(self._buffer):
+			self._buffer = bytearray(size)
+			self._buffer_view = memoryview(self._buffer)
+		offset = 0
+		for b in buffers:
+			self._buffer[offset:offset+len(b)] = b
+			offset += len(b)
+		return self._buffer_view[:size]
+
+	# ----------------------------
+	def _sendmsg(self, buffers):
+		sent = self._socket.sendmsg(buffers)
+		# the kernel may take only a part, send the rest like sendall does
+		for b in buffers:
+			if sent >= len(b):
+				sent -= len(b)
+				continue
+			self._socket.sendall(memoryview(b)[sent:])
+			sent = 0
+
+	# ----------------------------
+	def _send(self, buffers):
+		"""Send buffers which together hold one or more complete OPC messages.
+
+		TCP sends all of them with one scatter-gather sendmsg, udp sends each
+		message on its own (see udp_fragments). Return True on success or
+		False if the connection is lost.
+
+		"""
 		self._debug('put_pixels: sending pixels to server')
 		try:
-			self._socket.send(packet)
+			if self.udp:
+				packet = self._join(buffers)
+				offset = 0
+				while offset < len(packet):
+					end = offset + 4 + (packet[offset+2] << 8 | packet[offset+3])
+					for datagram in udp_fragments(packet[offset:end]):
+						self._socket.send(datagram)
+					offset = end
+			elif hasattr(self._socket, 'sendmsg'):
+				self._sendmsg(buffers)
+			else:
+				self._socket.sendall(self._join(buffers))
 		except socket.error:
 			self._debug('put_pixels: connection lost.  could not send pixels.')
 			self._socket = None
 			return False
-	
+
 		if not self._long_connection:
 			self._debug('put_pixels: disconnecting')
 			self.disconnect()
+		return True
+
+	# ----------------------------
+	def send_buffers(self, buffers):
+		"""Send buffers which together hold complete OPC messages, e.g. headers
+		and payloads that are kept apart, without joining them first.
+
+		Return True on success or False on failure. Does not connect, see
+		connect().
+
+		"""
+		return self._send(buffers)
+
+	# ----------------------------
+	def send(self, packet):
+		"""Send a complete OPC message. Return True on success or False on failure."""
+		return self._send([packet])
 
 	# ----------------------------
 	def put_pixels(self, pixels, channel=0):
@@ -161,6 +316,10 @@ class OPCclient(object):
 			Floats will be rounded down to integers.
 			Values outside the legal range will be clamped.
 
+			Much faster: bytes, bytearray or memoryview with r, g, b bytes, or
+			a NumPy array of any shape, e.g. (n, 3). These are sent without
+			being copied.
+
 		Will establish a connection to the server as needed.
 
 		On successful transmission of pixels, return True.
@@ -170,6 +329,19 @@ class OPCclient(object):
 		with the first LED.  It's not possible to send a color just to one
 		LED at a time (unless it's the first one).
 
+		"""
+		return self.put_frames([(channel, pixels)])
+
+	# ----------------------------
+	def put_frames(self, frames):
+		"""Send the pixels of several channels at once.
+
+		frames: A list of (channel, pixels) with pixels like for put_pixels.
+			Over TCP all messages go out with a single system call.
+
+		On successful transmission of pixels, return True.
+		On failure (bad connection), return False.
+
 		"""
 		self._debug('put_pixels: connecting')
 		is_connected = self._ensure_connected()
@@ -177,20 +349,12 @@ class OPCclient(object):
 			self._debug('put_pixels: not connected.  ignoring these pixels.')
 			return False
 
-		# build OPC message
-		len_hi_byte = int(len(pixels)*3 / 256)
-		len_lo_byte = (len(pixels)*3) % 256
-		command = 0  # set pixel colors from openpixelcontrol.org
-
-		header = struct.pack("BBBB", channel, command, len_hi_byte, len_lo_byte)
-		pieces = [ struct.pack( "BBB",
-					 min(255, max(0, int(r))),
-					 min(255, max(0, int(g))),
-					 min(255, max(0, int(b)))) for r, g, b in pixels ]
-
-		self.send( header + b''.join(pieces) )
-
-		return True
+		buffers = []
+		for index, (channel, pixels) in enumerate(frames):
+			payload = pixel_data(pixels)
+			buffers.append(self._header(index, channel, 0, len(payload)))  # command 0: set pixel colors
+			buffers.append(payload)
+		return self._send(buffers)
 
 
 	# ----------------------------
@@ -202,6 +366,16 @@ class OPCclient(object):
 		header = struct.pack(">BBHHH", 0, 0xFF, len(msg) + 4, systemId, commandId)
 		self.send(header + msg)
 
+	# ----------------------------
+	def setPriority(self, priority):
+		"""Set the priority of this connection for a HyperSim server running with
+		--merge priority, e.g. to tell apart senders on the same host.
+
+		priority: int in the range -32768..32767, higher wins.
+
+		"""
+		return self.sysEx(HYPERSIM_SYSEX_ID, SYSEX_PRIORITY, struct.pack(">h", priority))
+
 	# ----------------------------
 	def setGlobalColorCorrection(self, gamma=1.0, rgb=(1.0,1.0,1.0)):
 		data = json.dumps({'gamma': gamma, 'whitepoint': [rgb[0], rgb[1], rgb[2]]})
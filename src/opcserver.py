@@ -1,87 +1,229 @@
 # -*- coding: utf-8 -*-
 
-import socketserver, socket, json
+import socketserver, socket, json, time
 from threading import Thread, Lock
 
+from perfstats import PerfStats
+from opcclient import HYPERSIM_SYSEX_ID, SYSEX_PRIORITY
+
+OPC_HEADER_SIZE = 4
+OPC_MAX_FRAME   = OPC_HEADER_SIZE + 0xffff
+
+# ======================================================
+class OPCParser(object):
+	"""Incremental parser for a stream of OPC messages.
+
+	Socket data is received straight into a preallocated buffer:
+
+		n = sock.recv_into(parser.free())
+		parser.commit(n)
+		for channel, cmd, data in parser.frames():
+			...
+
+	frames() only yields complete messages. The payload is a memoryview into
+	the receive buffer and is valid until the next call to free(), so copy it
+	if you need to keep it.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, size=2*OPC_MAX_FRAME):
+		self.buffer = bytearray(max(size, OPC_MAX_FRAME))
+		self.view = memoryview(self.buffer)
+		self.start = 0
+		self.end = 0
+
+	# ------------------------------------------------------
+	def free(self):
+		""" return a writable view on the unused tail of the buffer """
+		if self.start and len(self.buffer) - self.end < OPC_MAX_FRAME:
+			# move the incomplete message to the front
+			pending = self.end - self.start
+			self.view[:pending] = self.view[self.start:self.end]
+			self.start = 0
+			self.end = pending
+		return self.view[self.end:]
+
+	# ------------------------------------------------------
+	def commit(self, nbytes):
+		self.end += nbytes
+
+	# ------------------------------------------------------
+	def frames(self):
+		buf = self.buffer
+		while self.end - self.start >= OPC_HEADER_SIZE:
+			pos = self.start
+			length = buf[pos+2]*256 + buf[pos+3]
+			data_end = pos + OPC_HEADER_SIZE + length
+			if data_end > self.end:
+				break
+			self.start = data_end
+			yield buf[pos], buf[pos+1], self.view[pos+OPC_HEADER_SIZE:data_end]
+
+		if self.start == self.end:
+			self.start = self.end = 0
+
+
+# ======================================================
+class FrameMailbox(object):
+	"""Hands the newest frame of each channel over to the render loop.
+
+	The server thread calls post() for every received frame. A frame that
+	was not taken by the render loop yet is replaced and counted as dropped,
+	so rendering never lags behind the sender. take() is called from the
+	render loop and returns the pending frames as {channel: bytes}.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self):
+		self._lock = Lock()
+		self._frames = {}
+		self.received = 0
+		self.rendered = 0
+		self.dropped = 0
+
+	# ------------------------------------------------------
+	def post(self, channel, data):
+		frame = bytes(data)
+		with self._lock:
+			self.received += 1
+			if channel in self._frames:
+				self.dropped += 1
+			self._frames[channel] = frame
+
+	# ------------------------------------------------------
+	def take(self):
+		with self._lock:
+			frames, self._frames = self._frames, {}
+			self.rendered += len(frames)
+		return frames
+
+	# ------------------------------------------------------
+	def stats(self):
+		return {'received': self.received, 'rendered': self.rendered, 'dropped': self.dropped}
+
+
+# ======================================================
+class OPCconnection(object):
+	""" a connected client, its priority and throughput """
+
+	# ------------------------------------------------------
+	def __init__(self, address, priority=0):
+		self.address = address
+		self.priority = priority
+		self.connected = time.monotonic()
+		self.last_frame = None
+		self.frames = 0
+		self.bytes = 0
+		self.rejected = 0
+		self._rate_time = self.connected
+		self._rate_frames = 0
+		self._rate_bytes = 0
+
+	# ------------------------------------------------------
+	def name(self):
+		return "%s:%s" % tuple(self.address[:2])
+
+	# ------------------------------------------------------
+	def stats(self):
+		""" counters and rates since the previous call """
+		now = time.monotonic()
+		elapsed = max(1e-6, now - self._rate_time)
+		stats = {
+			'client'   : self.name(),
+			'priority' : self.priority,
+			'frames'   : self.frames,
+			'bytes'    : self.bytes,
+			'rejected' : self.rejected,
+			'fps'      : (self.frames - self._rate_frames) / elapsed,
+			'bps'      : (self.bytes - self._rate_bytes) / elapsed,
+		}
+		self._rate_time, self._rate_frames, self._rate_bytes = now, self.frames, self.bytes
+		return stats
+
+
+# ======================================================
 class OPCserver(Thread):
-	update_func = None
-	running = False
-	_standby = False
-	_lock = Lock()
+	""" OPC server, every client connection is handled in its own thread
+
+	Frames of all clients are combined according to the merge policy:
+	  latest   - every frame is used, the newest one wins
+	  priority - only the active client (sent within ACTIVE_TIMEOUT) with the
+	             highest priority is used, priorities are set per host or
+	             host:port, or by the client with a priority sysEx
+	  owner    - the first client sending on a channel owns it until it
+	             disconnects or stays silent for ACTIVE_TIMEOUT
+
+	Without PORT nothing is received, messages only come from process(),
+	e.g. when rendering a capture.
+	"""
+	MERGE_POLICIES = ('latest', 'priority', 'owner')
+	ACTIVE_TIMEOUT = 1.0
 
 	# ======================================================
 	class OPCHandler(socketserver.BaseRequestHandler):
 
 		# ------------------------------------------------------
 		def setup(self):
+			self.opc = self.server.opc
 			self.request.settimeout(10)
+			self.parser = OPCParser()
+			self.client = self.opc.connect(self.client_address)
 
 		# ------------------------------------------------------
 		def handle(self):
-			while OPCserver.running:
+			parser = self.parser
+			perf = self.opc.perf
+			while self.opc.running:
+				timed = perf.enabled
+				if timed:
+					start = time.perf_counter()
 				try:
-					# recv header
-					data = self.request.recv(4).strip()
-					if not data or not OPCserver.running: break
-					channel, cmd, hi, lo = data[:4]
-					length = hi*256 + lo
-
-					# recv data
-					data = self.request.recv(length)
-					if not data or not OPCserver.running: break
+					nbytes = self.request.recv_into(parser.free())
 				except socket.timeout:
 					break
+				if not nbytes or not self.opc.running: break
 
-				# process data
-				with OPCserver._lock:
-					if cmd == 0:
-						if OPCserver.update_func is not None and len(data) >= 3:
-							led_data = []
-							for n in range(0,len(data),3):
-								led_data.append( (data[n], data[n+1], data[n+2]) )
-							OPCserver.update_func(led_data)
-						
-					elif cmd == 0xff:
-						sysex_cmd = 0
-						sysex_id = 0
-						if len(data) > 3:
-							sysex_id  = data[0]*256+data[1]
-							sysex_cmd = data[2]*256+data[3]
-							data = data[4:]
-					
-						if sysex_id == 1: # color correction commands
-							data = data.decode('utf-8')
-							print("sysEx [device: fadecandy command: %s] %s" % (sysex_cmd, data) )
-							if sysex_cmd == 1 and OPCserver.color_func is not None:
-								try:
-									json_data = json.loads(data)
-									if not OPCserver._standby:
-										OPCserver.color_func(json_data['gamma'],json_data['whitepoint'])
-								except:
-									print("  error reading json string")
-						
-							elif sysex_cmd == 2: # firmware commands
-								if len(data) > 0:
-									#data[0]
-									pass
-							
-							elif sysex_cmd > 2:
-								print("unknown fadecandy sysEx command")
-							
-						else:
-							print("sysEx [device: %s command: %s] %s", (sysex_id, sysex_cmd, data) )
-					else:
-						print("unknown command", cmd, data)
+				if timed:
+					received = time.perf_counter()
+					perf.add('recv', received - start, nbytes)
+				parser.commit(nbytes)
+				for channel, cmd, data in parser.frames():
+					self.opc.process(self.client, channel, cmd, data)
+				if timed:
+					perf.add('parse', time.perf_counter() - received)
+
+		# ------------------------------------------------------
+		def finish(self):
+			self.opc.disconnect(self.client)
 
 	# ======================================================
 
 	# ------------------------------------------------------
-	def __init__(self, upd_func=None, col_func=None, HOST='0.0.0.0', PORT=7890):
+	def __init__(self, upd_func=None, col_func=None, HOST='0.0.0.0', PORT=7890, merge='latest', priorities=None, fw_func=None, perf=None):
 		Thread.__init__(self)
-		OPCserver.update_func = upd_func
-		OPCserver.color_func = col_func
-		self.server = socketserver.TCPServer((HOST, int(PORT)), OPCserver.OPCHandler, False)
+		if merge not in OPCserver.MERGE_POLICIES:
+			raise ValueError("unknown merge policy '%s'" % merge)
+
+		self.update_func = upd_func
+		self.color_func = col_func
+		self.firmware_func = fw_func
+		self.merge = merge
+		self.priorities = dict(priorities or {})
+		self.clients = []
+		self.owners = {}
+		self.listeners = []
+		self.merged_listeners = []
+		self.perf = perf if perf is not None else PerfStats()
+		self.running = False
+		self._lock = Lock()
+
+		self.server = None
+		if PORT is None:
+			return
+		self.server = socketserver.ThreadingTCPServer((HOST, int(PORT)), OPCserver.OPCHandler, False)
+		self.server.daemon_threads = True
 		self.server.allow_reuse_address = True
+		self.server.opc = self
 		self.server.socket.settimeout(3)
 		self.server.server_bind()
 		print("opc server bind on %s %i" %(HOST,PORT) )
@@ -90,20 +232,133 @@ class OPCserver(Thread):
 	def __del__(self):
 		self.stop()
 
-	def standby(self,enable):
-		try:
-			if enable: OPCserver._lock.acquire(True,3)
-			else     : OPCserver._lock.release()
-		except:
-			print("locking error")
+	# ------------------------------------------------------
+	def addListener(self, func, merged=False):
+		"""func(channel, cmd, data) is called for every received message, before merging, from the client threads.
+
+		With merged, only frames the merge policy accepted are passed on (and
+		all other messages), e.g. to forward what the simulator shows.
+		"""
+		(self.merged_listeners if merged else self.listeners).append(func)
+
+	# ------------------------------------------------------
+	def connect(self, address):
+		# host:port of the peer before host, for senders on the same machine
+		priority = self.priorities.get("%s:%s" % tuple(address[:2]), self.priorities.get(address[0], 0))
+		client = OPCconnection(address, priority)
+		with self._lock:
+			self.clients.append(client)
+		print("opc client connected: %s" % client.name())
+		return client
+
+	# ------------------------------------------------------
+	def disconnect(self, client):
+		with self._lock:
+			if client in self.clients:
+				self.clients.remove(client)
+			for channel in [ c for c, owner in self.owners.items() if owner is client ]:
+				del self.owners[channel]
+		print("opc client disconnected: %s" % client.name())
+
+	# ------------------------------------------------------
+	def clientStats(self):
+		with self._lock:
+			return [ client.stats() for client in self.clients ]
+
+	# ------------------------------------------------------
+	def accept(self, client, channel, now):
+		""" decide by merge policy whether a frame of this client is used """
+		if self.merge == 'priority':
+			for other in self.clients:
+				if other.priority > client.priority and other.last_frame is not None and now - other.last_frame < OPCserver.ACTIVE_TIMEOUT:
+					return False
+
+		elif self.merge == 'owner':
+			owner = self.owners.get(channel)
+			if owner is not None and owner is not client and now - owner.last_frame < OPCserver.ACTIVE_TIMEOUT:
+				return False
+			self.owners[channel] = client
+
+		return True
+
+	# ------------------------------------------------------
+	def admit(self, client, channel, nbytes):
+		""" count a frame of client, True if the merge policy accepts it """
+		with self._lock:
+			now = time.monotonic()
+			client.frames += 1
+			client.bytes += nbytes
+			if not self.accept(client, channel, now):
+				client.rejected += 1
+				return False
+			client.last_frame = now
+			return True
+
+	# ------------------------------------------------------
+	def process(self, client, channel, cmd, data):
+		# outside of the lock: a recorder waiting for the disk must not hold up
+		# the other clients, listeners that keep state lock it themselves
+		for listener in self.listeners:
+			listener(channel, cmd, data)
+
+		if cmd == 0 and not self.admit(client, channel, len(data)):
+			return
+		for listener in self.merged_listeners:
+			listener(channel, cmd, data)
+
+		with self._lock:
+			if cmd == 0:
+				# led_data is a view of rgb triples, only valid during the call
+				if self.update_func is not None and len(data) >= 3:
+					self.update_func( channel, data[:len(data) - len(data) % 3] )
+
+			elif cmd == 0xff:
+				sysex_cmd = 0
+				sysex_id = 0
+				if len(data) > 3:
+					sysex_id  = data[0]*256+data[1]
+					sysex_cmd = data[2]*256+data[3]
+					data = data[4:]
+
+				if sysex_id == 1: # fadecandy commands
+					if sysex_cmd == 1: # color correction
+						data = bytes(data).decode('utf-8', 'replace')
+						print("sysEx [device: fadecandy command: %s] %s" % (sysex_cmd, data) )
+						if self.color_func is not None:
+							try:
+								json_data = json.loads(data)
+								self.color_func(json_data)
+							except:
+								print("  error reading json string")
+
+					elif sysex_cmd == 2: # firmware configuration
+						if len(data) > 0:
+							print("sysEx [device: fadecandy command: %s] flags 0x%02x" % (sysex_cmd, data[0]) )
+							if self.firmware_func is not None:
+								self.firmware_func(data[0])
+
+					elif sysex_cmd > 2:
+						print("unknown fadecandy sysEx command")
+
+				elif sysex_id == HYPERSIM_SYSEX_ID and sysex_cmd == SYSEX_PRIORITY and len(data) >= 2:
+					client.priority = (data[0]*256 + data[1]) - (0x10000 if data[0] & 0x80 else 0)
+					print("sysEx [device: hypersim command: %s] priority of %s: %d" % (sysex_cmd, client.name(), client.priority) )
+
+				else:
+					print("sysEx [device: %s command: %s] %s" % (sysex_id, sysex_cmd, bytes(data)) )
+			else:
+				print("unknown command", cmd, bytes(data))
+
 	# ------------------------------------------------------
 	def run(self):
-		OPCserver.running = True
-		self.server.server_activate()
-		self.server.serve_forever()
+		self.running = True
+		if self.server is not None:
+			self.server.server_activate()
+			self.server.serve_forever()
 
 	# ------------------------------------------------------
 	def stop(self):
-		OPCserver.running = False
-		self.server.shutdown()
-		self.server.server_close()
+		self.running = False
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
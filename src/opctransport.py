@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import socketserver, socket, struct, time, hashlib, base64
+from threading import Thread
+
+from opcserver import OPCParser, OPC_HEADER_SIZE, OPC_MAX_FRAME
+from opcclient import HYPERSIM_SYSEX_ID, SYSEX_FRAGMENT
+
+
+# ======================================================
+class OPCudpServer(Thread):
+	""" receives OPC messages as udp datagrams and feeds them to an OPCserver
+
+	Every datagram holds one or more complete OPC messages. Messages that do
+	not fit into a datagram arrive as HyperSim fragment sysEx messages (see
+	opcclient.udp_fragments) and are reassembled per sender and channel.
+	Each sender shows up as a client of the OPCserver until it has been
+	silent for CLIENT_TIMEOUT seconds.
+	"""
+	CLIENT_TIMEOUT = 10
+
+	# ------------------------------------------------------
+	def __init__(self, opc, HOST='0.0.0.0', PORT=7890):
+		Thread.__init__(self)
+		self.daemon = True
+		self.opc = opc
+		self.running = False
+		self.buffer = bytearray(0x10000)
+		self.view = memoryview(self.buffer)
+		self.senders = {}
+		self.fragments = {}
+
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.settimeout(0.5)
+		self.socket.bind((HOST, int(PORT)))
+		print("opc udp server bind on %s %i" %(HOST,PORT) )
+
+	# ------------------------------------------------------
+	def run(self):
+		self.running = True
+		perf = self.opc.perf
+		while self.running:
+			timed = perf.enabled
+			if timed:
+				start = time.perf_counter()
+			try:
+				nbytes, address = self.socket.recvfrom_into(self.buffer)
+			except socket.timeout:
+				nbytes = 0
+			except OSError:
+				break
+
+			now = time.monotonic()
+			if nbytes:
+				if timed:
+					received = time.perf_counter()
+					perf.add('recv', received - start, nbytes)
+				self.datagram(address, self.view[:nbytes], now)
+				if timed:
+					perf.add('parse', time.perf_counter() - received)
+			self.expire(now)
+
+		for address in list(self.senders):
+			self.opc.disconnect(self.senders.pop(address)[0])
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.running = False
+		self.socket.close()
+
+	# ------------------------------------------------------
+	def expire(self, now):
+		for address, (client, last_seen) in list(self.senders.items()):
+			if now - last_seen > OPCudpServer.CLIENT_TIMEOUT:
+				del self.senders[address]
+				for key in [ k for k in self.fragments if k[0] == address ]:
+					del self.fragments[key]
+				self.opc.disconnect(client)
+
+	# ------------------------------------------------------
+	def datagram(self, address, data, now):
+		sender = self.senders.get(address)
+		client = sender[0] if sender else self.opc.connect(address)
+		self.senders[address] = (client, now)
+
+		pos = 0
+		while len(data) - pos >= OPC_HEADER_SIZE:
+			channel, cmd = data[pos], data[pos+1]
+			end = pos + OPC_HEADER_SIZE + data[pos+2]*256 + data[pos+3]
+			if end > len(data):
+				print("udp: dropped truncated message from %s" % client.name())
+				break
+
+			payload = data[pos+OPC_HEADER_SIZE:end]
+			if cmd == 0xff and len(payload) >= 10 and payload[0]*256+payload[1] == HYPERSIM_SYSEX_ID and payload[2]*256+payload[3] == SYSEX_FRAGMENT:
+				self.fragment(address, client, payload)
+			else:
+				self.opc.process(client, channel, cmd, payload)
+			pos = end
+
+	# ------------------------------------------------------
+	def fragment(self, address, client, payload):
+		channel, cmd, total, offset = struct.unpack_from(">BBHH", payload, 4)
+		part = payload[10:]
+		key = (address, channel, cmd)
+
+		if offset == 0:
+			self.fragments[key] = [bytearray(total), 0]
+		frame = self.fragments.get(key)
+		if frame is None or frame[1] != offset or len(frame[0]) != total or offset + len(part) > total:
+			# lost or reordered fragment, wait for the start of the next frame
+			self.fragments.pop(key, None)
+			return
+
+		frame[0][offset:offset+len(part)] = part
+		frame[1] += len(part)
+		if frame[1] == total:
+			del self.fragments[key]
+			self.opc.process(client, channel, cmd, memoryview(frame[0]))
+
+
+# ======================================================
+class OPCwebSocketServer(Thread):
+	""" accepts OPC over WebSocket (RFC 6455) for browser based tools
+
+	The payload of the binary messages is handled as an OPC stream, so a
+	message may carry one or more OPC messages or parts of one. Text
+	messages are ignored.
+	"""
+	GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+	# ======================================================
+	class WebSocketHandler(socketserver.BaseRequestHandler):
+
+		# ------------------------------------------------------
+		def setup(self):
+			self.opc = self.server.opc
+			self.request.settimeout(10)
+			self.client = None
+
+		# ------------------------------------------------------
+		def handle(self):
+			try:
+				if not self.handshake():
+					return
+				self.client = self.opc.connect(self.client_address)
+				self.receive()
+			except (socket.timeout, ConnectionError):
+				pass
+
+		# ------------------------------------------------------
+		def finish(self):
+			if self.client is not None:
+				self.opc.disconnect(self.client)
+
+		# ------------------------------------------------------
+		def recv_exact(self, view):
+			while len(view):
+				nbytes = self.request.recv_into(view)
+				if not nbytes:
+					raise ConnectionError("websocket closed")
+				view = view[nbytes:]
+
+		# ------------------------------------------------------
+		def handshake(self):
+			request = b''
+			while b'\r\n\r\n' not in request:
+				data = self.request.recv(1024)
+				if not data or len(request) > 8192:
+					return False
+				request += data
+
+			headers = {}
+			for line in request.split(b'\r\n')[1:]:
+				name, _, value = line.partition(b':')
+				headers[name.strip().lower()] = value.strip()
+
+			key = headers.get(b'sec-websocket-key')
+			if key is None or b'websocket' not in headers.get(b'upgrade', b'').lower():
+				self.request.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+				return False
+
+			accept = base64.b64encode(hashlib.sha1(key + OPCwebSocketServer.GUID).digest())
+			self.request.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+			return True
+
+		# ------------------------------------------------------
+		def receive(self):
+			parser = OPCParser()
+			header = bytearray(14)
+			view = memoryview(header)
+			binary = False
+
+			while self.opc.running:
+				self.recv_exact(view[:2])
+				opcode = header[0] & 0x0f
+				masked = header[1] & 0x80
+				length = header[1] & 0x7f
+				extra = (2 if length == 126 else 8 if length == 127 else 0) + (4 if masked else 0)
+				self.recv_exact(view[2:2+extra])
+				if length == 126:
+					length = struct.unpack_from(">H", header, 2)[0]
+				elif length == 127:
+					length = struct.unpack_from(">Q", header, 2)[0]
+				mask = bytes(header[2+extra-4:2+extra]) if masked else None
+
+				if opcode >= 0x8:
+					payload = bytearray(length)
+					self.recv_exact(memoryview(payload))
+					if opcode == 0x8:   # close
+						self.request.sendall(b"\x88\x00")
+						return
+					if opcode == 0x9:   # ping
+						self.request.sendall(bytes((0x8a, len(payload))) + unmask(payload, mask, 0))
+					continue
+
+				if opcode != 0x0:
+					binary = opcode == 0x2
+
+				# read the payload straight into the parser buffer
+				received = 0
+				while received < length:
+					free = parser.free()
+					chunk = free[:min(length - received, OPC_MAX_FRAME)]
+					self.recv_exact(chunk)
+					if binary:
+						chunk[:] = unmask(chunk, mask, received)
+						parser.commit(len(chunk))
+						for channel, cmd, data in parser.frames():
+							self.opc.process(self.client, channel, cmd, data)
+					received += len(chunk)
+
+	# ------------------------------------------------------
+	def __init__(self, opc, HOST='0.0.0.0', PORT=7891):
+		Thread.__init__(self)
+		self.daemon = True
+		self.server = socketserver.ThreadingTCPServer((HOST, int(PORT)), OPCwebSocketServer.WebSocketHandler, False)
+		self.server.daemon_threads = True
+		self.server.allow_reuse_address = True
+		self.server.opc = opc
+		self.server.server_bind()
+		print("opc websocket server bind on %s %i" %(HOST,PORT) )
+
+	# ------------------------------------------------------
+	def run(self):
+		self.server.server_activate()
+		self.server.serve_forever()
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+# ------------------------------------------------------
+def unmask(data, mask, offset):
+	""" xor websocket payload data with the mask, offset is the position of data in the payload """
+	if mask is None or not len(data):
+		return bytes(data)
+	phase = offset % 4
+	mask = (mask[phase:] + mask[:phase]) * (len(data) // 4 + 1)
+	return (int.from_bytes(data, 'little') ^ int.from_bytes(mask[:len(data)], 'little')).to_bytes(len(data), 'little')
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""Timers for the stages a frame passes through.
+
+	recv   time blocked in recv() on the socket, bytes received
+	parse  splitting received data into OPC messages and handing them over
+	clut   color correction (and interpolation) of a frame
+	tk     drawing a frame: canvas items or image upload
+	idle   time the render loop leaves to tk between two frames
+
+A long recv with short parse, clut and tk means the wire (or the client)
+is the bottleneck, a long tk with a short idle means drawing is. The
+timers cost a perf_counter() call and a locked append per measurement and
+are only taken while PerfStats.enabled is set.
+
+PerfExporter writes snapshots periodically as JSON (*.json) or Prometheus
+text format (any other file name, e.g. for the node_exporter textfile
+collector) and serves both over http on /stats.json and /metrics.
+"""
+
+import json, os, time
+from collections import deque
+from threading import Thread, Lock, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+STAGES = ('recv', 'parse', 'clut', 'tk', 'idle')
+QUANTILES = (50, 95, 99)
+
+
+# ======================================================
+class PerfStats(object):
+	"""Rolling durations and totals of every stage.
+
+	Percentiles are taken over the last window measurements of a stage,
+	counts, seconds and bytes are totals since start, rates follow from two
+	snapshots, see rates().
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, enabled=False, window=1000):
+		self.enabled = enabled
+		self._lock = Lock()
+		self.samples = dict((stage, deque(maxlen=window)) for stage in STAGES)
+		self.totals = dict((stage, [0, 0.0, 0]) for stage in STAGES)
+
+	# ------------------------------------------------------
+	def add(self, stage, seconds, nbytes=0):
+		""" one measurement of stage, callers check enabled first """
+		with self._lock:
+			self.samples[stage].append(seconds)
+			total = self.totals[stage]
+			total[0] += 1
+			total[1] += seconds
+			total[2] += nbytes
+
+	# ------------------------------------------------------
+	def snapshot(self):
+		""" {'time': monotonic seconds, 'stages': {stage: {count, seconds, bytes, p50, p95, p99, max}}} """
+		with self._lock:
+			samples = dict((stage, sorted(self.samples[stage])) for stage in STAGES)
+			totals = dict((stage, list(self.totals[stage])) for stage in STAGES)
+
+		stages = {}
+		for stage in STAGES:
+			values = samples[stage]
+			count, seconds, nbytes = totals[stage]
+			entry = {'count': count, 'seconds': seconds, 'bytes': nbytes, 'max': values[-1] if values else 0.0}
+			for q in QUANTILES:
+				entry['p%d' % q] = values[min(len(values)-1, int(q / 100.0 * len(values)))] if values else 0.0
+			stages[stage] = entry
+		return {'time': time.monotonic(), 'stages': stages}
+
+
+# ------------------------------------------------------
+def rates(snapshot, previous):
+	""" {stage: (events per second, bytes per second)} between two snapshots """
+	elapsed = max(1e-6, snapshot['time'] - previous['time'])
+	return dict( (stage, ((s['count'] - p['count']) / elapsed, (s['bytes'] - p['bytes']) / elapsed))
+		for stage, s, p in ((stage, snapshot['stages'][stage], previous['stages'][stage]) for stage in STAGES) )
+
+
+# ------------------------------------------------------
+def summary(snapshot, previous):
+	""" one line for the status bar """
+	stages, rate = snapshot['stages'], rates(snapshot, previous)
+	ms = lambda stage, q: stages[stage]['p%d' % q] * 1e3
+	return "recv %.2f MB/s | parse %.2f/%.2f ms | clut %.2f/%.2f ms | tk %.2f/%.2f ms %.1f fps | idle %.1f ms  (p50/p99)" % (
+		rate['recv'][1] / 1e6, ms('parse', 50), ms('parse', 99), ms('clut', 50), ms('clut', 99),
+		ms('tk', 50), ms('tk', 99), rate['tk'][0], ms('idle', 50))
+
+
+# ------------------------------------------------------
+def toJson(snapshot, previous=None, extra=None):
+	data = {'stages': snapshot['stages']}
+	if previous is not None:
+		for stage, (rate, bps) in rates(snapshot, previous).items():
+			data['stages'][stage].update(rate=rate, bytes_per_s=bps)
+	if extra is not None:
+		data.update(extra)
+	return json.dumps(data, indent=1, sort_keys=True)
+
+
+# ------------------------------------------------------
+def toPrometheus(snapshot, extra=None):
+	lines = ['# HELP hypersim_stage_seconds time spent per stage',
+		'# TYPE hypersim_stage_seconds summary']
+	for stage in STAGES:
+		s = snapshot['stages'][stage]
+		for q in QUANTILES:
+			lines.append('hypersim_stage_seconds{stage="%s",quantile="%g"} %.9f' % (stage, q / 100.0, s['p%d' % q]))
+		lines.append('hypersim_stage_seconds_sum{stage="%s"} %.9f' % (stage, s['seconds']))
+		lines.append('hypersim_stage_seconds_count{stage="%s"} %d' % (stage, s['count']))
+	lines += ['# HELP hypersim_stage_bytes_total bytes handled per stage', '# TYPE hypersim_stage_bytes_total counter']
+	lines += [ 'hypersim_stage_bytes_total{stage="%s"} %d' % (stage, snapshot['stages'][stage]['bytes']) for stage in STAGES ]
+	for key, value in sorted((extra or {}).items()):
+		lines += ['# TYPE hypersim_%s gauge' % key, 'hypersim_%s %s' % (key, value)]
+	return "\n".join(lines) + "\n"
+
+
+# ======================================================
+class PerfExporter(Thread):
+	"""Writes snapshots of perf to path every interval seconds and serves them on host:port.
+
+	The server only listens on the loopback interface unless another host
+	is given, e.g. '0.0.0.0' for a Prometheus server on another machine.
+	extra() returns more numbers to export, e.g. HyperSimEngine.stats.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, perf, path=None, port=None, interval=1.0, extra=None, host='127.0.0.1'):
+		Thread.__init__(self)
+		self.daemon = True
+		self.perf = perf
+		self.path = path
+		self.interval = interval
+		self.extra = extra
+		self.previous = perf.snapshot()
+		self.json = self.prometheus = ''
+		self._stopping = Event()
+
+		self.server = None
+		if port is not None:
+			self.server = ThreadingHTTPServer((host, int(port)), PerfExporter.Handler)
+			self.server.daemon_threads = True
+			self.server.exporter = self
+			print("perf stats on http://%s:%d/metrics and /stats.json" % (host or '0.0.0.0', port))
+
+	# ======================================================
+	class Handler(BaseHTTPRequestHandler):
+
+		# ------------------------------------------------------
+		def do_GET(self):
+			exporter = self.server.exporter
+			if self.path == '/metrics':
+				body, content_type = exporter.prometheus, 'text/plain; version=0.0.4'
+			elif self.path == '/stats.json':
+				body, content_type = exporter.json, 'application/json'
+			else:
+				self.send_error(404)
+				return
+			body = body.encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		# ------------------------------------------------------
+		def log_message(self, format, *args):
+			pass
+
+	# ======================================================
+
+	# ------------------------------------------------------
+	def update(self):
+		snapshot = self.perf.snapshot()
+		extra = self.extra() if self.extra is not None else None
+		self.json = toJson(snapshot, self.previous, extra)
+		self.prometheus = toPrometheus(snapshot, extra)
+		self.previous = snapshot
+		if self.path is not None:
+			# write and rename, readers never see a partial file
+			temp = self.path + '.tmp'
+			with open(temp, 'w') as f:
+				f.write(self.json if self.path.endswith('.json') else self.prometheus)
+			os.replace(temp, self.path)
+
+	# ------------------------------------------------------
+	def run(self):
+		if self.server is not None:
+			Thread(target=self.server.serve_forever, daemon=True).start()
+		while True:
+			try:
+				self.update()
+			except OSError as e:
+				print("perf stats export failed: %s" % e)
+			if self._stopping.wait(self.interval):
+				break
+
+	# ------------------------------------------------------
+	def stop(self):
+		self._stopping.set()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
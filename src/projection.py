@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class Camera(object):
+	"""Perspective view of a 3d led layout.
+
+	The camera orbits the center of the layout: yaw turns the layout around
+	the vertical screen axis, pitch around the horizontal one, zoom scales
+	the view. With yaw and pitch 0 the view matches opc_xy, z points away
+	from the viewer. Points have to be centered and scaled to about unit
+	size, see layout.opcGeometry3d.
+
+	project() transforms all points at once and returns the leds sorted from
+	far to near, so drawing them in that order hides leds behind others.
+	"""
+	# distance of the camera from the center, sets the strength of the perspective
+	DISTANCE = 3.0
+
+	# ------------------------------------------------------
+	def __init__(self, yaw=0.0, pitch=0.0, zoom=1.0):
+		self.yaw = yaw
+		self.pitch = pitch
+		self.zoom = zoom
+
+	# ------------------------------------------------------
+	def rotate(self, yaw, pitch):
+		self.yaw = (self.yaw + yaw) % (2*math.pi)
+		self.pitch = max(-math.pi/2, min(math.pi/2, self.pitch + pitch))
+
+	# ------------------------------------------------------
+	def zoomBy(self, factor):
+		self.zoom = max(0.1, min(20.0, self.zoom * factor))
+
+	# ------------------------------------------------------
+	def matrix(self):
+		""" rows of the rotation, pitch applied after yaw """
+		cy, sy = math.cos(self.yaw), math.sin(self.yaw)
+		cp, sp = math.cos(self.pitch), math.sin(self.pitch)
+		return ( (cy, 0.0, -sy), (-sp*sy, cp, -sp*cy), (cp*sy, sp, cp*cy) )
+
+	# ------------------------------------------------------
+	def project(self, columns, win_width, win_height, led_size=15):
+		"""Project x, y, z columns into the window.
+
+		Returns (led_rects, order): [x0, y0, x1, y1] per led, None for leds
+		without point, and the indices of all leds with point from far to
+		near. Leds get bigger the closer they are.
+		"""
+		(r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = self.matrix()
+		scale = min(win_width, win_height) * 0.45 * self.zoom
+		cx, cy = win_width / 2.0, win_height / 2.0
+		distance = Camera.DISTANCE
+
+		if np is not None:
+			x, y, z = [ np.frombuffer(c, np.float64) if not isinstance(c, np.ndarray) else c for c in columns ]
+			depth = r20*x + r21*y + r22*z
+			s = distance / (distance + depth)
+			sx = cx + (r00*x + r01*y + r02*z) * s * scale
+			sy = cy + (r10*x + r11*y + r12*z) * s * scale
+			half = led_size * s / 2
+			coords = np.stack([sx - half, sy - half, sx + half, sy + half], axis=1)
+			missing = np.isnan(depth)
+			rects = np.where(missing[:, None], 0, coords).astype(np.int64).tolist()
+			for idx in np.flatnonzero(missing).tolist():
+				rects[idx] = None
+			valid = np.flatnonzero(~missing)
+			order = valid[np.argsort(-depth[valid], kind='stable')].tolist()
+			return rects, order
+
+		rects = []
+		depths = []
+		for idx, (x, y, z) in enumerate(zip(*columns)):
+			if x != x:
+				rects.append(None)
+				continue
+			depth = r20*x + r21*y + r22*z
+			s = distance / (distance + depth)
+			sx = cx + (r00*x + r01*y + r02*z) * s * scale
+			sy = cy + (r10*x + r11*y + r12*z) * s * scale
+			half = led_size * s / 2
+			rects.append([int(sx - half), int(sy - half), int(sx + half), int(sy + half)])
+			depths.append((-depth, idx))
+		depths.sort()
+		return rects, [ idx for depth, idx in depths ]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import math
+from array import array
+from itertools import groupby
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class Rasterizer(object):
+	"""Renders leds into a single rgb frame buffer.
+
+	Each led is reduced to a mask of the pixel rows it covers (rect or
+	ellipse shaped, inset by one pixel like the canvas outline). Leds that
+	come later in led_rects, or in order if given, cover earlier ones, just
+	like canvas items, so the masks only contain the visible pixels and leds
+	can be drawn in any order. frame holds width*height rgb triples, ppm() wraps it up for
+	tk.PhotoImage or an image file.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, width, height, led_rects, draw_type='rect', background=(169,169,169), order=None):
+		self.width = int(width)
+		self.height = int(height)
+		self.background = bytes(background)
+		self.frame = bytearray(self.background * (self.width*self.height))
+		self.header = b'P6 %d %d 255 ' % (self.width, self.height)
+
+		labels = self._labelRows(led_rects, draw_type, order)
+		self.spans = [ [] for r in led_rects ]
+		for y, row in enumerate(labels):
+			if row is None: continue
+			x = 0
+			for idx, run in groupby(row):
+				length = len(list(run))
+				if idx >= 0:
+					start = (y*self.width + x) * 3
+					self.spans[idx].append( (start, start + length*3) )
+				x += length
+
+		self.line = [ max([0] + [e-s for s, e in spans]) // 3 for spans in self.spans ]
+
+		self.labels = None
+		if np is not None:
+			# background gets the index after the last led
+			self.labels = np.full(self.width*self.height, len(led_rects), dtype=np.intp)
+			for idx, spans in enumerate(self.spans):
+				for start, end in spans:
+					self.labels[start//3:end//3] = idx
+			# leds a short frame does not reach keep the background, like fill() leaves them
+			self.palette = np.full((len(led_rects)+1, 3), tuple(self.background), dtype=np.uint8)
+
+	# ------------------------------------------------------
+	def _labelRows(self, led_rects, draw_type, order=None):
+		rows = [None] * self.height
+		for idx in range(len(led_rects)) if order is None else order:
+			r = led_rects[idx]
+			if r is None: continue
+			for y, x0, x1 in self._shape(r, draw_type):
+				if rows[y] is None:
+					rows[y] = array('i', [-1]) * self.width
+				rows[y][x0:x1] = array('i', [idx]) * (x1-x0)
+		return rows
+
+	# ------------------------------------------------------
+	def _shape(self, rect, draw_type):
+		""" yield (row, first column, end column) of the pixels covered by a led """
+		x0, y0, x1, y1 = min(rect[0],rect[2]), min(rect[1],rect[3]), max(rect[0],rect[2]), max(rect[1],rect[3])
+		cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+		rx, ry = max(0.5, (x1 - x0) / 2.0 - 1), max(0.5, (y1 - y0) / 2.0 - 1)
+
+		for y in range(max(0, y0+1), min(self.height, y1)):
+			if draw_type == 'circle':
+				dy = (y + 0.5 - cy) / ry
+				if abs(dy) > 1: continue
+				dx = rx * math.sqrt(1 - dy*dy)
+				a, b = int(round(cx - dx)), int(round(cx + dx))
+			else:
+				a, b = x0+1, x1
+			a, b = max(0, a), min(self.width, b)
+			if b > a:
+				yield y, a, b
+
+	# ------------------------------------------------------
+	def fill(self, idx, rgb):
+		""" draw a single led with the given rgb bytes """
+		spans = self.spans[idx]
+		if not spans: return
+		line = memoryview(bytes(rgb) * self.line[idx])
+		frame = self.frame
+		for start, end in spans:
+			frame[start:end] = line[:end-start]
+
+	# ------------------------------------------------------
+	def draw(self, colors, leds=None):
+		""" draw leds from a flat buffer of rgb bytes, all leds if leds is None """
+		if leds is None and self.labels is not None:
+			count = min(len(colors) // 3, len(self.palette)-1)
+			self.palette[:count] = np.frombuffer(colors, np.uint8, count*3).reshape(-1,3)
+			self.frame[:] = self.palette[self.labels].tobytes()
+			return
+
+		if leds is None:
+			leds = range(min(len(colors) // 3, len(self.spans)))
+		for idx in leds:
+			self.fill(idx, colors[idx*3:idx*3+3])
+
+	# ------------------------------------------------------
+	def ppm(self):
+		return self.header + self.frame
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""Capture of received OPC messages.
+
+A capture is an append-only file of records
+
+	header : b'HSCAP\\x01\\0\\0' + wall clock time of the start (double)
+	record : time since start in ns (uint64), channel, command, length (uint16), data
+
+all little endian, plus a sidecar file '<capture>.idx' with (time, file
+offset) pairs of uint64 every INDEX_INTERVAL seconds. Both files are memory
+mapped for reading, so seeking in a capture of many hours is a binary search
+in the index and a short scan.
+"""
+
+import mmap, os, struct, time
+from threading import Lock
+
+CAPTURE_MAGIC = b'HSCAP\x01\x00\x00'
+CAPTURE_HEADER = struct.Struct('<8sd')
+RECORD_HEADER = struct.Struct('<QBBH')
+INDEX_ENTRY = struct.Struct('<QQ')
+INDEX_INTERVAL = 0.1
+
+
+# ======================================================
+class FrameRecorder(object):
+	""" appends OPC messages to a capture, can be used as OPCserver listener """
+
+	# ------------------------------------------------------
+	def __init__(self, path, index_interval=INDEX_INTERVAL):
+		self.path = path
+		self.file = open(path, 'wb')
+		self.index = open(path + '.idx', 'wb')
+		self.file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time()))
+		self.offset = CAPTURE_HEADER.size
+		self.start = time.monotonic_ns()
+		self.index_interval = int(index_interval * 1e9)
+		self.next_index = 0
+		self.records = 0
+		self._lock = Lock()
+
+	# ------------------------------------------------------
+	def record(self, channel, cmd, data, now=None):
+		""" append one message, now is a time.monotonic_ns() value """
+		timestamp = (time.monotonic_ns() if now is None else now) - self.start
+		with self._lock:
+			if self.file is None:
+				return
+			if timestamp >= self.next_index:
+				self.index.write(INDEX_ENTRY.pack(timestamp, self.offset))
+				self.next_index = timestamp + self.index_interval
+			self.file.write(RECORD_HEADER.pack(timestamp, channel, cmd, len(data)))
+			self.file.write(data)
+			self.offset += RECORD_HEADER.size + len(data)
+			self.records += 1
+
+	# ------------------------------------------------------
+	def __call__(self, channel, cmd, data):
+		self.record(channel, cmd, data)
+
+	# ------------------------------------------------------
+	def close(self):
+		with self._lock:
+			if self.file is not None:
+				self.file.close()
+				self.index.close()
+				self.file = None
+
+
+# ======================================================
+class FrameCapture(object):
+	""" memory mapped, read only access to a capture """
+
+	# ------------------------------------------------------
+	def __init__(self, path):
+		self.path = path
+		self._file = open(path, 'rb')
+		self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.index = None
+		magic, self.start_time = CAPTURE_HEADER.unpack_from(self.data, 0)
+		if magic != CAPTURE_MAGIC:
+			self.close()
+			raise ValueError("'%s' is not a HyperSim capture" % path)
+		self.view = memoryview(self.data)
+
+		self.index_size = 0
+		if os.path.exists(path + '.idx') and os.path.getsize(path + '.idx') >= INDEX_ENTRY.size:
+			self._index_file = open(path + '.idx', 'rb')
+			self.index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+			self.index_size = len(self.index) // INDEX_ENTRY.size
+
+	# ------------------------------------------------------
+	def close(self):
+		# fails with BufferError while frames() data is still referenced
+		if getattr(self, 'view', None) is not None:
+			self.view.release()
+			self.view = None
+		self.data.close()
+		self._file.close()
+		if self.index is not None:
+			self.index.close()
+			self._index_file.close()
+			self.index = None
+
+	# ------------------------------------------------------
+	def _indexTime(self, i):
+		return INDEX_ENTRY.unpack_from(self.index, i*INDEX_ENTRY.size)[0]
+
+	# ------------------------------------------------------
+	def seek(self, seconds):
+		""" file offset of the first message at or after seconds since the start """
+		target = int(seconds * 1e9)
+		offset = CAPTURE_HEADER.size
+		if self.index is not None:
+			# binary search for the last index entry before target
+			lo, hi = 0, self.index_size
+			while lo < hi:
+				mid = (lo + hi) // 2
+				if self._indexTime(mid) <= target: lo = mid + 1
+				else: hi = mid
+			if lo > 0:
+				offset = INDEX_ENTRY.unpack_from(self.index, (lo-1)*INDEX_ENTRY.size)[1]
+
+		for timestamp, channel, cmd, data, next_offset in self._records(offset):
+			if timestamp >= target:
+				return next_offset - RECORD_HEADER.size - len(data)
+		return len(self.data)
+
+	# ------------------------------------------------------
+	def _records(self, offset):
+		size = len(self.data)
+		while offset + RECORD_HEADER.size <= size:
+			timestamp, channel, cmd, length = RECORD_HEADER.unpack_from(self.data, offset)
+			end = offset + RECORD_HEADER.size + length
+			if end > size:
+				break   # incomplete last record
+			yield timestamp, channel, cmd, self.view[offset+RECORD_HEADER.size:end], end
+			offset = end
+
+	# ------------------------------------------------------
+	def frames(self, start=0.0):
+		"""Yield (seconds, channel, command, data) from start seconds on.
+
+		data is a memoryview into the mapped file, no copies are made.
+		"""
+		for timestamp, channel, cmd, data, end in self._records(self.seek(start) if start > 0 else CAPTURE_HEADER.size):
+			yield timestamp / 1e9, channel, cmd, data
+
+	# ------------------------------------------------------
+	def duration(self):
+		last = 0
+		offset = INDEX_ENTRY.unpack_from(self.index, (self.index_size-1)*INDEX_ENTRY.size)[1] if self.index_size else CAPTURE_HEADER.size
+		for timestamp, channel, cmd, data, end in self._records(offset):
+			last = timestamp
+		return last / 1e9
+
+
+if __name__ == "__main__":
+	import sys
+	if len(sys.argv) < 2:
+		print("usage: recorder.py <capture> [<start seconds> [<count>]]")
+		exit(1)
+
+	capture = FrameCapture(sys.argv[1])
+	start = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+	count = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+	print("%s: started %s, %.3f s" % (sys.argv[1], time.ctime(capture.start_time), capture.duration()))
+	for n, (seconds, channel, cmd, data) in enumerate(capture.frames(start)):
+		if n >= count: break
+		print("%10.4f  channel %3d  command %3d  %5d bytes" % (seconds, channel, cmd, len(data)))
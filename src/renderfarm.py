@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""One simulator process per layout.
+
+A single hypersim shares one interpreter between the OPC threads, color
+correction and drawing. The render farm starts a worker process per
+layout and port instead, so every layout gets its own core:
+
+	renderfarm.py hyperion:../demo_configs/hyperion/hyperion.config.json@7890 \\
+	              opc_xy:../demo_configs/opc/wall.json@7891 opc_xy:../demo_configs/opc/ring24.json
+
+Every worker runs a HyperSimEngine and a Rasterizer and writes the image
+of its layout into a shared memory block. The supervisor shows all of them
+as tiles of one window (see dashboard.py) or, with --headless, just
+prints their statistics. Layouts without @port get the ports after --port.
+
+Shared memory block of a worker: a stop flag set by the supervisor,
+FRAME_HEADER, then width*height rgb bytes. seq is odd while the worker
+writes, a reader copies the frame and retries if seq was odd or changed
+meanwhile (seqlock), so workers never wait for the UI. No locks are shared,
+a worker that is killed cannot block the others or the UI.
+"""
+
+import argparse, os, struct, sys, time
+import multiprocessing
+from multiprocessing import shared_memory
+
+from engine import HyperSimEngine
+from framediff import changed_leds
+from layout import LAYOUT_TYPES, loadGeometry
+from rasterizer import Rasterizer
+
+# stop flag, written by the supervisor only
+FRAME_CONTROL = struct.Struct('<Q')
+# seq, width, height, received, rendered, dropped, clients
+FRAME_HEADER = struct.Struct('<QIIQQQQ')
+FRAME_OFFSET = FRAME_CONTROL.size + FRAME_HEADER.size
+
+
+# ------------------------------------------------------
+def tileLayout(layout_file, layout_type, tile_width, tile_height, led_size):
+	""" (led_rects, width, height) of a layout fitted into a tile """
+	geometry = loadGeometry(layout_file, layout_type)
+	if geometry is None:
+		raise ValueError("no led with a point in '%s'" % layout_file)
+	width, height = tile_width, tile_height
+	if geometry.aspect is not None:
+		width = min(tile_width, int(tile_height / geometry.aspect))
+		height = int(width * geometry.aspect)
+	led_rects, width, height = geometry.rects(width, height, led_size)
+	return led_rects, int(width), int(height)
+
+
+# ======================================================
+class FrameSlot(object):
+	""" the shared memory block of one worker """
+
+	# ------------------------------------------------------
+	def __init__(self, name=None, width=0, height=0):
+		if name is None:
+			self.shm = shared_memory.SharedMemory(create=True, size=FRAME_OFFSET + width*height*3)
+			FRAME_CONTROL.pack_into(self.shm.buf, 0, 0)
+			FRAME_HEADER.pack_into(self.shm.buf, FRAME_CONTROL.size, 0, width, height, 0, 0, 0, 0)
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+		self.name = self.shm.name
+		self.width, self.height = FRAME_HEADER.unpack_from(self.shm.buf, FRAME_CONTROL.size)[1:3]
+		self.frame = self.shm.buf[FRAME_OFFSET:FRAME_OFFSET + self.width*self.height*3]
+
+	# ------------------------------------------------------
+	def requestStop(self):
+		FRAME_CONTROL.pack_into(self.shm.buf, 0, 1)
+
+	# ------------------------------------------------------
+	def stopRequested(self):
+		return FRAME_CONTROL.unpack_from(self.shm.buf, 0)[0] != 0
+
+	# ------------------------------------------------------
+	def write(self, frame, stats):
+		buf = self.shm.buf
+		seq = FRAME_HEADER.unpack_from(buf, FRAME_CONTROL.size)[0]
+		struct.pack_into('<Q', buf, FRAME_CONTROL.size, seq + 1)
+		self.frame[:] = frame
+		FRAME_HEADER.pack_into(buf, FRAME_CONTROL.size, seq + 2, self.width, self.height,
+			stats['received'], stats['rendered'], stats['dropped'], stats['clients'])
+
+	# ------------------------------------------------------
+	def read(self, last_seq=None, retries=100):
+		"""(seq, rgb bytes, stats) or None if the frame is still last_seq.
+
+		Also None if no consistent frame was read after retries attempts, e.g.
+		because the worker died while writing.
+		"""
+		buf = self.shm.buf
+		for attempt in range(retries):
+			header = FRAME_HEADER.unpack_from(buf, FRAME_CONTROL.size)
+			seq = header[0]
+			if seq == last_seq:
+				return None
+			if seq & 1:
+				time.sleep(0)
+				continue
+			frame = bytes(self.frame)
+			if FRAME_HEADER.unpack_from(buf, FRAME_CONTROL.size)[0] == seq:
+				received, rendered, dropped, clients = header[3:]
+				return seq, frame, {'received': received, 'rendered': rendered, 'dropped': dropped, 'clients': clients}
+		return None
+
+	# ------------------------------------------------------
+	def close(self, unlink=False):
+		self.frame.release()
+		self.shm.close()
+		if unlink:
+			self.shm.unlink()
+
+
+# ------------------------------------------------------
+def runWorker(layout_file, layout_type, port, slot_name, tile, led_size, draw_type, fps):
+	""" worker process: receive OPC on port and draw the layout into the slot until stop is requested """
+	slot = FrameSlot(slot_name)
+	try:
+		led_rects, width, height = tileLayout(layout_file, layout_type, tile[0], tile[1], led_size)
+		engine = HyperSimEngine(port=port)
+		engine.setLeds(led_rects)
+		rasterizer = Rasterizer(slot.width, slot.height, led_rects, draw_type)
+		rasterizer.draw(len(led_rects) * b'\0\0\0')
+		slot.write(rasterizer.frame, engine.stats())
+	except (OSError, ValueError) as e:
+		print("%s:%s@%d: %s" % (layout_type, layout_file, port, e))
+		slot.close()
+		sys.exit(1)
+
+	engine.start()
+	last_colors = None
+	last_write = 0.0
+	try:
+		while not slot.stopRequested():
+			start = time.monotonic()
+			colors = engine.poll(start)
+			if colors is not None:
+				count = min(len(colors) // 3, len(led_rects))
+				changed = changed_leds(colors, last_colors, count)
+				last_colors = colors
+				if changed:
+					rasterizer.draw(colors, None if len(changed) == count else changed)
+					slot.write(rasterizer.frame, engine.stats())
+					last_write = start
+			if start - last_write >= 1.0:
+				# keep the statistics of idle workers current
+				slot.write(rasterizer.frame, engine.stats())
+				last_write = start
+			time.sleep(max(0.001, 1.0/fps - (time.monotonic() - start)))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		engine.stop()
+		slot.close()
+
+
+# ======================================================
+class RenderFarm(object):
+	"""Starts and stops the workers, offers their slots to the UI.
+
+	layouts is a list of (layout_file, layout_type, port).
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, layouts, tile=(400, 300), led_size=8, draw_type='rect', fps=60):
+		# spawn: the workers must not inherit the threads or tk of the supervisor
+		self.context = multiprocessing.get_context('spawn')
+		self.workers = []
+		for layout_file, layout_type, port in layouts:
+			led_rects, width, height = tileLayout(layout_file, layout_type, tile[0], tile[1], led_size)
+			slot = FrameSlot(width=width, height=height)
+			process = self.context.Process(target=runWorker, name="hypersim:%d" % port,
+				args=(layout_file, layout_type, port, slot.name, tile, led_size, draw_type, fps))
+			process.daemon = True
+			self.workers.append({'file': layout_file, 'type': layout_type, 'port': port, 'leds': len(led_rects), 'slot': slot, 'process': process})
+
+	# ------------------------------------------------------
+	def start(self):
+		for worker in self.workers:
+			worker['process'].start()
+
+	# ------------------------------------------------------
+	def stop(self):
+		for worker in self.workers:
+			worker['slot'].requestStop()
+		for worker in self.workers:
+			worker['process'].join(3)
+			if worker['process'].is_alive():
+				worker['process'].terminate()
+				worker['process'].join()
+			worker['slot'].close(unlink=True)
+
+	# ------------------------------------------------------
+	def label(self, worker):
+		return "%s @%d  %s (%d leds)" % (worker['type'], worker['port'], os.path.basename(worker['file']), worker['leds'])
+
+
+# ------------------------------------------------------
+def parseLayouts(specs, first_port):
+	""" [type:file[@port], ...] -> [(file, type, port), ...] """
+	layouts = []
+	ports = set()
+	next_port = first_port
+	for spec in specs:
+		layout_type, _, layout_file = spec.partition(':')
+		port = None
+		if '@' in layout_file:
+			layout_file, _, port = layout_file.rpartition('@')
+			port = int(port)
+		if layout_type not in LAYOUT_TYPES or not layout_file:
+			raise ValueError("invalid layout '%s', expected <type>:<file>[@<port>] with type one of %s" % (spec, ", ".join(LAYOUT_TYPES)))
+		if port is None:
+			while next_port in ports:
+				next_port += 1
+			port = next_port
+		if port in ports:
+			raise ValueError("port %d is used twice" % port)
+		ports.add(port)
+		layouts.append( (os.path.realpath(layout_file), layout_type, port) )
+	return layouts
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Run one simulator process per layout.', prog='renderfarm.py')
+	parser.add_argument('layouts', nargs='+', metavar="<type>:<file>[@<port>]", help='layout type (%s), file and OPC port' % ", ".join(LAYOUT_TYPES))
+	parser.add_argument('--port', default=7890, type=int, metavar="<port>", help='first port for layouts without port (default: 7890)')
+	parser.add_argument('--tile', default='400x300', metavar="<w>x<h>", help='size of a tile (default: 400x300)')
+	parser.add_argument('--columns', default=None, type=int, metavar="<count>", help='tiles per row (default: about square)')
+	parser.add_argument('--led_size', default=8, type=int, metavar="<pixel>", help='pixel size of a single led (default: 8)')
+	parser.add_argument('-c','--circle', dest='draw_type', default='rect', action='store_const', const='circle', help='draw led as circle/oval')
+	parser.add_argument('--fps', default=60, type=float, metavar="<rate>", help='maximum refresh rate of every worker (default: 60)')
+	parser.add_argument('--headless', default=False, action='store_true', help='no window, print the statistics of all workers')
+	args = parser.parse_args()
+
+	try:
+		layouts = parseLayouts(args.layouts, args.port)
+		tile = tuple(int(v) for v in args.tile.lower().split('x'))
+		if len(tile) != 2:
+			raise ValueError("invalid tile size '%s'" % args.tile)
+		farm = RenderFarm(layouts, tile, args.led_size, args.draw_type, max(1.0, args.fps))
+	except (OSError, ValueError) as e:
+		parser.error(str(e))
+
+	farm.start()
+	try:
+		if args.headless:
+			last = {}
+			while True:
+				time.sleep(10)
+				for worker in farm.workers:
+					frame = worker['slot'].read()
+					stats = frame[2] if frame else worker.get('stats', {})
+					worker['stats'] = stats
+					rendered = stats.get('rendered', 0)
+					print("%-50s %s  clients %d | out %.1f fps | dropped %d" % (farm.label(worker),
+						'running' if worker['process'].is_alive() else 'exited %s' % worker['process'].exitcode,
+						stats.get('clients', 0), (rendered - last.get(worker['port'], 0)) / 10.0, stats.get('dropped', 0)))
+					last[worker['port']] = rendered
+		else:
+			import tkinter as tk
+			from dashboard import Dashboard
+
+			root = tk.Tk()
+			app = Dashboard(root, farm, args.columns, max(1.0, args.fps))
+			root.protocol("WM_DELETE_WINDOW", app.on_close)
+			app.mainloop()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		farm.stop()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Dump and replay of OPC streams.
+
+A raw dump is the plain OPC byte stream, message after message, as a
+client sends it. It is written by StreamDumper, either as listener of the
+simulator (hypersim --dump) or by a logging proxy in front of another OPC
+server:
+
+	replay.py dump --listen 7891 --to localhost:7890 show.opc
+
+Raw dumps and captures of hypersim --record can be replayed into the
+simulator (hypersim --replay) or sent to any OPC server:
+
+	replay.py play show.opc --to localhost:7890 --speed 2
+	replay.py play show.hscap --to localhost:7890 --speed max
+
+Speeds: a factor of real time, 'max' for as fast as possible (a repeatable
+load generator) or 'step' to send one frame per key press. Raw dumps have
+no timestamps, they are played with --fps frames per second.
+"""
+
+import mmap, struct, time, sys
+from threading import Thread, Event, Lock
+
+from opcserver import OPCserver, OPC_HEADER_SIZE
+from opcclient import OPCclient
+from recorder import FrameCapture, CAPTURE_MAGIC
+
+OPC_HEADER = struct.Struct('>BBH')
+
+
+# ======================================================
+class StreamDumper(object):
+	""" writes OPC messages as raw byte stream, can be used as OPCserver listener """
+
+	# ------------------------------------------------------
+	def __init__(self, path):
+		self.file = open(path, 'wb')
+		self.header = bytearray(OPC_HEADER_SIZE)
+		self._lock = Lock()
+
+	# ------------------------------------------------------
+	def __call__(self, channel, cmd, data):
+		with self._lock:
+			if self.file is None:
+				return
+			OPC_HEADER.pack_into(self.header, 0, channel, cmd, len(data))
+			self.file.write(self.header)
+			self.file.write(data)
+
+	# ------------------------------------------------------
+	def close(self):
+		with self._lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+
+# ======================================================
+class RawCapture(object):
+	""" memory mapped raw OPC dump, offers the same frames() as recorder.FrameCapture """
+
+	# ------------------------------------------------------
+	def __init__(self, path, fps=60):
+		self._file = open(path, 'rb')
+		self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.view = memoryview(self.data)
+		self.frame_time = 1.0 / fps
+
+	# ------------------------------------------------------
+	def close(self):
+		self.view.release()
+		self.data.close()
+		self._file.close()
+
+	# ------------------------------------------------------
+	def frames(self, start=0.0):
+		"""Yield (seconds, channel, command, data) with data as memoryview into the file.
+
+		A new frame, and so a new point in time, starts with every set pixel
+		message whose channel is not above the channel of the previous one.
+		"""
+		data, size = self.data, len(self.data)
+		pos = 0
+		frame = -1
+		last_channel = 256
+		while pos + OPC_HEADER_SIZE <= size:
+			channel, cmd, length = OPC_HEADER.unpack_from(data, pos)
+			end = pos + OPC_HEADER_SIZE + length
+			if end > size:
+				break
+			if cmd == 0:
+				if channel <= last_channel:
+					frame += 1
+				last_channel = channel
+			seconds = max(0, frame) * self.frame_time
+			if seconds >= start:
+				yield seconds, channel, cmd, self.view[pos+OPC_HEADER_SIZE:end]
+			pos = end
+
+
+# ------------------------------------------------------
+def openCapture(path, fps=60):
+	""" FrameCapture for files written by --record, RawCapture for everything else """
+	with open(path, 'rb') as f:
+		magic = f.read(len(CAPTURE_MAGIC))
+	return FrameCapture(path) if magic == CAPTURE_MAGIC else RawCapture(path, fps)
+
+
+# ======================================================
+class ClientSink(object):
+	""" sends replayed messages with an OPCclient, header and payload without joining them """
+
+	# ------------------------------------------------------
+	def __init__(self, client):
+		self.client = client
+		self.header = bytearray(OPC_HEADER_SIZE)
+
+	# ------------------------------------------------------
+	def __call__(self, channel, cmd, data):
+		if not self.client.connect():
+			return
+		OPC_HEADER.pack_into(self.header, 0, channel, cmd, len(data))
+		self.client.send_buffers([self.header, data])
+
+
+# ======================================================
+class OPCreplay(Thread):
+	"""Plays a capture into a sink(channel, cmd, data).
+
+	speed is a factor of real time, 0 for as fast as possible or None to
+	wait for step() before every frame.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, capture, sink, speed=1.0, start=0.0, loop=False):
+		Thread.__init__(self)
+		self.daemon = True
+		self.capture = capture
+		self.sink = sink
+		self.speed = speed
+		self.start_time = start
+		self.loop = loop
+		self.running = False
+		self.messages = 0
+		self.frames = 0
+		self.bytes = 0
+		self.elapsed = 0.0
+		self._step = Event()
+		self._stopping = Event()
+
+	# ------------------------------------------------------
+	def step(self):
+		self._step.set()
+
+	# ------------------------------------------------------
+	def stop(self):
+		self.running = False
+		self._stopping.set()
+		self._step.set()
+
+	# ------------------------------------------------------
+	def run(self):
+		self.running = True
+		started = time.monotonic()
+		while self.running:
+			first = None
+			last_channel = 256
+			for seconds, channel, cmd, data in self.capture.frames(self.start_time):
+				if not self.running:
+					break
+
+				if cmd == 0 and channel <= last_channel:
+					self.frames += 1
+					if self.speed is None:
+						self._step.wait()
+						self._step.clear()
+				if cmd == 0:
+					last_channel = channel
+
+				if self.speed:
+					if first is None:
+						first, wall = seconds, time.monotonic()
+					delay = wall + (seconds - first) / self.speed - time.monotonic()
+					if delay > 0 and self._stopping.wait(delay):
+						break
+
+				self.sink(channel, cmd, data)
+				self.messages += 1
+				self.bytes += len(data)
+
+			if not self.loop:
+				break
+		self.elapsed = time.monotonic() - started
+		self.running = False
+
+	# ------------------------------------------------------
+	def summary(self):
+		elapsed = max(1e-6, self.elapsed)
+		return "replayed %d frames (%d messages, %d bytes) in %.2f s: %.1f fps, %.1f MB/s" % (
+			self.frames, self.messages, self.bytes, self.elapsed, self.frames / elapsed, self.bytes / elapsed / 1e6)
+
+
+# ------------------------------------------------------
+def parseSpeed(speed):
+	""" 'max' -> 0, 'step' -> None, otherwise a factor of real time """
+	if speed == 'max':
+		return 0
+	if speed == 'step':
+		return None
+	speed = float(speed)
+	if speed <= 0:
+		raise ValueError("speed must be positive, 'max' or 'step'")
+	return speed
+
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Dump and replay OPC streams.', prog='replay.py')
+	commands = parser.add_subparsers(dest='command')
+
+	play = commands.add_parser('play', help='send a dump or capture to an OPC server')
+	play.add_argument('capture', metavar="<file>", help='raw OPC dump or hypersim --record capture')
+	play.add_argument('--to', default='localhost:7890', metavar="<host:port>", help='OPC server (default: localhost:7890)')
+	play.add_argument('--speed', default='1', metavar="<x|max|step>", help='factor of real time, max or step (default: 1)')
+	play.add_argument('--fps', default=60, type=float, metavar="<rate>", help='frame rate of raw dumps (default: 60)')
+	play.add_argument('--start', default=0.0, type=float, metavar="<seconds>", help='start position')
+	play.add_argument('--loop', default=False, action='store_true', help='play forever')
+
+	dump = commands.add_parser('dump', help='logging proxy: write everything received to a raw dump')
+	dump.add_argument('dump', metavar="<file>", help='raw OPC dump to write')
+	dump.add_argument('--listen', default=7891, type=int, metavar="<port>", help='port to receive on (default: 7891)')
+	dump.add_argument('--to', default=None, metavar="<host:port>", help='forward everything to this OPC server')
+
+	args = parser.parse_args()
+	if args.command == 'play':
+		try:
+			speed = parseSpeed(args.speed)
+		except ValueError as e:
+			parser.error(str(e))
+		capture = openCapture(args.capture, args.fps)
+		replay = OPCreplay(capture, ClientSink(OPCclient(args.to)), speed, args.start, args.loop)
+		replay.start()
+		try:
+			if speed is None:
+				print("press enter for the next frame, ctrl+c to stop")
+				while replay.is_alive():
+					sys.stdin.readline()
+					replay.step()
+			else:
+				while replay.is_alive():
+					replay.join(0.5)
+		except KeyboardInterrupt:
+			replay.stop()
+			replay.join()
+		print(replay.summary())
+
+	elif args.command == 'dump':
+		dumper = StreamDumper(args.dump)
+		server = OPCserver(PORT=args.listen)
+		server.addListener(dumper)
+		if args.to is not None:
+			server.addListener(ClientSink(OPCclient(args.to)))
+		server.start()
+		try:
+			while True:
+				time.sleep(1)
+		except KeyboardInterrupt:
+			pass
+		server.stop()
+		dumper.close()
+
+	else:
+		parser.print_help()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+
+class SpatialIndex(object):
+	"""Uniform grid over led rects for hit tests and region queries.
+
+	Every led is stored in all grid cells its rect touches, so a query only
+	looks at the leds of the cells it covers instead of all leds. The cell
+	size follows the average led size, big overlapping rects like hyperion
+	scan areas just end up in more cells.
+
+	Leds later in order, or in led_rects if no order is given, are on top,
+	like canvas items and Rasterizer.
+	"""
+
+	# ------------------------------------------------------
+	def __init__(self, led_rects, order=None, cell_size=None):
+		self.rects = {}
+		for idx, r in enumerate(led_rects):
+			if r is not None:
+				self.rects[idx] = (min(r[0],r[2]), min(r[1],r[3]), max(r[0],r[2]), max(r[1],r[3]))
+		self.rank = dict((idx, rank) for rank, idx in enumerate(range(len(led_rects)) if order is None else order))
+
+		self.cells = {}
+		if not self.rects:
+			self.cell_size = 1
+			return
+
+		if cell_size is None:
+			sizes = [ max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in self.rects.values() ]
+			cell_size = sum(sizes) / float(len(sizes))
+		self.cell_size = max(1, int(math.ceil(cell_size)))
+
+		for idx, (x0, y0, x1, y1) in self.rects.items():
+			for cell in self._cells(x0, y0, x1, y1):
+				self.cells.setdefault(cell, []).append(idx)
+
+	# ------------------------------------------------------
+	def __len__(self):
+		return len(self.rects)
+
+	# ------------------------------------------------------
+	def _cells(self, x0, y0, x1, y1):
+		size = self.cell_size
+		for cy in range(int(y0 // size), int(y1 // size) + 1):
+			for cx in range(int(x0 // size), int(x1 // size) + 1):
+				yield cx, cy
+
+	# ------------------------------------------------------
+	def at(self, x, y):
+		""" the topmost led whose rect contains x, y, None if there is none """
+		size = self.cell_size
+		best = None
+		for idx in self.cells.get((int(x // size), int(y // size)), ()):
+			x0, y0, x1, y1 = self.rects[idx]
+			if x0 <= x <= x1 and y0 <= y <= y1 and (best is None or self.rank[idx] > self.rank[best]):
+				best = idx
+		return best
+
+	# ------------------------------------------------------
+	def region(self, x0, y0, x1, y1):
+		""" sorted ids of all leds whose rect overlaps the region """
+		x0, y0, x1, y1 = min(x0,x1), min(y0,y1), max(x0,x1), max(y0,y1)
+		found = set()
+		if len(self.cells) < (x1 - x0) * (y1 - y0) / float(self.cell_size**2):
+			# region bigger than the grid, e.g. the window around a small layout
+			cells = [ leds for cell, leds in self.cells.items() ]
+		else:
+			cells = [ self.cells.get(cell, ()) for cell in self._cells(x0, y0, x1, y1) ]
+		for leds in cells:
+			for idx in leds:
+				if idx in found:
+					continue
+				r = self.rects[idx]
+				if r[0] <= x1 and r[2] >= x0 and r[1] <= y1 and r[3] >= y0:
+					found.add(idx)
+		return sorted(found)
+
+
+# ------------------------------------------------------
+def idRanges(ids):
+	""" '0-3, 7, 9-12' for sorted led ids """
+	ranges = []
+	for idx in ids:
+		if ranges and ranges[-1][1] == idx - 1:
+			ranges[-1][1] = idx
+		else:
+			ranges.append([idx, idx])
+	return ", ".join( str(a) if a == b else "%d-%d" % (a, b) for a, b in ranges )